@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import print_function
+
+usage = \
+"""
+Compresses the .dat files of raw runs into .zdat files, which Rdata and the
+scripts based on it read transparently in place of the .dat files. The
+compression is lossless; use -c to check this by reading both files back.
+The .dat files are left in place unless -r is given.
+"""
+
+# builtins
+import argparse, os, sys
+
+# argument parsing
+parser = argparse.ArgumentParser(description=usage,formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+# positional
+parser.add_argument('runs', nargs='+', help='runs to compress, e.g. "run045"')
+
+# optional
+parser.add_argument('-z', dest='codec', default='zlib', choices=('zlib','lzma'), help='compression method')
+parser.add_argument('-l', dest='level', type=int, default=6, help='compression level, 0-9')
+parser.add_argument('-t', dest='nthreads', type=int, default=4, help='number of threads to compress with')
+parser.add_argument('-c', dest='check', action='store_true', help='check the compressed file against the original')
+parser.add_argument('-r', dest='remove', action='store_true', help='remove each .dat file once compressed (and checked if -c)')
+
+# OK, done with arguments.
+args = parser.parse_args()
+
+# more imports
+from trm import ultracam
+from trm.ultracam.Zdat import write_zdat, ZdatFile
+
+for run in args.runs:
+    if not os.path.exists(run + '.xml') or not os.path.exists(run + '.dat'):
+        print('ERROR: could not find',run+'.xml','and',run+'.dat')
+        continue
+
+    rhead = ultracam.Rhead(run)
+    nframe = write_zdat(rhead, codec=args.codec, level=args.level, nthreads=args.nthreads)
+    dsize  = os.path.getsize(run + '.dat')
+    zsize  = os.path.getsize(run + '.zdat')
+    print(run,':',nframe,'frames compressed by a factor',round(float(dsize)/max(1,zsize),2))
+
+    if args.check:
+        with open(run + '.dat', 'rb') as dat, ZdatFile(run + '.zdat') as zdat:
+            while True:
+                dbuff = dat.read(rhead.framesize)
+                if len(dbuff) < rhead.framesize:
+                    break
+                if zdat.read(rhead.framesize) != dbuff:
+                    print('ERROR: mismatch in frame',zdat.tell()//rhead.framesize,'of',run)
+                    sys.exit(1)
+        print(run,': check OK')
+
+    if args.remove:
+        os.remove(run + '.dat')
@@ -11,7 +11,9 @@ usage = \
 fcam3d2ucm converts a 3D FITS file from FastCam into ucm files. These will
 be named according to the root of the FastCam file name with a sequence number.
 e.g. abc.fits would produce files of the form 'abc_0001.ucm', 'abc_0002.ucm', 
-etc. The number of digits is 4 by default but can be varied.
+etc. The number of digits is 4 by default but can be varied. Alternatively
+all frames can be written to a single multi-frame container, 'abc.mucm',
+which can be read with trm.ultracam.Mucm.
 """
 
 import argparse
@@ -27,6 +29,8 @@ parser.add_argument('fcam',  help='name of FastCam file')
 # optional
 parser.add_argument('-d', dest='ndigit', type=int,
                     default=4, help='number of digits in file names to store sequence number')
+parser.add_argument('-m', dest='mucm', action='store_true',
+                    help='write all frames to one multi-frame container')
 
 # OK, done with arguments.
 args = parser.parse_args()
@@ -85,6 +89,10 @@ filter = head['FILTER']
 # Offset times to centre of exposures [? check]
 hours += exptime/3600./2.
 
+# all frames have the same format
+writer = ucam.UcmWriter()
+mucm   = None
+
 for n, image in enumerate(data):
     win = ucam.Window(image, llx, lly, xbin, ybin)
     utime = ucam.Time(mjd+hours/24., exptime, True, '')
@@ -109,12 +117,25 @@ for n, image in enumerate(data):
     # Create MCCD 
     mccd = ucam.MCCD([ccd,], head)
 
-    # Write to ucm file
-    oname = ('{0:s}_{1:0' + str(ndigit) + 'd}.ucm').format(fname[:-5], n+1)
-    mccd.wucm(oname)
-
-    if (n+1) % 10 == 0:
-        print('Dumped',oname,'to disk.')
+    if args.mucm:
+        # Write to container, with the time as the only item specific to
+        # each frame
+        if mucm is None:
+            oname = fname[:-5] + '.mucm'
+            mucm  = ucam.MucmWriter(oname, mccd)
+        over = ucam.Uhead()
+        over.add_entry('UT_date',(mjd,hours),ucam.ITYPE_TIME,'MJD at centre of exposure')
+        mucm.append(mccd, over)
+
+        if (n+1) % 10 == 0:
+            print('Dumped',n+1,'frames to',oname)
+    else:
+        # Write to ucm file
+        oname = ('{0:s}_{1:0' + str(ndigit) + 'd}.ucm').format(fname[:-5], n+1)
+        writer.write(mccd, oname)
+
+        if (n+1) % 10 == 0:
+            print('Dumped',oname,'to disk.')
 
     # Shift time to next exposure
     hours += exptime/3600.
@@ -122,4 +143,5 @@ for n, image in enumerate(data):
         hours -= 24.
         mjd += 1
 
-
+if mucm is not None:
+    mucm.close()
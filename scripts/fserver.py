@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import print_function
+
+usage = \
+"""
+Runs a minimal stand-in for the ATC FileServer, serving the runs in a local
+directory. Useful for trying out server-based scripts such as ualert.py and
+talert.py away from the telescope. Set ULTRACAM_DEFAULT_URL to the URL it
+reports.
+"""
+
+# builtins
+import argparse
+
+# mine
+from trm.ultracam.Fserver import Fserver
+
+# argument parsing
+parser = argparse.ArgumentParser(description=usage,formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+# optional
+parser.add_argument('-d', dest='root', default='.', help='directory to serve')
+parser.add_argument('-p', dest='port', type=int, default=8007, help='port to serve on')
+parser.add_argument('-v', dest='verbose', action='store_true', help='log requests')
+
+# OK, done with arguments.
+args = parser.parse_args()
+
+server = Fserver(args.root, args.port, verbose=args.verbose)
+print('Serving',args.root,'at',server.url)
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    server.server_close()
@@ -10,10 +10,13 @@ Plots frames from a raw ULTRACAM file sequentially.
 # just import these for speed. After arguments are OK-ed, some more imports
 import argparse, os
 
+# mine
+from trm import ultracam
+
 parser = argparse.ArgumentParser(description=usage)
 
 # positional
-parser.add_argument('run', help='run to plot, e.g. "run045"')
+parser.add_argument('run', help='run to plot, e.g. "run045", or the URL of a run on a web server')
 
 # optional
 parser.add_argument('-n', dest='nccd', type=int, default=0, help='CCD to plot (0 for all)')
@@ -36,10 +39,13 @@ args = parser.parse_args()
 
 # Check arguments
 run   = args.run
-if not args.ucam and not os.path.exists(run + '.xml'):
+# runs on web servers are read with HTTP Range requests
+remote = run.startswith('http://') or run.startswith('https://')
+if not args.ucam and not remote and not os.path.exists(run + '.xml'):
     print('ERROR: could not find',run+'.xml')
     exit(1)
-if not args.ucam and not os.path.exists(run + '.dat'):
+# the data can also be compressed (see open_dat)
+if not args.ucam and not remote and not ultracam.dat_exists(run):
     print('ERROR: could not find',run+'.dat')
     exit(1)
 
@@ -66,7 +72,6 @@ if phi < 0. or phi > 100.:
 
 # more imports
 import time, copy
-from trm import ultracam
 from ppgplot import *
 
 if args.bias:
@@ -99,6 +104,8 @@ if rdat.instrument == 'ULTRACAM':
             if first and bias != mccd:
                 try:
                     bias = bias.cropTo(mccd)
+                    # contiguous, so that subtraction acts on whole CCDs at once
+                    bias.pack()
                 except ultracam.UltracamError as err:
                     print('UltracamError:',err)
                     print('Bias format:\n',bias.format())
@@ -133,6 +140,8 @@ elif rdat.instrument == 'ULTRASPEC':
             if first and bias != ccd:
                 try:
                     bias = bias.cropTo(ccd)
+                    # contiguous, so that subtraction acts on whole CCDs at once
+                    bias.pack()
                 except ultracam.UltracamError as err:
                     print('UltracamError:',err)
                     print('Bias format:\n',bias.format())
@@ -144,7 +153,7 @@ elif rdat.instrument == 'ULTRASPEC':
         if args.back:
             ccd.rback(nccd)
 
-        vmin, vmax = ccd.centile((plo,phi))
+        vmin, vmax = ccd.centile((plo,phi), approx=True)
 
         ccd.plot(vmin,vmax)
         print('Plotted',ccd.head.value('Run.run'),'frame',ccd.head.value('Frame.frame'),'plot range:',vmin,'to',vmax)
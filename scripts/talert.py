@@ -2,7 +2,6 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
-from six.moves import range
 from six.moves import urllib
 
 usage = \
@@ -30,114 +29,82 @@ parser = argparse.ArgumentParser(description=usage,formatter_class=argparse.Argu
 parser.add_argument('-t', dest='tmax', type=int, default=30,
                     help='maximum time before warning of no new frame (secs)')
 parser.add_argument('-w', dest='wait', type=int, default=10,
-                    help='number of seconds wait between updates')
+                    help='maximum number of seconds wait between updates')
 parser.add_argument('-f', dest='fmax', type=float, default=0.1,
                     help='Maximum fractional deviation in interval')
 parser.add_argument('-n', dest='nmin', type=int, default=10,
                     help='Minimum number of frames to accumulate before reporting problems')
 parser.add_argument('-b', dest='bmax', type=int, default=0,
-                    help='Maximum number of times to read before pausing, 0 to ignore')
+                    help='Maximum number of times to read per poll, 0 to ignore')
 
 # OK, done with arguments.
 args = parser.parse_args()
 
-# these indicate the most recently read run, frame, and the last time
-# anything changed
+# these indicate the most recently read run, the last time anything changed
+# and the last time frames were reported as OK
 lastRun    = None
-lastNframe = None
 lastNew    = time.time()
+lastReport = lastNew
 
 print("""
-Time alert script started. Will poll once every {0:d}
+Time alert script started. Will poll at most every {0:d}
 seconds and will warn of no change after {1:d} seconds.
 It reads every frame of the most recent run looking for
 times that do not occur at close to the median interval
 after the previous one.
 """.format(args.wait,args.tmax))
 
-while True:
+def report(err):
+    """
+    Reports problems accessing the server
+    """
+    uttime = time.asctime(time.gmtime())
+    if isinstance(err, urllib.error.URLError):
+        print(uttime + ': ' + str(err) + '; have you started the ATC FileServer?')
+    else:
+        print(uttime + ': ' + str(err))
+
+# follow the times of the newest run, frame by frame
+for run, nf, tinfo in ultracam.follow(server=True, times=True, nbatch=args.bmax,
+                                      pmax=args.wait, tick=args.wait, onerror=report):
 
     # get a couple of times just once
     uttime  = time.asctime(time.gmtime())
     tstamp  = time.time()
 
-    # get list of runs from the FileServer
-    try:
-        runs = ultracam.get_runs_from_server()
-
-        if len(runs):
-
-            # Check whether the final run has changed
-            currentRun = runs[-1]
-
-            # skip poweron/offs
-            rhead = ultracam.Rhead(currentRun, server=True)
-            if rhead.isPonoff(): continue
-
-            newrun     = currentRun != lastRun
-            lastRun    = currentRun
-
-            # Check whether the number of frames has changed
-            nframe      = ultracam.get_nframe_from_server(currentRun)
-            newframe    = newrun or nframe != lastNframe
-            lastNframe  = nframe
-
-            # Update last time anything was new
-            lastNew = tstamp if newframe else lastNew
-
-            # Issue alert if nothing seems to be happening
-            if tstamp - lastNew >= args.tmax:
-                print(uttime + ': >>>>>>> WARNING: Nothing has changed for ' + \
-                    str(int(tstamp-lastNew)) + ' seconds! <<<<<<<<')
-
-            # update the Rdata object if the run has changed
-            if newrun:
-                tdat  = ultracam.Rtime(currentRun,server=True)
-                frame = 0
-                # use this to accumulate time intervals
-                diffs = []
-
-            if args.bmax:
-                nmax = min(nframe, frame+args.bmax)
-            else:
-                nmax = nframe
-
-           # Read the times of the frame up to the current frame
-            if nmax > frame:
-                for nf in range(frame+1,nmax+1):
-                    mjd = tdat(nf)[1]['gps']
-                    if nf > 1:
-                        diffs.append(86400.*(mjd-mjdold))
-                    mjdold = mjd
-
-                if len(diffs) > args.nmin:
-                    # only start checking when we have a few in the bag
-                    adiffs = np.array(diffs)
-                    mdiff  = np.median(adiffs)
-
-                    devs   = np.abs(adiffs[frame:] - mdiff)
-                    bad    = devs > args.fmax*mdiff
-                    if len(devs[bad]):
-                        for nb, ng in enumerate(bad):
-                            if ng:
-                                print('WARNING: run ' + str(currentRun) + ', frame',\
-                                    frame+nb+2,'occurred',adiffs[frame+nb],\
-                                    'secs after previous cf median =',mdiff)
-                    else:
-                        print('Run ' + str(currentRun) + ', frames',frame+1,'to',\
-                            nmax,'have OK times.')
-
-                frame = nmax
-
-        else:
-            if tstamp - lastNew > args.tmax:
-                print(uttime + ': >>>>>>> WARNING: Nothing has changed for ' + \
-                    str(int(tstamp-lastNew)) + ' seconds! <<<<<<<<')
-
-    except urllib.error.URLError as err:
-        print(uttime + ': ' + str(err) + '; have you started the ATC FileServer?')
-    except ultracam.UltracamError as err:
-        print(uttime + ': ' + str(err))
-
-    # now wait before polling the server again
-    time.sleep(args.wait)
+    if nf is None:
+        # Issue alert if nothing seems to be happening
+        if tstamp - lastNew >= args.tmax:
+            print(uttime + ': >>>>>>> WARNING: Nothing has changed for ' + \
+                str(int(tstamp-lastNew)) + ' seconds! <<<<<<<<')
+        continue
+
+    lastNew = tstamp
+
+    # reset when the run changes
+    if run != lastRun:
+        lastRun = run
+        # use this to accumulate time intervals
+        diffs  = []
+        mdiff  = None
+        fok    = 1
+
+    mjd = tinfo[1]['gps']
+    if nf > 1:
+        diffs.append(86400.*(mjd-mjdold))
+    mjdold = mjd
+
+    if len(diffs) > args.nmin:
+        # only start checking when we have a few in the bag. The median is
+        # only updated every nmin frames to keep the cost per frame down
+        if mdiff is None or len(diffs) % args.nmin == 0:
+            mdiff = np.median(diffs)
+        if abs(diffs[-1] - mdiff) > args.fmax*mdiff:
+            print('WARNING: run ' + str(run) + ', frame', nf, 'occurred', diffs[-1],\
+                'secs after previous cf median =', mdiff)
+            fok = nf + 1
+
+        elif tstamp - lastReport >= args.wait:
+            print('Run ' + str(run) + ', frames', fok, 'to', nf, 'have OK times.')
+            lastReport = tstamp
+            fok = nf + 1
@@ -18,10 +18,13 @@ raw ULTRACAM files.
 # just import these for speed. After arguments are OK-ed, some more imports
 import argparse, os
 
+# mine
+from trm import ultracam
+
 parser = argparse.ArgumentParser(description=usage)
 
 # positional
-parser.add_argument('run', help='run to plot, e.g. "run045"')
+parser.add_argument('run', help='run to plot, e.g. "run045", or the URL of a run on a web server')
 
 # optional
 parser.add_argument('-n', dest='nccd', type=int, default=0,
@@ -48,10 +51,13 @@ args = parser.parse_args()
 
 # Check arguments
 run   = args.run
-if not args.ucam and not os.path.exists(run + '.xml'):
+# runs on web servers are read with HTTP Range requests
+remote = run.startswith('http://') or run.startswith('https://')
+if not args.ucam and not remote and not os.path.exists(run + '.xml'):
     print('ERROR: could not find',run+'.xml')
     exit(1)
-if not args.ucam and not os.path.exists(run + '.dat'):
+# the data can also be compressed (see open_dat)
+if not args.ucam and not remote and not ultracam.dat_exists(run):
     print('ERROR: could not find',run+'.dat')
     exit(1)
 
@@ -66,7 +72,6 @@ try:
     import astropy.io.fits as fits
 except:
     import pyfits as fits
-from trm import ultracam
 
 if args.bias:
     bias = ultracam.MCCD.rucm(args.bias)
@@ -209,6 +214,8 @@ for mccd in rdat:
         if first and bias != mccd:
             try:
                 bias = bias.cropTo(mccd)
+                # contiguous, so that subtraction acts on whole CCDs at once
+                bias.pack()
             except ultracam.UltracamError as err:
                 print('UltracamError:',err)
                 print('Bias format:\n',bias.format())
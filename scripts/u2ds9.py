@@ -26,10 +26,13 @@ if __name__ == '__main__':
     # just import these for speed. After arguments are OK-ed, some more imports
     import argparse, os
 
+    # mine
+    from trm import ultracam
+
     parser = argparse.ArgumentParser(description=usage)
 
     # positional
-    parser.add_argument('run', help='run to plot, e.g. "run045"')
+    parser.add_argument('run', help='run to plot, e.g. "run045", or the URL of a run on a web server')
 
     # optional
     parser.add_argument('-n', dest='nccd', type=int, help='CCD to plot')
@@ -53,7 +56,9 @@ if __name__ == '__main__':
             print('ERROR: first frame must be >= 0')
             exit(1)
 
-    elif os.path.exists(run + '.xml') and os.path.exists(run + '.dat'):
+    elif run.startswith('http://') or run.startswith('https://') or \
+            (os.path.exists(run + '.xml') and ultracam.dat_exists(run)):
+        # runs on web servers are read with HTTP Range requests
         nframe = args.frame
         if nframe < 0:
             print('ERROR: first frame must be >= 0')
@@ -82,7 +87,6 @@ if __name__ == '__main__':
     import time, copy, tempfile
     import numpy as np
     from astropy.io import fits
-    from trm import ultracam
 
     # Load bias
     if args.bias:
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import print_function
+
+usage = \
+"""
+Combines the frames of a run into a single frame, e.g. to make a master bias,
+dark or flat field, saving the result as a ucm file. The combination is done
+pixel by pixel across the frames using the mean, median, a sigma-clipped
+mean or a mean after rejecting the highest and lowest values. Frames are
+stored in a scratch file while being read, so runs of any length can be
+combined within limited memory. A frame of the uncertainty of each combined
+pixel can be saved as well.
+"""
+
+# builtins
+import argparse, sys
+
+# argument parsing
+parser = argparse.ArgumentParser(description=usage,formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+# positional
+parser.add_argument('run', help='run to combine, e.g. "run045"')
+parser.add_argument('output', help='ucm file to save the combined frame to')
+
+# optional
+parser.add_argument('-m', dest='method', default='median', choices=('mean','median','clipped','minmax'),
+                    help='combination method')
+parser.add_argument('-f', dest='first', type=int, default=1, help='first frame to combine')
+parser.add_argument('-l', dest='last', type=int, default=0, help='last frame to combine, 0 for the last')
+parser.add_argument('-b', dest='bias', help='bias frame to subtract from each frame (ucm file)')
+parser.add_argument('-n', dest='norm', action='store_true', help='normalise each CCD of each frame by its median')
+parser.add_argument('-s', dest='nsigma', type=float, default=3., help='rejection threshold, RMS, for the clipped mean')
+parser.add_argument('-r', dest='nreject', type=int, default=1,
+                    help='number of highest and of lowest values to reject from each pixel for minmax')
+parser.add_argument('-e', dest='noise', help='ucm file to save the uncertainties to')
+parser.add_argument('-t', dest='nthreads', type=int, default=4, help='number of threads to combine with')
+parser.add_argument('-M', dest='maxmem', type=int, default=256, help='memory to use for combining, MB')
+parser.add_argument('-S', dest='server', action='store_true', help='read the run from the FileServer')
+
+# OK, done with arguments.
+args = parser.parse_args()
+
+# more imports
+from trm import ultracam
+
+try:
+    bias = ultracam.MCCD.rucm(args.bias) if args.bias else None
+    comb, noise = ultracam.combine(args.run, args.method, args.first, args.last, bias, args.norm,
+                                   args.nsigma, args.nreject, args.maxmem, args.nthreads, args.server)
+except ultracam.UltracamError as err:
+    print('UltracamError:',err)
+    sys.exit(1)
+except IOError as err:
+    print('IOError:',err)
+    sys.exit(1)
+
+comb.wucm(args.output)
+print('Combined',comb.head.value('Combine.nframe'),'frames of',args.run,'into',args.output)
+if args.noise:
+    noise.wucm(args.noise)
+    print('Saved uncertainties to',args.noise)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import print_function
+
+usage = \
+"""
+Follows runs during observing, reading and decoding each frame once, and
+publishes the frames into a ring buffer in shared memory from which any
+number of local programs can read them, rather than each one polling the
+FileServer and decoding the same frames itself. Programs read the ring with
+trm.ultracam.RingReader (e.g. 'ualert.py -r ultracam'). Each entry is a
+tuple of (run, frame number, frame). The ring holds the most recent frames
+only; programs that fall behind skip frames and never hold up the reading.
+"""
+
+# builtins
+import argparse, time
+
+# argument parsing
+parser = argparse.ArgumentParser(description=usage,formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+# optional
+parser.add_argument('-r', dest='run', help='run to follow, e.g. "run045"; default is the newest, switching as new runs start')
+parser.add_argument('-n', dest='name', default='ultracam', help='name of the ring, used by programs to read it')
+parser.add_argument('-N', dest='nslot', type=int, default=16, help='number of frames held in the ring')
+parser.add_argument('-m', dest='slotsize', type=int, default=32, help='maximum size of a frame, MB')
+parser.add_argument('-p', dest='path', default='.', help='directory of runs for local disk access')
+parser.add_argument('-f', dest='flt', action='store_true', help='publish frames as floats rather than 2-byte ints')
+parser.add_argument('-l', dest='latest', action='store_true', help='read only the latest frame each cycle')
+parser.add_argument('-s', dest='server', action='store_true', help='read from the FileServer rather than local disk')
+parser.add_argument('-w', dest='wait', type=float, default=5., help='maximum number of seconds between polls')
+
+# OK, done with arguments.
+args = parser.parse_args()
+
+# more imports
+from trm import ultracam
+
+def report(err):
+    """
+    Reports problems accessing the data
+    """
+    print(time.asctime(time.gmtime()) + ': ' + str(err))
+
+writer = ultracam.RingWriter(args.name, args.nslot, 1024*1024*args.slotsize)
+print('Publishing frames to ring "' + args.name + '" of',args.nslot,'slots of',args.slotsize,'MB')
+try:
+    for run, nframe, mccd in ultracam.follow(args.run, args.server, args.path, flt=args.flt,
+                                             latest=args.latest, pmax=args.wait, onerror=report):
+        try:
+            writer.put((run, nframe, mccd))
+        except ultracam.UltracamError as err:
+            report(err)
+            continue
+        if writer.nwrite % 100 == 0:
+            print(time.asctime(time.gmtime()) + ': published',writer.nwrite,'frames; now on',run,'frame',nframe)
+except KeyboardInterrupt:
+    print('\nStopped after publishing',writer.nwrite,'frames')
+finally:
+    writer.close()
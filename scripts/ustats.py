@@ -172,21 +172,21 @@ for rpath, rnames, fnames in os.walk(raw):
 
                     for ccd in mccd:
                         npix = ccd.npix()
-                        # treat left and right sides separately
-                        larr, rarr = [], []
+                        # treat left and right sides separately, accumulating
+                        # histograms of the values from which all the
+                        # statistics follow
+                        hl, hr = ultracam.Hstats(), ultracam.Hstats()
                         for winl, winr in zip(ccd[::2],ccd[1::2]):
-                            larr.append(winl.flatten())
-                            rarr.append(winr.flatten())
-                        larr = np.concatenate(larr)
-                        rarr = np.concatenate(rarr)
-
-                        minl.append(larr.min())
-                        maxl.append(larr.max())
-                        minr.append(rarr.min())
-                        maxr.append(rarr.max())
-                        meanl.append(larr.mean())
-                        meanr.append(rarr.mean())
-                        p01,p1,p5,med,p95,p99,p999 = np.percentile(larr,(0.1,1.,5.,50.,95.,99.,99.9))
+                            hl.add(winl.data)
+                            hr.add(winr.data)
+
+                        minl.append(hl.min())
+                        maxl.append(hl.max())
+                        minr.append(hr.min())
+                        maxr.append(hr.max())
+                        meanl.append(hl.mean())
+                        meanr.append(hr.mean())
+                        p01,p1,p5,med,p95,p99,p999 = hl.centile((0.1,1.,5.,50.,95.,99.,99.9))
                         p01l.append(p01)
                         p1l.append(p1)
                         p5l.append(p5)
@@ -194,7 +194,7 @@ for rpath, rnames, fnames in os.walk(raw):
                         p95l.append(p95)
                         p99l.append(p99)                        
                         p999l.append(p999)                        
-                        p01,p1,p5,med,p95,p99,p999 = np.percentile(rarr,(0.1,1.,5.,50.,95.,99.,99.9))
+                        p01,p1,p5,med,p95,p99,p999 = hr.centile((0.1,1.,5.,50.,95.,99.,99.9))
                         p01r.append(p01)
                         p1r.append(p1)
                         p5r.append(p5)
@@ -206,15 +206,11 @@ for rpath, rnames, fnames in os.walk(raw):
                         exp.append(ccd.time.expose)
                         flag.append(ccd.time.good)
                         
-                        hist = np.bincount(larr)
-                        imax = np.argmax(hist)
-                        nmax = hist[imax]
+                        imax, nmax = hl.mode()
                         model.append(imax)
                         nmodel.append(nmax)
 
-                        hist = np.bincount(rarr)
-                        imax = np.argmax(hist)
-                        nmax = hist[imax]
+                        imax, nmax = hr.mode()
                         moder.append(imax)
                         nmoder.append(nmax)
 
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+from __future__ import absolute_import
+from __future__ import print_function
+
+usage = \
+"""
+Transposes a run into a file of pixel time series, in which the values of
+each pixel over all frames are stored together, so that the light curve of
+any pixel, or of a small region, can be read in one go rather than by
+reading the whole run (see trm.ultracam.Tseries). Windows are stored in
+tiles; regions lying within a tile are read with a single read. The frames
+are read once and transposed via a scratch file in limited memory, so runs
+of any length can be transposed.
+"""
+
+# builtins
+import argparse, sys
+
+# argument parsing
+parser = argparse.ArgumentParser(description=usage,formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+# positional
+parser.add_argument('run', help='run to transpose, e.g. "run045"')
+parser.add_argument('output', help='time-series file to write')
+
+# optional
+parser.add_argument('-c', dest='ccds', type=int, nargs='+', help='CCDs to include (from 1); default all')
+parser.add_argument('-w', dest='wins', type=int, nargs='+', help='windows of each CCD to include (from 1); default all')
+parser.add_argument('-f', dest='first', type=int, default=1, help='first frame to include')
+parser.add_argument('-l', dest='last', type=int, default=0, help='last frame to include, 0 for the last')
+parser.add_argument('-T', dest='tile', type=int, nargs=2, default=(16,16), help='size of tiles, ny nx')
+parser.add_argument('-F', dest='flt', action='store_true', help='store floats rather than 2-byte ints')
+parser.add_argument('-t', dest='nthreads', type=int, default=4, help='number of threads to transpose with')
+parser.add_argument('-M', dest='maxmem', type=int, default=256, help='memory to use for transposing, MB')
+parser.add_argument('-S', dest='server', action='store_true', help='read the run from the FileServer')
+
+# OK, done with arguments.
+args = parser.parse_args()
+
+# more imports
+from trm import ultracam
+
+try:
+    wins = None
+    if args.ccds or args.wins:
+        # each CCD has the windows of the run's header
+        rhead = ultracam.Rhead(args.run, server=args.server)
+        ccds  = args.ccds if args.ccds else range(1, 4 if rhead.instrument == 'ULTRACAM' else 2)
+        nwins = args.wins if args.wins else range(1, len(rhead.win)+1)
+        wins  = [(nc-1, nw-1) for nc in ccds for nw in nwins]
+    nframe = ultracam.write_tseries(args.run, args.output, wins, args.first, args.last, tuple(args.tile),
+                                    args.flt, args.maxmem, args.nthreads, args.server)
+except ultracam.UltracamError as err:
+    print('UltracamError:',err)
+    sys.exit(1)
+
+print('Transposed',nframe,'frames of',args.run,'into',args.output)
@@ -18,7 +18,9 @@ setup(name='trm.ultracam',
                'scripts/to3dfits.py', 'scripts/utimes.py', 'scripts/ualert.py',
                'scripts/uspchecker.py', 'scripts/uspfix.py', 'scripts/ustats.py',
                'scripts/u2ds9.py', 'scripts/tchecker.py', 'scripts/talert.py',
-               'scripts/tnofcorr.py'],
+               'scripts/tnofcorr.py', 'scripts/fserver.py', 'scripts/dat2zdat.py',
+               'scripts/ucombine.py', 'scripts/ufanout.py',
+               'scripts/utseries.py'],
 
       author='Tom Marsh',
       description="Python module for accessing ULTRACAM files",
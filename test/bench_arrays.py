@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Benchmark of reading a small-window run frame by frame, as for high-speed
+work, comparing Rdata (MCCD objects with headers) with Rdata.iter_arrays
+(bare arrays and times) and with reading the raw frames alone, which sets
+the limit. A fake ULTRACAM run with one pair of windows is written to a
+temporary directory, so the file is most likely read from the page cache.
+
+Run as: python test/bench_arrays.py [nframe [nx [ny]]]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from trm import ultracam
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from test_ultracam import make_run
+
+def rate(func):
+    """
+    Returns (frames read, seconds taken) of func()
+    """
+    t1 = time.time()
+    nframe = func()
+    return (nframe, time.time()-t1)
+
+def raw(run):
+    rdat = ultracam.Rdata(run)
+    for nf in range(1, rdat.ntotal()+1):
+        rdat._fobj.read_frame(nf)
+    return rdat.ntotal()
+
+def objects(run):
+    return sum(1 for mccd in ultracam.Rdata(run, flt=False))
+
+def arrays(run):
+    return sum(1 for frame in ultracam.Rdata(run, flt=False).iter_arrays())
+
+if __name__ == '__main__':
+    nframe = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    nx     = int(sys.argv[2]) if len(sys.argv) > 2 else 24
+    ny     = int(sys.argv[3]) if len(sys.argv) > 3 else 24
+    tdir   = tempfile.mkdtemp()
+    try:
+        run = os.path.join(tdir, 'run001')
+        framesize = make_run(run, nframe, nx, ny)
+        print('{0:d} frames of 3 CCDs x 2 windows of {1:d}x{2:d}, {3:d} bytes/frame'.format(
+            nframe, nx, ny, framesize))
+        for name, func in (('raw reads', raw), ('Rdata', objects), ('iter_arrays', arrays)):
+            n, secs = rate(lambda: func(run))
+            print('  {0:12s}: {1:9.0f} frames/s, {2:7.1f} MB/s'.format(
+                name, n/secs, n*framesize/secs/1.e6))
+    finally:
+        shutil.rmtree(tdir)
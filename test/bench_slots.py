@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Benchmark of the per-frame object overhead of Window, Time and CCD, which
+use __slots__, against equivalents with a per-instance __dict__. Each
+"frame" is three CCDs of six Windows each with its own Time, as for
+ULTRACAM; all Windows share one small data array so that only the objects
+themselves are measured.
+
+Run as: python test/bench_slots.py [nframe]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import sys
+import gc
+import time
+import tracemalloc
+
+import numpy as np
+from trm import ultracam
+
+# equivalents with a __dict__: subclasses which do not define __slots__
+class DictWindow(ultracam.Window):
+    pass
+
+class DictTime(ultracam.Time):
+    pass
+
+class DictCCD(ultracam.CCD):
+    pass
+
+DATA = np.zeros((4,4), np.float32)
+
+def frame(wcls, tcls, ccls):
+    ccds = []
+    for nc in range(3):
+        wins = [wcls(DATA, 1+100*nw, 1, 1, 1) for nw in range(6)]
+        ccds.append(ccls(wins, tcls(56000.1, 1., True, ''), 1080, 1032, True, None))
+    return ccds
+
+def measure(nframe, wcls, tcls, ccls):
+    """
+    Returns (bytes per frame, microseconds per frame) of keeping nframe frames
+    """
+    gc.collect()
+    tracemalloc.start()
+    t1 = time.time()
+    frames = [frame(wcls, tcls, ccls) for n in range(nframe)]
+    t2 = time.time()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del frames
+    return (size/nframe, 1.e6*(t2-t1)/nframe)
+
+if __name__ == '__main__':
+    nframe = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    sbytes, stime = measure(nframe, ultracam.Window, ultracam.Time, ultracam.CCD)
+    dbytes, dtime = measure(nframe, DictWindow, DictTime, DictCCD)
+    print('Frames of 3 CCDs x 6 Windows, {0:d} frames kept'.format(nframe))
+    print('  __slots__ : {0:8.0f} bytes/frame, {1:6.1f} us/frame'.format(sbytes, stime))
+    print('  __dict__  : {0:8.0f} bytes/frame, {1:6.1f} us/frame'.format(dbytes, dtime))
+    print('  saving    : {0:8.0f} bytes/frame ({1:.0f}%)'.format(dbytes-sbytes, 100.*(dbytes-sbytes)/dbytes))
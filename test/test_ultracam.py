@@ -5,7 +5,13 @@ Run with 'python test_ultracam.py'
 """
 from __future__ import absolute_import
 
+import os
+import copy
+import pickle
+import struct
 import unittest
+import tempfile
+import shutil
 import numpy as np
 with_pg = True
 try:
@@ -14,6 +20,54 @@ except:
     print('No ppgplot - not testing plotting')
     with_pg = False
 from   trm import ultracam
+from   trm.ultracam.Fserver import Fserver, FileServerHandler
+
+# Minimal xml for an ULTRACAM 1-pair run, enough to satisfy Rhead
+RUN_XML = """<?xml version="1.0"?>
+<datatop>
+ <data_status framesize="{framesize}">
+  <header_status headerwords="16"/>
+ </data_status>
+ <instrument_status>
+  <name>Ultracam</name>
+  <application_status id="SDSU Exec" name="appl5_window1pair_cfg"/>
+{params}
+ </instrument_status>
+ <user>
+  <target>IP Peg</target>
+  <revision>140331</revision>
+ </user>
+</datatop>
+"""
+
+def frame_bytes(nf, nx=8, ny=6, expose=1000):
+    """
+    Returns the bytes of frame nf of a fake ULTRACAM run (format 2 timing)
+    """
+    tbytes = struct.pack('<4sIIII', 4*b'\0', nf, expose, 1400000000+nf, 0) + \
+             4*b'\0' + struct.pack('<H', ultracam.PCPS_SYNCD) + 6*b'\0'
+    data = (1000 + 10*nf + np.arange(6*nx*ny)).astype('<u2')
+    return tbytes + data.tobytes()
+
+def make_run(run, nframe, nx=8, ny=6, expose=1000):
+    """
+    Writes xml and dat files of a fake ULTRACAM run with 1 pair of
+    nx by ny windows and nframe frames. Returns the framesize.
+    """
+    params = {'X_BIN_FAC' : 1, 'Y_BIN_FAC' : 1, 'EXPOSE_TIME' : expose,
+              'NO_EXPOSURES' : 0, 'GAIN_SPEED' : 0xcdd, 'V_FT_CLK' : 0,
+              'NBLUE' : 1, 'Y1_START' : 101, 'X1L_START' : 101,
+              'X1R_START' : 601, 'X1_SIZE' : nx, 'Y1_SIZE' : ny,
+              'REVISION' : 140331}
+    framesize = 32 + 12*nx*ny
+    with open(run + '.xml', 'w') as fobj:
+        fobj.write(RUN_XML.format(framesize=framesize, params='\n'.join(
+            '  <parameter_status name="{0}" value="{1}"/>'.format(k,v)
+            for k,v in params.items())))
+    with open(run + '.dat', 'wb') as fobj:
+        for nf in range(1,nframe+1):
+            fobj.write(frame_bytes(nf, nx, ny, expose))
+    return framesize
 
 class TestWindow(unittest.TestCase):
 
@@ -140,9 +194,849 @@ class TestCCD(unittest.TestCase):
             return True
         self.assertTrue(ok())
 
+    def test_pack(self):
+        med  = self.ccd.median()
+        win0 = self.ccd[0].data
+        buff = self.ccd.pack()
+        self.assertTrue(self.ccd.buffer is buff)
+        self.assertEqual(len(buff), self.ccd.npix())
+        self.assertTrue(np.shares_memory(self.ccd[1].data, buff))
+        self.assertTrue((self.ccd[0].data == win0).all())
+        self.assertEqual(self.ccd.median(), med)
+        self.assertEqual(self.ccd.max(), 15.)
+
+        # in-place arithematic keeps the storage, trimming a Window ends it
+        self.ccd[1] += 10.
+        self.assertEqual(buff.max(), 25.)
+        self.assertTrue(self.ccd.buffer is buff)
+        self.ccd[0].trim(1,1,1,1)
+        self.assertTrue(self.ccd.buffer is None)
+        self.assertEqual(self.ccd.npix(), 8*18+200)
+
+    def test_arith(self):
+        other = self.ccd + 1.
+        diff  = self.ccd - other
+        self.assertEqual((diff.min(), diff.max()), (-1., -1.))
+        self.ccd.pack()
+        other.pack()
+        diff = self.ccd - other
+        self.assertTrue(diff.buffer is not None)
+        self.assertEqual((diff.min(), diff.max()), (-1., -1.))
+        self.assertEqual((2. - self.ccd)[1][0,0], -13.)
+
+        # out= and in-place, which keep the storage
+        buff = other.buffer
+        self.ccd.mul(2., out=other)
+        self.assertTrue(other.buffer is buff)
+        self.assertEqual(other[1][0,0], 30.)
+        self.ccd -= other
+        self.assertEqual(self.ccd[0][0,0], -5.)
+
+    def test_crop(self):
+        win1 = ultracam.Window(self.ccd[0].data[2:6,3:9], 18, 28, 2, 3)
+        win2 = ultracam.Window(self.ccd[1].data[1:,:-1], 120, 223, 2, 3)
+        small = ultracam.CCD([win2,win1], None, 900, 800, True, None)
+        self.assertTrue(self.ccd.canCropTo(small))
+        self.assertFalse(small.canCropTo(self.ccd))
+        self.assertEqual(hash(small.fsig), hash(ultracam.CCD([win2,win1], None, 900, 800, True, None).fsig))
+
+        crop = self.ccd.cropTo(small)
+        self.assertEqual(crop, small)
+        self.assertTrue((crop[1].data == win1.data).all())
+        self.assertTrue((self.ccd.fsig, small.fsig) in ultracam.CROP_PLANS)
+        self.assertRaises(ultracam.UltracamError, small.cropTo, self.ccd)
+
+        # the signature follows changes of format of a packed CCD
+        small.pack()
+        fsig = small.fsig
+        small[0].llx += 2
+        self.assertNotEqual(small.fsig, fsig)
+        small.nymax = 1000
+        self.assertEqual(small.fsig[1], 1000)
+
+    def test_promote(self):
+        wins = [ultracam.Window(np.ones((4,5), np.uint16), 1, 1, 1, 1)]
+        ccd  = ultracam.CCD(wins, None, 10, 10, True, None)
+        ccd.pack()
+        ccd /= 2
+        self.assertEqual(ccd[0].dtype, np.float32)
+        self.assertEqual(ccd.buffer.dtype, np.float32)
+        self.assertEqual(ccd.max(), 0.5)
+
+    def test_pickle(self):
+        self.ccd.pack()
+        for ccd in (pickle.loads(pickle.dumps(self.ccd, pickle.HIGHEST_PROTOCOL)),
+                    copy.deepcopy(self.ccd)):
+            self.assertTrue(ccd == self.ccd)
+            self.assertTrue(ccd.buffer is not None)
+            self.assertTrue((ccd.buffer == self.ccd.buffer).all())
+            self.assertEqual(ccd.time.mjd, self.ccd.time.mjd)
+            self.assertFalse(hasattr(ccd[0], '__dict__'))
+
+    def test_old_pickle(self):
+        # pickles made before __slots__ were used hold a __dict__ as state
+        from six.moves import copyreg
+
+        class Old(object):
+            def __init__(self, cls, state):
+                self.cls, self.state = cls, state
+            def __reduce__(self):
+                return (copyreg._reconstructor, (self.cls, object, None), self.state)
+
+        win  = self.ccd[0]
+        wins = [Old(ultracam.Window, {'_data' : w.data, 'llx' : w.llx, 'lly' : w.lly,
+                                      'xbin' : w.xbin, 'ybin' : w.ybin}) for w in self.ccd]
+        time = Old(ultracam.Time, {'mjd' : 55000.5, 'expose' : 10., 'good' : True, 'reason' : ''})
+        ccd  = Old(ultracam.CCD, {'_data' : wins, 'time' : time, 'nxmax' : self.ccd.nxmax,
+                                  'nymax' : self.ccd.nymax, 'good' : True, 'head' : None})
+        rwin = Old(ultracam.Rwin, (None, {'llx' : 1, 'lly' : 2, 'nx' : 3, 'ny' : 4}))
+        for proto in (0, pickle.HIGHEST_PROTOCOL):
+            new, rnew = pickle.loads(pickle.dumps((ccd, rwin), proto))
+            self.assertTrue(new == self.ccd)
+            self.assertEqual((new[0].llx, new[0].ybin), (win.llx, win.ybin))
+            self.assertTrue((new[0].data == win.data).all())
+            self.assertEqual((new.time.mjd, new.time.expose), (55000.5, 10.))
+            self.assertTrue(new.buffer is None)
+            self.assertEqual((rnew.llx, rnew.lly, rnew.nx, rnew.ny), (1, 2, 3, 4))
+
+class TestRdata(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.run  = os.path.join(self.tdir,'run001')
+        make_run(self.run, 6)
+        self.frames = [mccd for mccd in ultracam.Rdata(self.run)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def test_cursor(self):
+        import threading
+        rdat = ultracam.Rdata(self.run)
+        self.assertEqual(rdat.ntotal(), 6)
+        results = {}
+        def read(n):
+            # times depend on preceding frames, so each cursor has its own
+            results[n] = [mccd for mccd in rdat.cursor()]
+        threads = [threading.Thread(target=read, args=(n,)) for n in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for frames in results.values():
+            self.assertEqual(len(frames), 6)
+            for mccd, check in zip(frames, self.frames):
+                self.assertTrue((mccd[1].buffer == check[1].buffer).all())
+                self.assertEqual(mccd[0].time.mjd, check[0].time.mjd)
+        self.assertEqual(rdat.nframe(), 1)
+        self.assertTrue((rdat(0)[2].buffer == self.frames[-1][2].buffer).all())
+
+    def test_iter_arrays(self):
+        # times depend on preceding frames, so these are read from the start
+        frames = list(ultracam.Rdata(self.run, flt=False).iter_arrays())
+        self.assertEqual([nf for nf, times, arrays in frames], [1,2,3,4,5,6])
+        for (nf, times, arrays), check in zip(frames, self.frames):
+            self.assertEqual(len(arrays), len(check))
+            for time, wins, ccd in zip(times, arrays, check):
+                self.assertEqual(time.mjd, ccd.time.mjd)
+                self.assertEqual(len(wins), len(ccd))
+                for arr, win in zip(wins, ccd):
+                    self.assertEqual(arr.dtype, np.uint16)
+                    self.assertTrue((arr == win.data).all())
+        nf, times, arrays = next(ultracam.Rdata(self.run, 5).iter_arrays())
+        self.assertEqual(nf, 5)
+        self.assertEqual(arrays[2][1].dtype, np.float32)
+        self.assertTrue((arrays[2][1] == self.frames[4][2][1].data).all())
+
+    def test_run_array(self):
+        rarr = ultracam.RunArray(self.run, flt=False)
+        self.assertEqual((len(rarr), rarr.nccd, rarr.nwin(0)), (6, 3, 2))
+        for nc, nw in ((0,0), (1,1), (2,0)):
+            warr  = rarr[nc,nw]
+            stack = np.array([mccd[nc][nw].data for mccd in self.frames])
+            self.assertEqual(warr.shape, stack.shape)
+            self.assertTrue((warr[:] == stack).all())
+            self.assertTrue((warr[1:5,2:4,3] == stack[1:5,2:4,3]).all())
+            self.assertTrue((warr[::-2,1] == stack[::-2,1]).all())
+            self.assertTrue((warr[[0,3,4],:,-1] == stack[[0,3,4],:,-1]).all())
+            self.assertTrue((warr[-1] == stack[-1]).all())
+            lc = warr.map(lambda d: d.sum(axis=(1,2)), np.s_[:,1:3,2:5], maxmem=1.e-4)
+            self.assertTrue(len(lc) > 1)
+            self.assertTrue((np.concatenate(lc) == stack[:,1:3,2:5].sum(axis=(1,2))).all())
+        self.assertRaises(IndexError, rarr[0,0].__getitem__, 6)
+        total = rarr.map(lambda arrs: sum(arr.sum() for arr in arrs[1]), slice(2,None),
+                         reduce=lambda a, b: a+b, maxmem=1.e-3, nthreads=2)
+        self.assertEqual(total, sum(mccd[1].buffer.sum() for mccd in self.frames[2:]))
+        rarr.close()
+
+    def test_tseries(self):
+        fname = os.path.join(self.tdir, 'run001.tsf')
+        self.assertEqual(ultracam.write_tseries(self.run, fname, [(1,0), (2,1)], first=2, tile=(4,3),
+                                                maxmem=1.e-4, nthreads=2), 5)
+        tser = ultracam.Tseries(fname)
+        self.assertEqual((tser.first, tser.nframe, list(tser.wins.keys())), (2, 5, [(1,0), (2,1)]))
+        for nc, nw in tser.wins:
+            stack = np.array([mccd[nc][nw].data for mccd in self.frames[1:]])
+            self.assertTrue((tser.series(nc, nw, 5, 7) == stack[:,5,7]).all())
+            box = tser.region(nc, nw, 1, 6, 2, 5)
+            self.assertEqual(box.dtype, np.uint16)
+            self.assertTrue((box == stack[:,1:6,2:5].transpose(1,2,0)).all())
+        self.assertEqual(tser.mjd[1,0], next(ultracam.Rdata(self.run, 2).iter_arrays())[1][1].mjd)
+        self.assertRaises(ultracam.UltracamError, tser.series, 0, 0, 1, 1)
+        tser.close()
+
+    def test_tseries_blocks(self):
+        # more frames than fit in one block: maxmem=2.e-3 and 3 threads give
+        # blocks of 174 values
+        from trm.ultracam.Tseries import _blocks
+        run = os.path.join(self.tdir,'run002')
+        make_run(run, 40)
+        blocks = _blocks(3*2*8*6, 40, 174)
+        self.assertTrue(len(set(block[2] for block in blocks)) > 1)
+        self.assertEqual(sum((p2-p1)*(f2-f1) for p1, p2, f1, f2 in blocks), 3*2*8*6*40)
+        frames = [mccd for mccd in ultracam.Rdata(run)]
+        fname  = os.path.join(self.tdir, 'run002.tsf')
+        for nthreads in (1, 3):
+            self.assertEqual(ultracam.write_tseries(run, fname, tile=(4,4), maxmem=2.e-3,
+                                                    nthreads=nthreads), 40)
+            tser = ultracam.Tseries(fname)
+            for nc, nw in tser.wins:
+                stack = np.array([mccd[nc][nw].data for mccd in frames])
+                self.assertTrue((tser.region(nc, nw, 0, 4, 0, 4) ==
+                                 stack[:,0:4,0:4].transpose(1,2,0)).all())
+                self.assertTrue((tser.series(nc, nw, 5, 7) == stack[:,5,7]).all())
+            tser.close()
+
+    def test_pickle(self):
+        rdat = ultracam.Rdata(self.run, 2)
+        rdat()
+        rdat = pickle.loads(pickle.dumps(rdat))
+        mccd = rdat()
+        self.assertEqual(rdat.nframe(), 4)
+        self.assertTrue((mccd[0].buffer == self.frames[2][0].buffer).all())
+        self.assertEqual(mccd[0].time.mjd, self.frames[2][0].time.mjd)
+
+    @unittest.skipIf(ultracam.Shared.shared_memory is None, 'no shared_memory')
+    def test_shm(self):
+        shm  = ultracam.ShmFrame(self.frames[1])
+        self.assertEqual(shm.nbytes, 3*2*8*6*4)
+        mccd = pickle.loads(pickle.dumps(shm)).get()
+        self.assertEqual(mccd, self.frames[1])
+        for ccd, check in zip(mccd, self.frames[1]):
+            self.assertTrue(ccd.buffer is not None)
+            self.assertTrue((ccd.buffer == check.buffer).all())
+        self.assertEqual(mccd.head.value('Frame.frame'), self.frames[1].head.value('Frame.frame'))
+        # unlinked once received
+        self.assertRaises(OSError, shm.get)
+        ultracam.ShmFrame(self.frames[2]).release()
+
+    @unittest.skipIf(ultracam.Shared.shared_memory is None, 'needs multiprocessing.shared_memory')
+    def test_ring(self):
+        name   = 'utest{0:d}'.format(os.getpid())
+        writer = ultracam.RingWriter(name, nslot=4, slotsize=64*1024)
+        reader = ultracam.RingReader(name)
+        self.assertTrue(reader.get(block=False) is None)
+        for nf, mccd in enumerate(self.frames):
+            writer.put((self.run, nf+1, mccd))
+        # a slow reader loses the oldest frames but is not waited for
+        seq, (run, nf, mccd) = reader.get()
+        self.assertEqual((seq, nf, reader.ndropped), (3, 4, 3))
+        self.assertEqual(mccd, self.frames[3])
+        self.assertTrue((mccd[0].buffer == self.frames[3][0].buffer).all())
+        # views of the ring are good until overwritten
+        seq, (run, nf, mccd) = reader.get(copy=False)
+        self.assertTrue(reader.valid(seq))
+        for nf in range(7,11):
+            writer.put((self.run, nf, self.frames[0]))
+        self.assertFalse(reader.valid(seq))
+        writer.close()
+        self.assertEqual([item[1] for item in reader.frames()], [8, 9, 10])
+        self.assertEqual(reader.ndropped, 5)
+        reader.close()
+
+class TestCombine(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.run  = os.path.join(self.tdir,'run001')
+        make_run(self.run, 5)
+        self.frames = [mccd for mccd in ultracam.Rdata(self.run)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def test_methods(self):
+        for method in ultracam.COMBINE_METHODS:
+            comb, noise = ultracam.combine(self.run, method, nthreads=2, maxmem=0)
+            self.assertEqual(comb, self.frames[0])
+            self.assertEqual(comb.head.value('Combine.nframe'), 5)
+            for nc, ccd in enumerate(comb):
+                stack = np.array([mccd[nc].buffer for mccd in self.frames])
+                if method == 'mean':
+                    self.assertTrue(np.allclose(ccd.buffer, stack.mean(axis=0)))
+                elif method == 'median':
+                    self.assertTrue(np.allclose(ccd.buffer, np.median(stack, axis=0)))
+                elif method == 'minmax':
+                    self.assertTrue(np.allclose(ccd.buffer, np.sort(stack, axis=0)[1:-1].mean(axis=0)))
+                self.assertTrue((noise[nc].buffer >= 0).all())
+
+    def test_bias(self):
+        comb, noise = ultracam.combine(self.run, 'mean', first=2, last=3, bias=self.frames[0])
+        diff = (self.frames[1] + self.frames[2])/2. - self.frames[0]
+        for ccd, dccd in zip(comb, diff):
+            self.assertTrue(np.allclose(ccd.buffer, dccd.buffer))
+
+    def test_calib(self):
+        bias = self.frames[0]
+        dark = self.frames[0]*0. + 2.
+        flat = self.frames[0]*0. + 4.
+        for ccd in dark:
+            ccd.time = ultracam.Time(ccd.time.mjd, 2.*ccd.time.expose, True, '')
+        calib  = ultracam.Calib(bias, dark, flat)
+        frames = [mccd for mccd in ultracam.Rdata(self.run, flt=False, calib=calib)]
+        self.assertEqual(len(frames), 5)
+        for mccd, raw in zip(frames, self.frames):
+            for ccd, rccd, bccd, dccd in zip(mccd, raw, bias, dark):
+                check = (rccd.buffer - bccd.buffer - 2.*rccd.time.expose/dccd.time.expose)/4.
+                self.assertEqual(ccd.buffer.dtype, np.float32)
+                self.assertTrue(np.allclose(ccd.buffer, check, atol=1e-3))
+
+        # threaded decoding gives the same results
+        for mccd, tccd in zip(frames, ultracam.Rdata(self.run, calib=calib, nthreads=3)):
+            for ccd, tccd in zip(mccd, tccd):
+                self.assertTrue((ccd.buffer == tccd.buffer).all())
+        for mccd, tccd in zip(self.frames, ultracam.Rdata(self.run, nthreads=2)):
+            self.assertEqual(mccd, tccd)
+            self.assertTrue((mccd[2].buffer == tccd[2].buffer).all())
+
+        # the dark cannot be scaled without exposure times
+        for ccd in dark:
+            ccd.time = None
+        self.assertRaises(ultracam.UltracamError, ultracam.Calib(bias, dark), self.frames[1])
+
+    def test_running(self):
+        rstats = ultracam.RunningStats()
+        self.assertEqual(rstats.add_frames(self.frames[:3], nblock=2), 3)
+        rpart = ultracam.RunningStats()
+        for mccd in self.frames[3:]:
+            rpart.add(mccd)
+        rstats.merge(rpart)
+        self.assertEqual(rstats.n, 5)
+        mean, sigma = rstats.mean(), rstats.sigma()
+        self.assertEqual(mean, self.frames[0])
+        for nc in range(len(mean)):
+            stack = np.array([mccd[nc].buffer for mccd in self.frames])
+            self.assertTrue(np.allclose(mean[nc].buffer, stack.mean(axis=0)))
+            self.assertTrue(np.allclose(sigma[nc].buffer, stack.std(axis=0, ddof=1), atol=1e-4))
+            self.assertTrue((rstats.min()[nc].buffer == stack.min(axis=0)).all())
+            self.assertTrue((rstats.max()[nc].buffer == stack.max(axis=0)).all())
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.idata = rng.randint(1000, 1400, (50,60)).astype(np.uint16)
+        self.fdata = rng.normal(1000., 20., (50,60)).astype(np.float32)
+        self.pcs   = (0.1,1.,5.,50.,95.,99.,99.9)
+
+    def test_int(self):
+        hs = ultracam.Hstats(self.idata[:20])
+        hs.add(self.idata[20:])
+        self.assertTrue((hs.centile(self.pcs) == np.percentile(self.idata, self.pcs)).all())
+        self.assertEqual((hs.min(), hs.max()), (self.idata.min(), self.idata.max()))
+        self.assertAlmostEqual(hs.mean(), self.idata.mean(), 8)
+        hist = np.bincount(self.idata.ravel())
+        self.assertEqual(hs.mode(), (np.argmax(hist), hist.max()))
+
+    def test_float(self):
+        hs = ultracam.Hstats(self.fdata)
+        self.assertTrue(np.allclose(hs.centile(self.pcs), np.percentile(self.fdata, self.pcs),
+                                    atol=hs.width))
+        self.assertEqual(hs.max(), self.fdata.max())
+        self.assertRaises(ultracam.UltracamError, hs.add, self.idata)
+
+    def test_ccd(self):
+        win1 = ultracam.Window(self.idata[:,:30], 1, 1, 1, 1)
+        win2 = ultracam.Window(self.idata[:,30:], 31, 1, 1, 1)
+        ccd  = ultracam.CCD([win1,win2], None, 100, 100, True, None)
+        self.assertEqual(ccd.median(), np.median(self.idata))
+        self.assertEqual(win1.median(), np.median(self.idata[:,:30]))
+        self.assertTrue((ccd.centile((5,95)) == np.percentile(self.idata, (5,95))).all())
+
+class TestUcm(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        make_run(os.path.join(self.tdir,'run001'), 2)
+        self.mccd = ultracam.Rdata(os.path.join(self.tdir,'run001'))(2)
+        self.fname = os.path.join(self.tdir, 'frame.ucm')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def check(self, mccd, dtype):
+        self.assertEqual(list(mccd.head.keys()), list(self.mccd.head.keys()))
+        for key in self.mccd.head:
+            value, itype, comment = self.mccd.head[key]
+            if itype == ultracam.ITYPE_FLOAT:
+                self.assertAlmostEqual(mccd.head[key][0], value, 6)
+            else:
+                self.assertEqual(mccd.head[key], (value, itype, comment))
+        for ccd1, ccd2 in zip(mccd, self.mccd):
+            self.assertEqual((ccd1.nxmax,ccd1.nymax), (ccd2.nxmax,ccd2.nymax))
+            for win1, win2 in zip(ccd1, ccd2):
+                self.assertEqual(win1.data.dtype, dtype)
+                self.assertEqual((win1.llx,win1.lly,win1.xbin,win1.ybin),
+                                 (win2.llx,win2.lly,win2.xbin,win2.ybin))
+                self.assertTrue((win1.data == win2.data).all())
+
+    def test_float(self):
+        self.mccd.wucm(self.fname)
+        mccd = ultracam.MCCD.rucm(self.fname)
+        self.check(mccd, np.float32)
+        mccd[0][0].data += 1.
+        self.assertTrue(mccd[0][0].data.flags.writeable)
+        self.assertEqual(mccd[0].buffer.size, mccd[0].npix())
+
+    def test_int(self):
+        self.mccd = ultracam.Rdata(os.path.join(self.tdir,'run001'), flt=False)(2)
+        for ccd in self.mccd:
+            self.assertEqual(ccd.buffer.dtype, np.uint16)
+            self.assertEqual(ccd.median(), np.median(np.concatenate([w.data.ravel() for w in ccd])))
+        self.mccd.wucm(self.fname)
+        self.check(ultracam.MCCD.rucm(self.fname, False), np.uint16)
+        self.check(ultracam.MCCD.rucm(self.fname), np.float32)
+
+    def test_mmap(self):
+        self.mccd.wucm(self.fname)
+        mccd = ultracam.MCCD.rucm(self.fname, mmap=True)
+        self.check(mccd, np.float32)
+        self.assertFalse(mccd[0][0].data.flags.writeable)
+
+    def test_writer(self):
+        writer = ultracam.UcmWriter()
+        for n in range(3):
+            self.mccd[0][0].data += 1.
+            writer.write(self.mccd, os.path.join(self.tdir, 'frame' + str(n)))
+            self.check(ultracam.MCCD.rucm(os.path.join(self.tdir, 'frame' + str(n))), np.float32)
+
+        # header bytes are re-used until the header changes
+        hbytes = self.mccd.head.pack()
+        self.assertTrue(self.mccd.head.pack() is hbytes)
+        self.mccd.head.add_entry('Comment', 'test', ultracam.ITYPE_STRING, 'a comment')
+        self.assertFalse(self.mccd.head.pack() is hbytes)
+
+        # no copy needed if the type matches
+        win = self.mccd[0][0]
+        self.assertTrue(win.astype(np.float32, copy=False) is win.data)
+
+    def test_mucm(self):
+        rdat  = ultracam.Rdata(os.path.join(self.tdir,'run001'))
+        fname = os.path.join(self.tdir, 'frames')
+        frames = [rdat(1), rdat(2)]
+        writer = ultracam.MucmWriter(fname, frames[0])
+        mucm   = ultracam.Mucm(fname)
+        self.assertEqual(len(mucm), 0)
+        over = ultracam.Uhead()
+        over.add_entry('Frame', 'Frame info')
+        over.add_entry('Frame.number', 2, ultracam.ITYPE_INT, 'frame number')
+        writer.append(frames[0])
+        writer.append(frames[1], over)
+        writer.close()
+
+        # appending to an existing container
+        with ultracam.MucmWriter(fname) as writer:
+            writer.append(frames[0])
+        frames.append(frames[0])
+        self.assertEqual(len(mucm), 3)
+
+        for mmap in (True, False):
+            mucm = ultracam.Mucm(fname, mmap=mmap)
+            for n, mccd in enumerate(mucm):
+                self.mccd = frames[n]
+                if n != 1:
+                    # (frame 1 has the extra overlay item)
+                    self.check(mccd, np.float32)
+                self.assertEqual(mccd[0].time.mjd, frames[n][0].time.mjd)
+                self.assertEqual(mucm.time(n)[1].good, frames[n][1].time.good)
+            self.assertEqual(mucm[1].head['Frame.number'][0], 2)
+            self.assertTrue((mucm[-2][1][0].data == frames[1][1][0].data).all())
+            self.assertRaises(IndexError, mucm.__getitem__, 3)
+
+    def test_bad(self):
+        with open(self.fname, 'wb') as fobj:
+            fobj.write(b'junk')
+        self.assertRaises(ultracam.UltracamError, ultracam.MCCD.rucm, self.fname)
+
+class TestZdat(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.run  = os.path.join(self.tdir,'run001')
+        self.framesize = make_run(self.run, 5)
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def test_filter(self):
+        data = (1000 + np.arange(600) % 17).astype('<u2')
+        for lag in (1, 6, 7):
+            self.assertTrue((ultracam.Zdat.zunfilter(ultracam.Zdat.zfilter(data, lag), lag) == data).all())
+
+    def test_zdat(self):
+        frames = [mccd for mccd in ultracam.Rdata(self.run)]
+        times  = [tinfo[1]['gps'] for tinfo in ultracam.Rtime(self.run)]
+        self.assertEqual(ultracam.Zdat.write_zdat(ultracam.Rhead(self.run)), 5)
+        self.assertTrue(os.path.getsize(self.run + '.zdat') < os.path.getsize(self.run + '.dat'))
+        with open(self.run + '.dat', 'rb') as fobj:
+            whole = fobj.read()
+        os.remove(self.run + '.dat')
+
+        for threads in (True, False):
+            zfile = ultracam.Zdat.ZdatFile(self.run + '.zdat', threads)
+            self.assertEqual(zfile.read(), whole)
+            zfile.seek(self.framesize+10)
+            self.assertEqual(zfile.read(2*self.framesize), whole[self.framesize+10:3*self.framesize+10])
+            zfile.close()
+
+        rdat = ultracam.Rdata(self.run)
+        self.assertEqual(rdat.ntotal(), 5)
+        for n, mccd in enumerate(rdat):
+            self.assertTrue((mccd[1][1].data == frames[n][1][1].data).all())
+        self.assertTrue((rdat(0)[0][0].data == frames[-1][0][0].data).all())
+
+        # times without decompression
+        rtim = ultracam.Rtime(self.run)
+        self.assertEqual([tinfo[1]['gps'] for tinfo in rtim], times)
+        self.assertEqual(rtim._fobj.ndecomp, 0)
+
+class TestCdat(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.run  = os.path.join(self.tdir,'run001')
+        self.framesize = make_run(self.run, 6)
+        self.frames = [mccd for mccd in ultracam.Rdata(self.run)]
+        self.times  = [tinfo[1]['gps'] for tinfo in ultracam.Rtime(self.run)]
+        with open(self.run + '.dat', 'rb') as fobj:
+            self.whole = fobj.read()
+        os.remove(self.run + '.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def test_gzip(self):
+        # two gzip members, as from concatenation
+        import gzip
+        half = len(self.whole)//2
+        with open(self.run + '.dat.gz', 'wb') as fobj:
+            fobj.write(gzip.compress(self.whole[:half]) + gzip.compress(self.whole[half:]))
+
+        cfile = ultracam.CdatFile(self.run + '.dat.gz', self.framesize, 16, chunk=100, spacing=500)
+        self.assertEqual(cfile.read(), self.whole)
+        self.assertTrue(len(cfile._checks) > 1)
+        for pos in (3000, 1000, 10, 2500):
+            cfile.seek(pos)
+            self.assertEqual(cfile.read(700), self.whole[pos:pos+700])
+        # reading to the end needed the index
+        self.assertTrue(os.path.exists(self.run + '.dat.gz.uidx'))
+        cfile.close()
+
+        rdat = ultracam.Rdata(self.run)
+        self.assertTrue((rdat(0)[1][0].data == self.frames[-1][1][0].data).all())
+        for n, mccd in enumerate(ultracam.Rdata(self.run, 3)):
+            self.assertTrue((mccd[0][1].data == self.frames[n+2][0][1].data).all())
+
+        # times and frame counts from the index alone
+        rtim = ultracam.Rtime(self.run)
+        self.assertEqual(rtim._fobj.nframe, 6)
+        self.assertEqual([tinfo[1]['gps'] for tinfo in rtim], self.times)
+        self.assertEqual(rtim._fobj._upos + len(rtim._fobj._pend), 0)
+
+    def test_backward_read(self):
+        # a short read, then a longer one from just before it, from within
+        # the decompressed bytes pending
+        import gzip
+        with open(self.run + '.dat.gz', 'wb') as fobj:
+            fobj.write(gzip.compress(self.whole))
+        cfile = ultracam.CdatFile(self.run + '.dat.gz', self.framesize, 16, chunk=100, spacing=500)
+        for pos in (2000, 300):
+            cfile.seek(pos)
+            self.assertEqual(cfile.read(10), self.whole[pos:pos+10])
+            cfile.seek(pos-10)
+            self.assertEqual(cfile.read(1500), self.whole[pos-10:pos+1490])
+        cfile.close()
+
+    def test_bz2(self):
+        import bz2
+        self.assertFalse(ultracam.dat_exists(self.run))
+        with open(self.run + '.dat.bz2', 'wb') as fobj:
+            fobj.write(bz2.compress(self.whole))
+        self.assertTrue(ultracam.dat_exists(self.run))
+        rdat = ultracam.Rdata(self.run)
+        self.assertEqual(rdat.ntotal(), 6)
+        for n in (4, 2, 6):
+            self.assertTrue((rdat(n)[1][1].data == self.frames[n-1][1][1].data).all())
+
+class TestFrameCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir  = tempfile.mkdtemp()
+        self.cache = ultracam.FrameCache(maxbytes=25, spill=self.tdir, maxspill=25)
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def test_hit(self):
+        self.cache.put(('u','run001',1), b'0123456789')
+        self.assertEqual(self.cache.get(('u','run001',1)), b'0123456789')
+        self.assertEqual(self.cache.get(('u','run001',2)), None)
+
+    def test_evict(self):
+        for nf in range(1,4):
+            self.cache.put(nf, 10*str(nf).encode())
+        self.assertTrue(self.cache.nbytes <= 25)
+        # oldest should have been spilled, and come back intact
+        self.assertEqual(self.cache.get(1), 10*b'1')
+        self.assertEqual(self.cache.get(3), 10*b'3')
+
+    def test_replace_spilled(self):
+        for nf in range(1,4):
+            self.cache.put(nf, 10*str(nf).encode())
+        # 1 is on disk; replacing it must not leave the old buffer there
+        self.cache.put(1, 5*b'a')
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.nspill, 0)
+        self.assertEqual(os.listdir(self.tdir), [])
+        self.assertEqual(self.cache.get(1), 5*b'a')
+
+    def test_lru(self):
+        cache = ultracam.FrameCache(maxbytes=20)
+        cache.put(1, 10*b'1')
+        cache.put(2, 10*b'2')
+        cache.get(1)
+        cache.put(3, 10*b'3')
+        self.assertEqual(cache.get(2), None)
+        self.assertEqual(cache.get(1), 10*b'1')
+
+class TestFollow(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        make_run(os.path.join(self.tdir,'run001'), 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def test_follow(self):
+        fol = ultracam.follow(path=self.tdir, times=True, pmin=0.001, pmax=0.01)
+        nfs = [next(fol)[1] for i in range(3)]
+        self.assertEqual(nfs, [1,2,3])
+
+        # add a frame and a partial frame
+        with open(os.path.join(self.tdir,'run001.dat'),'ab') as fobj:
+            fobj.write(frame_bytes(4))
+            fobj.write(frame_bytes(5)[:50])
+        run, nf, tinfo = next(fol)
+        self.assertEqual((run, nf), ('run001', 4))
+
+        # new run; the rest of frame 5 should be read before switching
+        make_run(os.path.join(self.tdir,'run002'), 2)
+        with open(os.path.join(self.tdir,'run001.dat'),'ab') as fobj:
+            fobj.write(frame_bytes(5)[50:])
+        res = [next(fol)[:2] for i in range(3)]
+        self.assertEqual(res, [('run001',5), ('run002',1), ('run002',2)])
+
+    def test_tick(self):
+        fol = ultracam.follow(path=self.tdir, latest=True, pmin=0.001, pmax=0.01, tick=0.05)
+        run, nf, mccd = next(fol)
+        self.assertEqual(nf, 3)
+        self.assertEqual(next(fol), ('run001', None, None))
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        make_run(os.path.join(self.tdir,'run001'), 5)
+        self.server = Fserver(self.tdir, 0)
+        self.server.start()
+        self.url = ultracam.Server.URL
+        ultracam.Server.URL = self.server.url
+
+    def tearDown(self):
+        self.server.stop()
+        ultracam.Server.URL = self.url
+        shutil.rmtree(self.tdir)
+
+    def test_frames(self):
+        self.assertEqual(ultracam.get_runs_from_server(), ['run001'])
+        self.assertEqual(ultracam.get_nframe_from_server('run001'), 5)
+        rdat = ultracam.Rdata(os.path.join(self.tdir,'run001'))
+        for n, mccd in enumerate(ultracam.Rdata('run001', server=True)):
+            self.assertTrue((mccd[1][1].data == rdat(n+1)[1][1].data).all())
+        self.assertEqual(n, 4)
+
+    def test_timing(self):
+        ltimes = [tinfo[1]['gps'] for tinfo in ultracam.Rtime(os.path.join(self.tdir,'run001'))]
+        stimes = [tinfo[1]['gps'] for tinfo in ultracam.Rtime('run001', server=True)]
+        self.assertEqual(ltimes, stimes)
+        self.assertTrue(ultracam.Server.TIMING_ACTION[self.server.url])
+
+    def test_runlist(self):
+        rlist = ultracam.RunList(maxage=0.)
+        self.assertEqual(rlist.runs(), [ultracam.Runinfo('run001', 5)])
+        self.assertEqual(rlist.names(), ['run001'])
+        self.assertEqual(rlist.nfull, 1)
+        make_run(os.path.join(self.tdir,'run002'), 2)
+        self.assertEqual(rlist.names(), ['run001', 'run002'])
+        self.assertEqual(rlist.nfull, 2)
+        # unchanged: conditional request should not re-fetch
+        rlist.names()
+        self.assertEqual(rlist.nfull, 2)
+        # new frames of a run leave the listing unchanged
+        with open(os.path.join(self.tdir,'run002.dat'), 'ab') as fobj:
+            fobj.write(frame_bytes(3, 8, 6, 1000))
+        self.assertEqual(rlist.runs()[-1], ultracam.Runinfo('run002', 2))
+        self.assertEqual(rlist.nfull, 2)
+        self.assertEqual(rlist.runs(True)[-1], ultracam.Runinfo('run002', 3))
+
+    def test_timing_fallback(self):
+        def reject(handler):
+            if 'get_timing' in handler.path:
+                handler.send_error(400)
+            else:
+                FileServerHandler.do_GET(handler)
+        server = Fserver(self.tdir, 0)
+        server.RequestHandlerClass = type('Handler', (FileServerHandler,), {'do_GET' : reject})
+        server.start()
+        ultracam.Server.URL = server.url
+        try:
+            rtim = ultracam.Rtime('run001', server=True)
+            self.assertEqual(len(list(rtim)), 5)
+            self.assertFalse(ultracam.Server.TIMING_ACTION[server.url])
+        finally:
+            server.stop()
+
+    def test_timing_empty(self):
+        # a server answering actions it does not know with an empty reply
+        ntiming = []
+        def empty(handler):
+            if 'get_timing' in handler.path:
+                ntiming.append(handler.path)
+                handler.send_response(200)
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+            else:
+                FileServerHandler.do_GET(handler)
+        server = Fserver(self.tdir, 0)
+        server.RequestHandlerClass = type('Handler', (FileServerHandler,), {'do_GET' : empty})
+        server.start()
+        ultracam.Server.URL = server.url
+        try:
+            stimes = [tinfo[1]['gps'] for tinfo in ultracam.Rtime('run001', server=True)]
+            self.assertEqual(len(stimes), 5)
+            # settled by the first frame, so asked only once
+            self.assertEqual(len(ntiming), 1)
+            self.assertFalse(ultracam.Server.TIMING_ACTION[server.url])
+        finally:
+            server.stop()
+
+        # asking first for a frame that does not exist yet decides nothing
+        ultracam.Server.URL = self.server.url
+        ultracam.Server.TIMING_ACTION.pop(self.server.url, None)
+        self.assertEqual(ultracam.get_timing_from_server('run001', 6, 16, 608), b'')
+        self.assertTrue(self.server.url not in ultracam.Server.TIMING_ACTION)
+        self.assertEqual(len(ultracam.get_timing_from_server('run001', 1, 16, 608)), 32)
+        self.assertTrue(ultracam.Server.TIMING_ACTION[self.server.url])
+
+    def test_timing_bad_reply(self):
+        # one bad reply from a server that supports get_timing
+        def bad(handler):
+            if 'get_timing' in handler.path:
+                handler.send_response(200)
+                handler.send_header('Content-Length', '5')
+                handler.end_headers()
+                handler.wfile.write(b'12345')
+            else:
+                FileServerHandler.do_GET(handler)
+        server = Fserver(self.tdir, 0)
+        server.RequestHandlerClass = type('Handler', (FileServerHandler,), {'do_GET' : bad})
+        server.start()
+        ultracam.Server.URL = server.url
+        ultracam.Server.TIMING_ACTION[server.url] = True
+        try:
+            self.assertRaises(ultracam.UltracamError, ultracam.get_timing_from_server,
+                              'run001', 2, 16, 608)
+            self.assertTrue(ultracam.Server.TIMING_ACTION[server.url])
+        finally:
+            server.stop()
+
+    def test_range(self):
+        run  = self.server.url + 'run001'
+        rdat = ultracam.Rdata(os.path.join(self.tdir,'run001'))
+        for n, mccd in enumerate(ultracam.Rdata(run)):
+            self.assertTrue((mccd[1][1].data == rdat(n+1)[1][1].data).all())
+        self.assertEqual(n, 4)
+        self.assertEqual(len(list(ultracam.Rtime(run))), 5)
+        self.assertEqual(ultracam.Rdata(run).ntotal(), 5)
+
+        # coalescing and caching of blocks
+        with open(os.path.join(self.tdir,'run001.dat'), 'rb') as fobj:
+            whole = fobj.read()
+        rfile = ultracam.Range.RangeFile(run + '.dat', 256, ultracam.FrameCache())
+        rfile.seek(300)
+        self.assertEqual(rfile.read(1000), whole[300:1300])
+        self.assertEqual(rfile.nrequest, 1)
+        rfile.seek(600)
+        self.assertEqual(rfile.read(500), whole[600:1100])
+        self.assertEqual(rfile.nrequest, 1)
+        rfile.seek(-100,2)
+        self.assertEqual(rfile.read(1000), whole[-100:])
+        self.assertEqual(rfile.read(10), b'')
+
+    def test_range_ignored(self):
+        server = Fserver(self.tdir, 0, ranges=False)
+        server.start()
+        try:
+            rfile = ultracam.Range.RangeFile(server.url + 'run001.dat', 256, ultracam.FrameCache())
+            rfile.seek(1000)
+            self.assertEqual(len(rfile.read(1000)), 1000)
+            self.assertFalse(rfile.ranges)
+            rdat = ultracam.Rdata(server.url + 'run001')
+            self.assertEqual(len(list(rdat)), 5)
+        finally:
+            server.stop()
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestWindow)
     unittest.TextTestRunner(verbosity=2).run(suite)
 
     suite = unittest.TestLoader().loadTestsFromTestCase(TestCCD)
     unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStats)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestRdata)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCombine)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestUcm)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestZdat)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCdat)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFrameCache)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFollow)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestServer)
+    unittest.TextTestRunner(verbosity=2).run(suite)
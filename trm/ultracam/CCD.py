@@ -27,11 +27,53 @@ except ImportError:
     print('Failed to import astropy.io.fits; FITS access will fail')
 
 from trm.ultracam.Constants import *
-from trm.ultracam.Window import Window
+from trm.ultracam.Window import Window, hist_ok, crop_slices
+from trm.ultracam.Stats import Hstats
 from trm.ultracam.Uhead import Uhead
 from trm.ultracam.Time import Time
+from trm.ultracam.Utils import set_dict_state
 from trm.ultracam.UErrors import UltracamError
 
+# crop plans keyed by (source, target) format signatures; see crop_plan
+CROP_PLANS  = {}
+CROP_NPLANS = 1024
+
+def crop_plan(sfsig, tfsig):
+    """
+    Returns the plan for cropping a CCD of format signature sfsig to the
+    format tfsig (see CCD.fsig), or None if this is impossible. The plan is a
+    tuple with one (nwin, slices) pair for each target window, where nwin is
+    the index of the source window to crop and slices the (y, x) slices to
+    apply to its data. Plans are kept in CROP_PLANS, so repeated cropping
+    between the same formats, e.g. of a bias frame to each frame of a run,
+    needs no searching.
+    """
+    key = (sfsig, tfsig)
+    try:
+        return CROP_PLANS[key]
+    except KeyError:
+        pass
+
+    snxmax, snymax, swins = sfsig
+    tnxmax, tnymax, twins = tfsig
+    plan = None
+    if snxmax == tnxmax and snymax == tnymax:
+        plan = []
+        for twin in twins:
+            for nwin, swin in enumerate(swins):
+                slices = crop_slices(swin, twin)
+                if slices is not None:
+                    plan.append((nwin, slices))
+                    break
+            else:
+                plan = None
+                break
+
+    if len(CROP_PLANS) >= CROP_NPLANS:
+        CROP_PLANS.clear()
+    CROP_PLANS[key] = plan = None if plan is None else tuple(plan)
+    return plan
+
 class CCD(object):
     """
     Class to represent a CCD. Contains a list of Windows representing
@@ -40,6 +82,11 @@ class CCD(object):
 
     Indexed access returns the component Window objects.
     """
+
+    # no per-instance __dict__, to keep the many CCDs of long runs compact
+    __slots__ = ('_data', 'time', 'nxmax', 'nymax', 'good', 'head',
+                 '_buff', '_views', '_shapes')
+
     def __init__(self, wins, time, nxmax, nymax, good, head):
         """
         Creates a new CCD frame.
@@ -69,6 +116,45 @@ class CCD(object):
         self.nymax = nymax
         self.good  = good
         self.head  = head
+        self._buff   = None
+        self._views  = ()
+        self._shapes = ()
+
+    def __getstate__(self):
+        """
+        State for pickling. With contiguous storage the array is saved once,
+        along with the positions and binning factors of the Windows, and the
+        Windows are re-made as views into it when unpickled.
+        """
+        buff = self.buffer
+        if buff is None:
+            return (self._data, self.time, self.nxmax, self.nymax, self.good, self.head, None)
+        wins = tuple((win.llx, win.lly, win.xbin, win.ybin) for win in self._data)
+        return (wins, self.time, self.nxmax, self.nymax, self.good, self.head,
+                (buff, self._shapes))
+
+    def __setstate__(self, state):
+        self._buff   = None
+        self._views  = ()
+        self._shapes = ()
+        if set_dict_state(self, state):
+            return
+        wins, self.time, self.nxmax, self.nymax, self.good, self.head, packed = state
+        if packed is None:
+            self._data = wins
+        else:
+            buff, shapes = packed
+            self._data = []
+            views = []
+            off   = 0
+            for (llx, lly, xbin, ybin), shape in zip(wins, shapes):
+                view = buff[off:off+shape[0]*shape[1]].reshape(shape)
+                self._data.append(Window(view, llx, lly, xbin, ybin))
+                views.append(view)
+                off += view.size
+            self._buff   = buff
+            self._views  = tuple(views)
+            self._shapes = shapes
 
     def __repr__(self):
         """Warts-and-all contents of a CCD"""
@@ -87,17 +173,10 @@ class CCD(object):
     def __eq__(self, other):
         """
         Equality of two CCDs is defined by matching binning factors,
-        maximum dimensions and windows (in order).
+        maximum dimensions and windows (in order), i.e. matching format
+        signatures.
         """
-
-        if self.nxmax != other.nxmax or self.nymax != other.nymax or len(self) != len(other):
-            return False
-
-        # now test for equal windows
-        for swin,owin in zip(self._data,other._data):
-            if swin != owin:
-                return False
-        return True
+        return self.fsig == other.fsig
 
     def __ne__(self, other):
         """
@@ -136,6 +215,15 @@ class CCD(object):
                 raise UltracamError('CCD.data: wins must be a list of Windows.')
         self._data = wins
 
+    @property
+    def fsig(self):
+        """
+        Format signature of the CCD, the tuple (nxmax, nymax, wsigs) where
+        wsigs is a tuple of the signatures of the Windows (see Window.fsig).
+        Signatures are hashable and equal for CCDs of the same format.
+        """
+        return (self.nxmax, self.nymax, tuple(win.fsig for win in self._data))
+
     @property
     def nwin(self):
         """
@@ -189,10 +277,69 @@ class CCD(object):
                 warnings.warn('CCD.toInt: input data out of range 0 to 65535')
             win.totype(np.uint16)
 
+    @property
+    def buffer(self):
+        """
+        The 1D array holding the data of all Windows, in order, if the CCD has
+        contiguous storage (see pack), else None. Replacing the data of any
+        Window, e.g. with Window.trim or Window.totype, ends the contiguous
+        storage, as does changing the list of Windows.
+        """
+        buff = self._buff
+        if buff is not None:
+            if len(self._data) == len(self._views) and \
+                    all(win._data is view for win, view in zip(self._data, self._views)):
+                return buff
+            self._buff   = None
+            self._views  = ()
+            self._shapes = ()
+        return None
+
+    def pack(self, dtype=None):
+        """
+        Moves the data of all Windows into a single contiguous 1D array, in
+        Window order, with the data of each Window a 2D view into it. Whole-CCD
+        statistics (mean, median, centile, etc) are then computed on this
+        array with no copying. Returns the array.
+
+        dtype -- data type to store the data as. Defaults to the type of the
+                 Windows (which must all match). Conversion from floats to an
+                 integer type rounds to the nearest integer.
+        """
+        if dtype is None:
+            dtypes = set(win.dtype for win in self._data)
+            if len(dtypes) > 1:
+                raise UltracamError('CCD.pack: Windows have more than one data type; dtype must be set')
+            dtype = dtypes.pop() if dtypes else np.float32
+        dtype = np.dtype(dtype).newbyteorder('=')
+
+        buff  = np.empty(sum(win.size for win in self._data), dtype)
+        views = []
+        off   = 0
+        for win in self._data:
+            view = buff[off:off+win.size].reshape((win.ny,win.nx))
+            if issubclass(dtype.type, np.integer) and \
+                    not issubclass(win.dtype.type, np.integer):
+                np.copyto(view, np.rint(win._data), casting='unsafe')
+            else:
+                np.copyto(view, win._data, casting='unsafe')
+            win._data = view
+            views.append(view)
+            off += win.size
+
+        self._buff   = buff
+        self._views  = tuple(views)
+        self._shapes = tuple(view.shape for view in views)
+        return buff
+
     def mean(self):
         """
         Returns the mean over all Windows of a CCD
         """
+        buff = self.buffer
+        if buff is not None:
+            return buff.mean()
+
         nelem = 0
         sum   = 0.
         for win in self._data:
@@ -204,6 +351,10 @@ class CCD(object):
         """
         Returns the minimum over all Windows of a CCD
         """
+        buff = self.buffer
+        if buff is not None:
+            return buff.min()
+
         minv = None
         for win in self._data:
             minv = win.min() if minv is None else min(minv, win.min())
@@ -213,6 +364,10 @@ class CCD(object):
         """
         Returns the maximum over all Windows of a CCD
         """
+        buff = self.buffer
+        if buff is not None:
+            return buff.max()
+
         maxv = None
         for win in self._data:
             maxv = win.max() if maxv is None else max(maxv, win.max())
@@ -224,28 +379,52 @@ class CCD(object):
             np += win.size
         return np
 
-    def median(self):
+    def _pixels(self):
         """
-        Returns median over all Windows of a CCD.
+        Returns all the pixels of the CCD as a 1D array, without copying
+        if the CCD has contiguous storage.
         """
+        buff = self.buffer
+        if buff is not None:
+            return buff
+        return np.concatenate([win.data.ravel() for win in self._data])
 
-        # generate combined list of all pixels in CCD called 'arr'
-        larr = []
+    def hstats(self):
+        """
+        Returns an Hstats of all the pixels of the CCD, from which the
+        minimum, maximum, mean, mode and percentiles can be found in one pass
+        through the data. See Stats.py.
+        """
+        buff = self.buffer
+        if buff is not None:
+            return Hstats(buff)
+        hs = Hstats()
         for win in self._data:
-            larr.append(win.flatten())
-        arr = np.concatenate(larr)
-
-        return np.median(arr)
+            hs.add(win.data)
+        return hs
 
+    def median(self):
+        """
+        Returns median over all Windows of a CCD. This is computed from a
+        histogram for raw unsigned 2-byte data.
+        """
+        if hist_ok(self._data):
+            return self.hstats().median()
+        return np.median(self._pixels())
 
-    def centile(self, pcent):
+    def centile(self, pcent, approx=False):
         """
         Returns percentile(s) over all Windows of a CCD. Given pcent, this
         routine returns the image level below which pcent percent of the pixel
         values lie.  pcent can be a single number or array-like. In the latter
         case a list of values is returned.
 
-        pcent -- percentile or percentiles (array-like)
+        pcent  -- percentile or percentiles (array-like)
+
+        approx -- for floating point data, estimate the percentiles from a
+                  fine histogram rather than partially sorting the data. This
+                  is faster and fine for setting plot limits. Raw unsigned
+                  2-byte data always use a histogram, which is exact.
 
         Returns image value or values as a list equivalent to the input
         percentiles.
@@ -255,13 +434,9 @@ class CCD(object):
         if isinstance(pcent, six.string_types):
             raise UltracamError('CCD.centile: argument "pcent" cannot be a string')
 
-        # generate combined list of all pixels in CCD called 'arr'
-        larr = []
-        for win in self._data:
-            larr.append(win.flatten())
-        arr = np.concatenate(larr)
-
-        return np.percentile(arr,pcent)
+        if approx or hist_ok(self._data):
+            return self.hstats().centile(pcent)
+        return np.percentile(self._pixels(),pcent)
 
     def rback(self):
         """
@@ -293,15 +468,7 @@ class CCD(object):
         It does this by checking that each Window of ccd is enclosed
         by a Window of the CCD.
         """
-        if self.nxmax != ccd.nxmax or self.nymax != ccd.nymax:
-            return False
-
-        for wino in ccd._data:
-            for win in self._data:
-                if win >= wino: break
-            else:
-                return False
-        return True
+        return crop_plan(self.fsig, ccd.fsig) is not None
 
     def cropTo(self, ccd):
         """
@@ -312,171 +479,215 @@ class CCD(object):
         if self.nxmax != ccd.nxmax or self.nymax != ccd.nymax:
             raise UltracamError('CCD.crop: maximum dimensions did not match')
 
+        tfsig = ccd.fsig
+        plan  = crop_plan(self.fsig, tfsig)
+        if plan is None:
+            raise UltracamError('CCD.crop: could not crop the windows of CCD to match those of other.')
+
         wins = []
-        for nwino, wino in enumerate(ccd._data):
-            for win in self._data:
-                if win.canCropTo(wino):
-                    wins.append(win.cropTo(wino))
-                    break
-            else:
-                raise UltracamError('CCD.crop: could not crop any window of CCD to match window ' +
-                                    str(nwino+1) + ' of other.')
+        for (nwin, slices), (llx, lly, nx, ny, xbin, ybin) in zip(plan, tfsig[2]):
+            wins.append(Window(self._data[nwin]._data[slices], llx, lly, xbin, ybin))
         return CCD(wins, self.time, self.nxmax, self.nymax, self.good, self.head)
 
-    # arithematic
+    # arithematic. All operations go through _arith which acts on the whole
+    # of the contiguous storage (see pack) in a single numpy call when it
+    # can, or Window by Window otherwise.
+
+    def _arith(self, other, op, out=None, reverse=False):
+        """
+        Applies the numpy ufunc 'op' to the CCD and 'other' (a CCD or a
+        constant), i.e. op(self, other), or op(other, self) if reverse.
+
+        out -- CCD of matching format to store the result in, which can be
+               the CCD itself for in-place operations. If None a new CCD is
+               returned.
+
+        In-place operations on integer data which would give floating point
+        results (a floating point operand or division) first convert the CCD
+        to 4-byte floats.
+        """
+        isccd = isinstance(other, CCD)
+        if isccd and len(other) != len(self):
+            raise UltracamError('CCD._arith: number of windows do not match')
+
+        if out is self and self.anyInt() and (op is np.true_divide or
+                                              (other.anyFloat() if isccd else
+                                               isinstance(other, (float, np.floating)))):
+            if self.buffer is not None:
+                self.pack(np.float32)
+            else:
+                self.toFloat()
+
+        sbuff = self.buffer
+        obuff = other.buffer if isccd else other
+        if sbuff is not None and obuff is not None and \
+                (not isccd or other._shapes == self._shapes):
+            # fast route: one operation on all pixels
+            x, y = (obuff, sbuff) if reverse else (sbuff, obuff)
+            if out is None:
+                return self.like(op(x, y), other.good if isccd else True)
+            obuff = out.buffer
+            if obuff is not None and out._shapes == self._shapes:
+                op(x, y, out=obuff)
+                return out
+
+        if out is None:
+            wins = []
+            for nw, win in enumerate(self._data):
+                o = other._data[nw].data if isccd else other
+                x, y = (o, win.data) if reverse else (win.data, o)
+                wins.append(Window(op(x, y), win.llx, win.lly, win.xbin, win.ybin))
+            good = self.good and (other.good if isccd else True)
+            return CCD(wins, self.time, self.nxmax, self.nymax, good, self.head)
+
+        if len(out) != len(self):
+            raise UltracamError('CCD._arith: number of windows of out does not match')
+        for nw, win in enumerate(self._data):
+            o = other._data[nw].data if isccd else other
+            x, y = (o, win.data) if reverse else (win.data, o)
+            op(x, y, out=out._data[nw].data)
+        return out
+
+    def like(self, buff, good=True):
+        """
+        Returns a CCD of the same format, time and header as the CCD, with the
+        data of its Windows views into the 1D array 'buff', which must have one
+        element per pixel, in Window order (see pack).
+
+        good -- the returned CCD is good if this and the CCD are both True.
+        """
+        if buff.ndim != 1 or len(buff) != self.npix():
+            raise UltracamError('CCD.like: buff must be 1D with one element per pixel')
+        wins  = []
+        views = []
+        off   = 0
+        for win in self._data:
+            view = buff[off:off+win.size].reshape((win.ny,win.nx))
+            wins.append(Window(view, win.llx, win.lly, win.xbin, win.ybin))
+            views.append(view)
+            off += win.size
+        ccd = CCD(wins, self.time, self.nxmax, self.nymax, self.good and good, self.head)
+        if buff.flags.c_contiguous:
+            ccd._buff   = buff
+            ccd._views  = tuple(views)
+            ccd._shapes = tuple(view.shape for view in views)
+        return ccd
+
+    def add(self, other, out=None):
+        """
+        Adds 'other' (a CCD or constant) to the CCD, storing the result in the
+        CCD 'out' if set (which can be the CCD itself), else returning a new CCD.
+        """
+        return self._arith(other, np.add, out)
+
+    def sub(self, other, out=None):
+        """
+        Subtracts 'other' (a CCD or constant) from the CCD, storing the result
+        in the CCD 'out' if set (which can be the CCD itself), else returning a
+        new CCD.
+        """
+        return self._arith(other, np.subtract, out)
+
+    def mul(self, other, out=None):
+        """
+        Multiplies the CCD by 'other' (a CCD or constant), storing the result
+        in the CCD 'out' if set (which can be the CCD itself), else returning a
+        new CCD.
+        """
+        return self._arith(other, np.multiply, out)
+
+    def div(self, other, out=None):
+        """
+        Divides the CCD by 'other' (a CCD or constant), storing the result in
+        the CCD 'out' if set (which can be the CCD itself), else returning a
+        new CCD.
+        """
+        return self._arith(other, np.true_divide, out)
+
     def __iadd__(self, other):
         """
         Adds 'other' to the CCD in place (+=). 'other' can be a
         constant or a CCD
         """
-        if isinstance(other, CCD):
-            for win,owin in zip(self._data,other._data):
-                win += owin
-        else:
-            for win in self._data:
-                win += other
-        return self
+        return self._arith(other, np.add, self)
 
     def __isub__(self, other):
         """
         Subtracts 'other' from the CCD in place (-=)
         """
-        if isinstance(other, CCD):
-            for win,owin in zip(self._data,other._data):
-                win -= owin
-        else:
-            for win in self._data:
-                win -= other
-        return self
+        return self._arith(other, np.subtract, self)
 
     def __imul__(self, other):
         """
         Multiplies the CCD by 'other' in place (\*=)
         """
-        if isinstance(other, CCD):
-            for win,owin in zip(self._data,other._data):
-                win *= owin
-        else:
-            for win in self._data:
-                win *= other
-        return self
+        return self._arith(other, np.multiply, self)
 
     def __idiv__(self, other):
         """
         Divides the CCD by 'other' in place (/=)
         """
-        if isinstance(other, CCD):
-            for win,owin in zip(self._data,other._data):
-                win /= owin
-        else:
-            for win in self._data:
-                win /= other
-        return self
+        return self._arith(other, np.true_divide, self)
+
+    # python3 calls itruediv
+    def __itruediv__(self, other):
+        return self.__idiv__(other)
 
     def __add__(self, other):
         """
         Adds 'other' to the CCD (+)
         """
-        twins = []
-        OK = self.good
-        if isinstance(other, CCD):
-            OK = OK and other.good
-            for win,owin in zip(self._data,other._data):
-                twins.append(win + owin)
-        else:
-            for win in self._data:
-                twins.append(win + other)
-        return CCD(twins, self.time, self.nxmax, self.nymax, OK, self.head)
+        return self._arith(other, np.add)
 
     def __sub__(self, other):
         """
         Subtracts 'other' from the CCD (-)
         """
-        twins = []
-        OK = self.good
-        if isinstance(other, CCD):
-            OK = OK and other.good
-            for win,owin in zip(self._data,other._data):
-                twins.append(win - owin)
-        else:
-            for win in self._data:
-                twins.append(win - other)
-        return CCD(twins, self.time, self.nxmax, self.nymax, OK, self.head)
+        return self._arith(other, np.subtract)
 
     def __mul__(self, other):
         """
         Multiplies CCD by 'other' (*)
         """
-        twins = []
-        OK = self.good
-        if isinstance(other, CCD):
-            OK = OK and other.good
-            for win,owin in zip(self._data,other._data):
-                twins.append(win * owin)
-        else:
-            for win in self._data:
-                twins.append(win * other)
-        return CCD(twins, self.time, self.nxmax, self.nymax, OK, self.head)
+        return self._arith(other, np.multiply)
 
     def __div__(self, other):
         """
         Divides CCD by 'other' (/)
         """
-        twins = []
-        OK = self.good
-        if isinstance(other, CCD):
-            OK = OK and other.good
-            for win,owin in zip(self._data,other._data):
-                twins.append(win / owin)
-        else:
-            other.good = True
-            for win in self._data:
-                twins.append(win / other)
-        return CCD(twins, self.time, self.nxmax, self.nymax, OK, self.head)
+        return self._arith(other, np.true_divide)
 
     # python3 calls truediv
     def __truediv__(self,other):
         return self.__div__(other)
-        
+
     def __radd__(self, other):
         """
         Defines other + CCD
         """
-        twins = []
-        for win in self._data:
-            twins.append(other + win)
-        return CCD(twins, self.time, self.nxmax, self.nymax, self.good and other.good, self.head)
+        return self._arith(other, np.add, reverse=True)
 
     def __rsub__(self, other):
         """
         Defines other - CCD
         """
-        twins = []
-        for win in self._data:
-            twins.append(other - win)
-        return CCD(twins, self.time, self.nxmax, self.nymax, self.good and other.good, self.head)
+        return self._arith(other, np.subtract, reverse=True)
 
     def __rmul__(self, other):
         """
         Defines other * CCD
         """
-        twins = []
-        for win in self._data:
-            twins.append(other * win)
-        return CCD(twins, self.time, self.nxmax, self.nymax, self.good and other.good, self.head)
+        return self._arith(other, np.multiply, reverse=True)
 
     def __rdiv__(self, other):
         """
-        Defines other * CCD
+        Defines other / CCD
         """
-        twins = []
-        for win in self._data:
-            twins.append(other / win)
-        return CCD(twins, self.time, self.nxmax, self.nymax, self.good and other.good, self.head)
+        return self._arith(other, np.true_divide, reverse=True)
 
     def __rtruediv__(self, other):
         return self.__rdiv__(other)
-        
+
     def __str__(self):
         """
         Generates readable summary of a CCD
@@ -0,0 +1,179 @@
+"""
+Calibration of raw frames: bias subtraction, dark subtraction and flat
+fielding in one step.
+
+Done with MCCD arithematic, calibrating a frame read with Rdata(flt=True)
+creates a new full-frame array at each of the conversion to floats, the
+bias subtraction, the scaling and subtraction of the dark and the flat
+field division. A Calib instead crops the calibration frames to the format
+of the data once, combining the bias and scaled dark into a single offset
+and turning the flat into its reciprocal, then writes each frame straight
+from the raw unsigned 2-byte data into one float32 array with two in-place
+numpy operations. Passed to Rdata, it is applied as frames are read::
+
+  calib = Calib(bias, dark, flat)
+  for mccd in Rdata('run045', calib=calib):
+     ...
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+    import numpy as np
+except ImportError:
+    print('Failed to import numpy; some routines will fail')
+
+from trm.ultracam.Utils import thread_pool
+from trm.ultracam.UErrors import UltracamError
+
+# number of prepared offset / flat pairs kept; see Calib.plan
+CALIB_NPLANS = 64
+
+class Calib(object):
+    """
+    Applies bias, dark and flat field frames (MCCDs), any of which may be
+    None, to data. A calibrated pixel is
+
+      (data - bias - dark*expose/dexpose) / flat
+
+    where expose and dexpose are the exposure times of the CCD of the data
+    and of the dark. The dark should therefore have had the bias subtracted,
+    and the flat should have had the bias subtracted and be normalised, e.g.
+    to a median of 1. Pixels where the flat is zero are set to zero. expose
+    is rounded to 4 significant figures so that the jitter in measured
+    exposure times from frame to frame does not force the offset to be
+    recomputed for every frame.
+
+    Calibration frames can be of larger format than the data, e.g. full
+    frame, and are cropped to match (see CCD.cropTo). This is done once for
+    each format and exposure time met, with the results kept.
+
+    Attributes:
+
+      bias, dark, flat -- the calibration MCCDs, or None
+    """
+
+    def __init__(self, bias=None, dark=None, flat=None):
+        self.bias   = bias
+        self.dark   = dark
+        self.flat   = flat
+        self._plans = {}
+
+    def plan(self, ccd, nc):
+        """
+        Returns (offset, rflat), the combined bias and dark and the reciprocal
+        of the flat for CCD number nc of a frame, as 1D float32 arrays in the
+        pixel order of CCD.pack to match ccd, or None where not needed.
+        """
+        expose = None
+        if self.dark is not None and ccd.time is not None and ccd.time.expose:
+            expose = float('{0:.4g}'.format(ccd.time.expose))
+        key    = (nc, ccd.fsig, expose)
+        try:
+            return self._plans[key]
+        except KeyError:
+            pass
+
+        def crop(mccd, name):
+            try:
+                cal = mccd[nc]
+            except IndexError:
+                raise UltracamError('Calib.plan: ' + name + ' has no CCD ' + str(nc+1))
+            if cal.fsig != ccd.fsig:
+                try:
+                    cal = cal.cropTo(ccd)
+                except UltracamError:
+                    raise UltracamError('Calib.plan: could not crop CCD ' + str(nc+1) + ' of the ' +
+                                        name + ' to the format of the data')
+            return cal._pixels().astype(np.float32)
+
+        offset = None
+        if self.bias is not None:
+            offset = crop(self.bias, 'bias')
+        if self.dark is not None:
+            dexpose = self.dark[nc].time.expose if self.dark[nc].time is not None else None
+            if expose is None or not dexpose:
+                raise UltracamError('Calib.plan: exposure times are needed to scale the dark')
+            dark = crop(self.dark, 'dark')
+            dark *= expose/dexpose
+            offset = dark if offset is None else offset + dark
+
+        rflat = None
+        if self.flat is not None:
+            flat = crop(self.flat, 'flat')
+            rflat = np.zeros_like(flat)
+            np.divide(1., flat, out=rflat, where=flat != 0.)
+
+        if len(self._plans) >= CALIB_NPLANS:
+            self._plans.clear()
+        self._plans[key] = (offset, rflat)
+        return (offset, rflat)
+
+    def apply(self, ccd, nc, out=None):
+        """
+        Returns a calibrated version of a CCD, with its data stored as float32
+        in one contiguous array (see CCD.pack). The CCD itself is unchanged
+        and can hold data of any type, e.g. views of raw unsigned 2-byte data,
+        which are converted as they are calibrated.
+
+        ccd -- the CCD
+
+        nc  -- its number within the frame (from 0), to pick the CCD of the
+               calibration frames.
+
+        out -- 1D float32 array with one element per pixel to store the
+               result in, or None to create one.
+        """
+        offset, rflat = self.plan(ccd, nc)
+        npix = ccd.npix()
+        if out is None:
+            out = np.empty(npix, np.float32)
+        elif out.dtype != np.float32 or out.shape != (npix,):
+            raise UltracamError('Calib.apply: out must be a 1D float32 array with one element per pixel')
+
+        # conversion and subtraction in one go, window by window
+        off = 0
+        for win in ccd:
+            view = out[off:off+win.size].reshape((win.ny,win.nx))
+            if offset is None:
+                np.copyto(view, win.data, casting='unsafe')
+            else:
+                np.subtract(win.data, offset[off:off+win.size].reshape(view.shape),
+                            out=view, casting='unsafe')
+            off += win.size
+
+        if rflat is not None:
+            np.multiply(out, rflat, out=out)
+        return ccd.like(out)
+
+    def __call__(self, mccd, nthreads=1):
+        """
+        Returns a calibrated copy of an MCCD, leaving it unchanged.
+
+        nthreads -- number of threads to calibrate the CCDs in parallel
+        """
+        def apply(nc):
+            return self.apply(mccd[nc], nc)
+
+        if nthreads > 1 and len(mccd) > 1:
+            ccds = thread_pool(min(nthreads, len(mccd))).map(apply, range(len(mccd)))
+        else:
+            ccds = [apply(nc) for nc in range(len(mccd))]
+        return mccd.__class__(ccds, mccd.head)
+
+if __name__ == '__main__':
+    from trm.ultracam.Window import Window
+    from trm.ultracam.Time import Time
+    from trm.ultracam.CCD import CCD
+    from trm.ultracam.MCCD import MCCD
+
+    def frame(value, dtype, expose=10.):
+        wins = [Window(np.full((10,20), value, dtype), 11, 21, 1, 1)]
+        return MCCD([CCD(wins, Time(56000., expose, True, ''), 100, 100, True, None)], None)
+
+    calib = Calib(frame(100., np.float32), frame(5., np.float32, 5.), frame(2., np.float32))
+    cal   = calib(frame(1210, np.uint16))
+    assert cal[0].buffer.dtype == np.float32
+    assert (cal[0].buffer == 550.).all()
+    print('test passed')
@@ -0,0 +1,312 @@
+"""
+Reading raw data files compressed with gzip, bzip2 or xz, i.e.
+run###.dat.gz, run###.dat.bz2 or run###.dat.xz, which Rdata and Rtime pick
+up if there is no plain .dat file (see open_dat in Raw.py).
+
+These formats can only be decompressed sequentially, so random access is
+helped in two ways. First, the number of frames and the timing bytes of
+every frame are stored in a small sidecar file (the compressed file name
+plus '.uidx'), built the first time they are needed by a complete pass
+through the file. With it, nframe=0, ntotal and reading times need no
+decompression. Second, for gzip files, the state of the decompressor is
+saved at intervals during each pass, so that later seeks go back only as
+far as the nearest saved state rather than to the start of the file. These
+checkpoints are only kept in memory as the state of zlib cannot be saved to
+disk from Python. bzip2 and xz files restart from the start when seeking
+backwards.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import bz2
+import zlib
+import struct
+import tempfile
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from trm.ultracam.UErrors import UltracamError
+
+# extensions recognised and the sidecar index
+CDAT_EXTENSIONS = ('.gz', '.bz2', '.xz')
+CDAT_INDEX      = '.uidx'
+CDAT_MAGIC      = b'UCDX'
+CDAT_VERSION    = 1
+CDAT_HEAD       = struct.Struct('<4siqdiiq')
+
+def find_cdat(run):
+    """
+    Returns the name of a compressed .dat file of a run if there is one, else
+    None. Extensions are tried in the order of CDAT_EXTENSIONS.
+    """
+    for ext in CDAT_EXTENSIONS:
+        if os.path.exists(run + '.dat' + ext):
+            return run + '.dat' + ext
+    return None
+
+class CdatFile(object):
+    """
+    Read-only, seekable file-like object which presents a gzip, bzip2 or xz
+    compressed .dat file as the .dat file itself. It supports read, readinto,
+    seek and tell, which is all that Rdata and Rtime need.
+
+    Attributes:
+
+      name        -- name of the compressed file
+      framesize   -- bytes per frame
+      headerwords -- number of 2-byte timing words per frame
+      nframe      -- number of complete frames, None until the index is built
+    """
+
+    def __init__(self, fname, framesize, headerwords, chunk=1024*1024, spacing=16*1024*1024):
+        """
+        fname       -- the compressed file
+
+        framesize   -- bytes per frame
+
+        headerwords -- number of 2-byte timing words per frame
+
+        chunk       -- number of compressed bytes to decompress at a time
+
+        spacing     -- approximate number of uncompressed bytes between saved
+                       states of gzip decompression.
+        """
+        if fname.endswith('.gz'):
+            self.kind = 'gz'
+        elif fname.endswith('.bz2'):
+            self.kind = 'bz2'
+        elif fname.endswith('.xz'):
+            if lzma is None:
+                raise UltracamError('CdatFile: lzma not available to read ' + fname)
+            self.kind = 'xz'
+        else:
+            raise UltracamError('CdatFile: could not recognise the compression of ' + fname)
+
+        self.name        = fname
+        self.framesize   = framesize
+        self.headerwords = headerwords
+        self.nframe      = None
+        self.closed      = False
+        self._chunk      = chunk
+        self._spacing    = spacing
+        self._raw        = open(fname, 'rb')
+        self._checks     = []
+        self._tbytes     = None
+        self._pos        = 0
+        self._read_index()
+        self._restart(None)
+
+    # decompression
+
+    def _decompressor(self):
+        if self.kind == 'gz':
+            return zlib.decompressobj(16+zlib.MAX_WBITS)
+        elif self.kind == 'bz2':
+            return bz2.BZ2Decompressor()
+        else:
+            return lzma.LZMADecompressor()
+
+    def _restart(self, check):
+        """
+        Restarts decompression, from the start or from a checkpoint
+        """
+        if check is None:
+            self._raw.seek(0)
+            self._dobj = self._decompressor()
+            self._upos = 0
+        else:
+            self._upos, rpos, dobj = check
+            self._raw.seek(rpos)
+            self._dobj = dobj.copy()
+        # _pend holds decompressed bytes from uncompressed position _upos,
+        # of which the first _poff have been passed
+        self._pend = b''
+        self._poff = 0
+        self._eof  = False
+
+    def _feed(self):
+        """
+        Decompresses the next chunk, returning False at the end of the file
+        """
+        if self._eof:
+            return False
+        cbuff = self._raw.read(self._chunk)
+        if not cbuff:
+            self._eof = True
+            return False
+
+        out = [self._pend[self._poff:]]
+        while cbuff:
+            out.append(self._dobj.decompress(cbuff))
+            if self._dobj.eof:
+                # end of a stream; files can hold several, one after another
+                cbuff = self._dobj.unused_data
+                self._dobj = self._decompressor()
+            else:
+                cbuff = b''
+        self._upos += self._poff
+        self._pend  = b''.join(out)
+        self._poff  = 0
+
+        # save the state of gzip decompression at intervals
+        end = self._upos + len(self._pend)
+        if self.kind == 'gz' and end >= (self._checks[-1][0] if self._checks else 0) + self._spacing:
+            self._checks.append((end, self._raw.tell(), self._dobj.copy()))
+        return True
+
+    def _data(self, pos, nbytes):
+        """
+        Returns up to nbytes decompressed bytes starting at position pos
+        """
+        if pos < self._upos:
+            # go back to the nearest checkpoint before pos
+            check = None
+            for chk in self._checks:
+                if chk[0] > pos:
+                    break
+                check = chk
+            self._restart(check)
+
+        while True:
+            off = pos - self._upos
+            if off >= len(self._pend):
+                # skipping forward: nothing pending is needed
+                self._poff = len(self._pend)
+                if not self._feed():
+                    return b''
+            else:
+                # nothing before pos is needed again: _feed drops it
+                self._poff = off
+                if off + nbytes <= len(self._pend) or not self._feed():
+                    return self._pend[off:off+nbytes]
+
+    # index
+
+    def _read_index(self):
+        """
+        Reads the sidecar index if it exists and matches the file
+        """
+        try:
+            with open(self.name + CDAT_INDEX, 'rb') as fobj:
+                buff = fobj.read()
+            magic, version, size, mtime, framesize, headerwords, nframe = \
+                CDAT_HEAD.unpack_from(buff)
+        except (IOError, OSError, struct.error):
+            return
+
+        stat = os.stat(self.name)
+        hbytes = 2*self.headerwords
+        if magic == CDAT_MAGIC and version == CDAT_VERSION and size == stat.st_size \
+                and mtime == stat.st_mtime and framesize == self.framesize and \
+                headerwords == self.headerwords and len(buff) == CDAT_HEAD.size + hbytes*nframe:
+            self.nframe  = nframe
+            self._tbytes = buff[CDAT_HEAD.size:]
+
+    def index(self):
+        """
+        Makes sure the number of frames and their timing bytes are known,
+        making a complete pass through the file if necessary. This saves the
+        sidecar index if possible. Returns the number of frames.
+        """
+        if self.nframe is not None:
+            return self.nframe
+
+        hbytes = 2*self.headerwords
+        tbytes = []
+        pos    = 0
+        while True:
+            frame = self._data(pos, self.framesize)
+            if len(frame) < self.framesize:
+                break
+            tbytes.append(frame[:hbytes])
+            pos += self.framesize
+        self.nframe  = len(tbytes)
+        self._tbytes = b''.join(tbytes)
+
+        # save, ignoring failure (e.g. a read-only archive)
+        stat = os.stat(self.name)
+        try:
+            fd, tname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.name)))
+            with os.fdopen(fd, 'wb') as fobj:
+                fobj.write(CDAT_HEAD.pack(CDAT_MAGIC, CDAT_VERSION, stat.st_size, stat.st_mtime,
+                                          self.framesize, self.headerwords, self.nframe))
+                fobj.write(self._tbytes)
+            os.rename(tname, self.name + CDAT_INDEX)
+        except (IOError, OSError):
+            pass
+
+        return self.nframe
+
+    # file interface
+
+    def size(self):
+        """
+        Size of the uncompressed file, counting complete frames only
+        """
+        return self.index()*self.framesize
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        elif whence == 2:
+            self._pos = self.size() + offset
+        else:
+            raise UltracamError('CdatFile.seek: whence = ' + str(whence) + ' not recognised')
+        if self._pos < 0:
+            self._pos = 0
+            raise IOError('CdatFile.seek: attempt to seek before start of file')
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, nbytes=-1):
+        """
+        Reads up to nbytes bytes from the current position, fewer if the end of
+        the file is reached. nbytes < 0 reads to the end of the file.
+        """
+        if nbytes < 0:
+            nbytes = max(0, self.size() - self._pos)
+
+        hbytes = 2*self.headerwords
+        nf, start = divmod(self._pos, self.framesize)
+        if self._tbytes is not None and start < hbytes and nbytes <= hbytes - start:
+            # timing bytes from the index
+            buff = self._tbytes[nf*hbytes+start:nf*hbytes+start+nbytes]
+        else:
+            buff = self._data(self._pos, nbytes)
+        self._pos += len(buff)
+        return buff
+
+    def readinto(self, buff):
+        """
+        Reads into a pre-allocated, writable buffer, returning the number of
+        bytes read.
+        """
+        mv   = memoryview(buff)
+        if mv.ndim != 1 or mv.itemsize != 1:
+            raise UltracamError('CdatFile.readinto: buffer must be 1D and of bytes')
+        data = self.read(len(mv))
+        mv[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._raw.close()
+        self._pend   = b''
+        self._checks = []
+        self.closed  = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+if __name__ == '__main__':
+    print('test passed')
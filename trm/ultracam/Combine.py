@@ -0,0 +1,214 @@
+"""
+Combining the frames of a run, e.g. to make master bias, dark and flat field
+frames.
+
+Frames are read one at a time and their pixels appended as rows of a
+scratch file on disk, so that however many frames there are, only one is in
+memory while reading. The combination is then carried out over chunks of
+pixels, each small enough that all frames of the chunk fit within a set
+amount of memory, with chunks reduced in parallel in a pool of threads
+(numpy's sorting and arithematic release the GIL). Along with the combined
+frame, a noise frame is computed giving the estimated uncertainty of each
+combined pixel from the scatter of the frames.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:
+    print('Failed to import numpy; some routines will fail')
+
+from trm.ultracam.Constants import *
+from trm.ultracam.MCCD import MCCD
+from trm.ultracam.Raw import Rdata
+from trm.ultracam.Calib import Calib
+from trm.ultracam.Utils import thread_pool
+from trm.ultracam.UErrors import UltracamError, UendError
+
+COMBINE_METHODS = ('mean', 'median', 'clipped', 'minmax')
+
+def reduce_stack(data, method='median', nsigma=3., nreject=1, maxiter=10):
+    """
+    Combines a stack of frames along its first axis, returning (value, noise)
+    arrays, the noise being the estimated uncertainty of each value.
+
+    data    -- 2D float array of nframe rows. It may be modified.
+
+    method  -- 'mean', 'median', 'clipped' (mean after iterative rejection
+               of points more than nsigma RMS from the mean), or 'minmax'
+               (mean after rejecting the nreject lowest and nreject highest
+               values of each pixel)
+
+    nsigma  -- rejection threshold for 'clipped'
+
+    nreject -- number of values rejected at each end for 'minmax'
+
+    maxiter -- maximum number of rejection cycles for 'clipped'
+    """
+    nframe = len(data)
+    if method == 'mean':
+        value = data.mean(axis=0)
+        if nframe > 1:
+            noise = data.std(axis=0, ddof=1)/math.sqrt(nframe)
+        else:
+            noise = np.zeros_like(value)
+
+    elif method == 'median':
+        value = np.median(data, axis=0)
+        if nframe > 1:
+            # the median is noisier than the mean by sqrt(pi/2) for gaussian data
+            noise = math.sqrt(math.pi/2.)*data.std(axis=0, ddof=1)/math.sqrt(nframe)
+        else:
+            noise = np.zeros_like(value)
+
+    elif method == 'clipped':
+        if nframe > 2:
+            for n in range(maxiter):
+                mean = np.nanmean(data, axis=0)
+                std  = np.nanstd(data, axis=0, ddof=1)
+                with np.errstate(invalid='ignore'):
+                    bad = np.abs(data - mean) > nsigma*std
+                if not bad.any():
+                    break
+                data[bad] = np.nan
+            value = np.nanmean(data, axis=0)
+            nok   = np.sum(~np.isnan(data), axis=0)
+            noise = np.nanstd(data, axis=0, ddof=1)/np.sqrt(nok)
+        else:
+            return reduce_stack(data, 'mean')
+
+    elif method == 'minmax':
+        if nframe <= 2*nreject:
+            raise UltracamError('reduce_stack: too few frames (' + str(nframe) +
+                                ') to reject ' + str(nreject) + ' from each end')
+        data  = np.sort(data, axis=0)[nreject:nframe-nreject]
+        return reduce_stack(data, 'mean')
+
+    else:
+        raise UltracamError('reduce_stack: method = ' + str(method) + ' not recognised')
+
+    return (value, noise)
+
+def combine(run, method='median', first=1, last=0, bias=None, norm=False, nsigma=3.,
+            nreject=1, maxmem=256, nthreads=4, server=False, tdir=None):
+    """
+    Combines frames of a run, returning (comb, noise) MCCDs of the combined
+    frame and its uncertainty. All frames are converted to floats.
+
+    run      -- run to read, e.g. 'run045'
+
+    method   -- combination method: 'mean', 'median', 'clipped' or 'minmax'
+                (see reduce_stack)
+
+    first    -- first frame to include
+
+    last     -- last frame to include, 0 for the last in the run
+
+    bias     -- MCCD to subtract from each frame before combining, or None. It
+                is cropped to the format of the run if necessary.
+
+    norm     -- True to divide each CCD of each frame by its median before
+                combining, e.g. for flat fields taken at varying levels.
+
+    nsigma   -- rejection threshold for 'clipped'
+
+    nreject  -- number rejected at each end of each pixel for 'minmax'
+
+    maxmem   -- approximate memory to use for combining, MB
+
+    nthreads -- number of chunks of pixels to combine in parallel, and of
+                threads used to read frames (see Rdata)
+
+    server   -- True to read the run from the FileServer
+
+    tdir     -- directory for the scratch file; defaults to the system's
+                temporary directory.
+    """
+    if method not in COMBINE_METHODS:
+        raise UltracamError('combine: method = ' + str(method) + ' not recognised')
+
+    # the bias is subtracted as frames are decoded
+    calib = Calib(bias) if bias is not None else None
+    rdat  = Rdata(run, first, flt=True, server=server, calib=calib, nthreads=nthreads)
+    if last == 0:
+        last = rdat.ntotal()
+    if last < first:
+        raise UltracamError('combine: no frames to combine from ' + str(run))
+    nframe = last - first + 1
+
+    with tempfile.TemporaryFile(dir=tdir) as fobj:
+
+        # read frames into the stack
+        stack = None
+        nread = 0
+        for nf in range(first, last+1):
+            try:
+                mccd = rdat(nf)
+            except UendError:
+                break
+
+            if stack is None:
+                template = mccd
+                offsets  = np.cumsum([0] + [ccd.npix() for ccd in mccd])
+                stack    = np.memmap(fobj, np.float32, 'w+', shape=(nframe, offsets[-1]))
+            elif mccd.fsig != template.fsig:
+                raise UltracamError('combine: format of frame ' + str(nf) + ' differs from frame ' +
+                                    str(first))
+
+            for nc, ccd in enumerate(mccd):
+                if norm:
+                    ccd /= ccd.median()
+                stack[nread,offsets[nc]:offsets[nc+1]] = ccd._pixels()
+            nread += 1
+
+        if nread == 0:
+            raise UltracamError('combine: no frames could be read from ' + str(run))
+
+        # combine in chunks of pixels, with room for the working copies
+        # made by the reductions
+        npix  = offsets[-1]
+        comb  = np.empty(npix, np.float32)
+        noise = np.empty(npix, np.float32)
+        nchunk = max(1, int(1024*1024*maxmem) // (16*nread*max(1,nthreads)))
+
+        def reduce_chunk(p1):
+            p2 = min(npix, p1+nchunk)
+            comb[p1:p2], noise[p1:p2] = reduce_stack(np.array(stack[:nread,p1:p2]),
+                                                     method, nsigma, nreject)
+
+        if nthreads > 1:
+            thread_pool(nthreads).map(reduce_chunk, range(0, npix, nchunk))
+        else:
+            for p1 in range(0, npix, nchunk):
+                reduce_chunk(p1)
+        del stack
+
+    # build the output frames
+    if template.head is not None:
+        head = template.head.copy()
+        head.add_entry('Combine', 'Frame combination')
+        head.add_entry('Combine.method', method, ITYPE_STRING, 'combination method')
+        head.add_entry('Combine.first', first, ITYPE_INT, 'first frame combined')
+        head.add_entry('Combine.nframe', nread, ITYPE_INT, 'number of frames combined')
+    else:
+        head = None
+
+    cccds, nccds = [], []
+    for nc, ccd in enumerate(template):
+        cccds.append(ccd.like(comb[offsets[nc]:offsets[nc+1]].copy()))
+        nccds.append(ccd.like(noise[offsets[nc]:offsets[nc+1]].copy()))
+    return (MCCD(cccds, head), MCCD(nccds, head))
+
+if __name__ == '__main__':
+    data = np.random.normal(100., 1., (11, 50)).astype(np.float32)
+    data[3,5] = 1000.
+    for method in COMBINE_METHODS:
+        value, noise = reduce_stack(data.copy(), method)
+        assert value.shape == (50,)
+    assert abs(reduce_stack(data.copy(), 'clipped')[0][5] - 100.) < 2.
+    print('test passed')
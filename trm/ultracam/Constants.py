@@ -168,6 +168,9 @@ TNAME = {ITYPE_DOUBLE : 'double', ITYPE_INT : 'int', ITYPE_UINT : 'uint',
 # ucm magic number
 MAGIC           = 47561009
 
+# magic number of multi-frame ucm containers (see Mucm.py)
+MAGIC_MUCM      = 47561010
+
 # Bit masks needed for Meinberg GPS data.
 # See description in read_header.cc in pipeline for more
 PCPS_FREER            = 0x01   # DCF77 clock running on xtal, GPS receiver has not verified its position
@@ -0,0 +1,170 @@
+"""
+Following runs as they are written, for use during observing
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import re
+import time
+import xml.parsers.expat
+from six.moves import urllib
+
+from trm.ultracam.Raw import Rdata, Rtime
+from trm.ultracam.Server import get_nframe_from_server, RunList
+from trm.ultracam.UErrors import UltracamError, PowerOnOffError
+
+RUN_RE = re.compile(r'^run\d\d\d\.xml$')
+
+def local_runs(path='.'):
+    """
+    Returns a sorted list of the runs (e.g. 'run045') in a local directory,
+    as judged from the presence of the xml files.
+
+    path -- directory to look in
+    """
+    runs = [fname[:-4] for fname in os.listdir(path) if RUN_RE.match(fname)]
+    runs.sort()
+    return runs
+
+def complete_frames(rhead, guard=0):
+    """
+    Returns the number of complete frames of a run, local or on the server,
+    judged by the number of whole framesize blocks available. Frames in the
+    process of being written are therefore never counted.
+
+    rhead -- the Rhead (or Rdata/Rtime) of the run.
+
+    guard -- number of the most recent complete frames to hold back, e.g. if
+             the writer is not trusted to write frames atomically.
+    """
+    if rhead.server:
+        nframe = get_nframe_from_server(rhead.run)
+    else:
+        fname = rhead.run + '.dat'
+        nframe = os.path.getsize(fname) // rhead.framesize if os.path.exists(fname) else 0
+    return max(0, nframe - guard)
+
+def follow(run=None, server=False, path='.', times=False, flt=True, ccd=False,
+           latest=False, nbatch=0, guard=0, pmin=0.1, pmax=5., tick=None, onerror=None):
+    """
+    Generator which follows a run while it is being written, yielding frames
+    as soon as they are complete. It polls with an adaptive backoff, waiting
+    pmin seconds after finding new data, doubling the wait each time nothing
+    is found, up to pmax seconds. Only new data is read on each cycle.
+
+    Arguments:
+
+      run     -- run to follow, e.g. 'run045'. If None, the newest run is
+                 followed and the generator switches automatically to any
+                 newer run that appears, after reading the last frames of
+                 the old one. Power on/offs are skipped.
+
+      server  -- True to get the data via the FileServer, else from local disk
+
+      path    -- directory of the runs for local disk access
+
+      times   -- True to yield just the timing information of each frame as
+                 returned by Rtime, rather than the frames themselves.
+
+      flt     -- read frames as floats (see Rdata)
+
+      ccd     -- read ULTRASPEC frames as CCDs (see Rdata)
+
+      latest  -- True to skip straight to the most recent complete frame each
+                 cycle, rather than reading all of them; suitable for monitoring.
+
+      nbatch  -- maximum number of frames to read per poll cycle, 0 for no limit
+
+      guard   -- number of the most recent complete frames to hold back (see
+                 complete_frames).
+
+      pmin    -- minimum polling interval, seconds
+
+      pmax    -- maximum polling interval, seconds
+
+      tick    -- if not None, a (run, None, None) tuple is yielded each time
+                 this many seconds pass without a new frame, allowing the caller
+                 to act when nothing is happening. 'run' is None if there is
+                 nothing to follow yet.
+
+      onerror -- function called with the exception if accessing the data
+                 fails with an UltracamError or a URL or IO error. The cycle
+                 then counts as one with no new data. If None, such errors
+                 are raised.
+
+    Yields (run, nframe, item) tuples where 'item' is whatever Rdata or Rtime
+    returns when called for frame 'nframe'.
+    """
+
+    rlist   = RunList() if server and run is None else None
+    current = None
+    reader  = None
+    nread   = 0
+    skip    = set()
+    wait    = pmin
+    lastnew = time.time()
+
+    while True:
+
+        nnew = 0
+        try:
+
+            # see if there is a newer run
+            newer = None
+            if run is None:
+                runs  = rlist.names() if server else local_runs(path)
+                runs  = [r for r in runs if r not in skip]
+                if len(runs) and runs[-1] != current:
+                    newer = runs[-1]
+            elif current is None:
+                newer = run
+
+            # read any new frames of the current run (draining it if
+            # about to switch)
+            if reader is not None:
+                ntot = complete_frames(reader, guard)
+                if latest and ntot > nread:
+                    nread = ntot - 1
+                nlast = ntot if newer or not nbatch else min(ntot, nread+nbatch)
+                while nread < nlast:
+                    item   = reader(nread+1)
+                    nread += 1
+                    nnew  += 1
+                    yield (current, nread, item)
+
+            # switch to newer run
+            if newer is not None:
+                rname = newer if server else os.path.join(path, newer)
+                if not server and not os.path.exists(rname + '.dat'):
+                    # run started but no data file yet
+                    newer = None
+
+            if newer is not None:
+                try:
+                    reader  = Rtime(rname, server=server) if times else \
+                              Rdata(rname, flt=flt, server=server, ccd=ccd)
+                    current = newer
+                    nread   = 0
+                    nnew   += 1
+                except PowerOnOffError:
+                    skip.add(newer)
+                except xml.parsers.expat.ExpatError:
+                    # xml file not yet fully written; try again next cycle
+                    pass
+
+        except (UltracamError, urllib.error.URLError, IOError) as err:
+            if onerror is None: raise
+            onerror(err)
+
+        # adaptive backoff
+        now = time.time()
+        if nnew:
+            wait    = pmin
+            lastnew = now
+        else:
+            if tick is not None and now - lastnew >= tick:
+                lastnew = now
+                yield (current, None, None)
+            wait = min(2*wait, pmax)
+            time.sleep(wait)
@@ -0,0 +1,256 @@
+"""
+A minimal stand-in for the ATC FileServer, serving runs from a local
+directory over HTTP. It is not a replacement for the real thing, but it
+allows the server-mode code (Rdata(server=True), follow, talert etc) to be
+tested away from the telescope, and it is where extensions to the server
+protocol are tried out. The actions recognised are:
+
+  dir             -- list the runs in a directory, with their numbers of
+                     frames. Supports conditional requests via ETags and
+                     Last-Modified, which change only when the runs listed
+                     do, not as frames are added, so the frame counts of a
+                     cached listing may be out of date.
+  get_xml         -- return the xml file of a run
+  get_num_frames  -- return the number of complete frames of a run
+  get_frame       -- return frame 'frame' (starting from 0), timing and data
+  get_timing      -- return just the timing bytes of 'nframe' frames starting
+                     at 'frame' (starting from 0) in one go. Fewer frames are
+                     returned if the run does not have them all. Not yet
+                     supported by the real FileServer.
+
+For example, URL + 'run045?action=get_frame&frame=9' returns the 10th frame
+of run045.
+
+Requests without an action return the file named, honouring single HTTP
+Range requests, as a static web server would. This allows the Range reader
+(see Range.py) to be tested.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import re
+import hashlib
+import email.utils
+import threading
+import xml.dom.minidom
+import xml.parsers.expat
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse, parse_qs
+
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+class FileServerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Request handler for the stand-in FileServer. The directory served is
+    taken from the 'root' attribute of the server.
+    """
+
+    def log_message(self, format, *args):
+        # keep quiet unless asked
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_HEAD(self):
+        name, query = self._parse()
+        if name is None:
+            return
+        if not os.path.isfile(name):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(os.path.getsize(name)))
+        self.send_header('Accept-Ranges', 'bytes' if self.server.ranges else 'none')
+        self.end_headers()
+
+    def do_GET(self):
+        name, query = self._parse()
+        if name is None:
+            return
+        action = query.get('action', [None])[0]
+
+        try:
+            if action is None:
+                self._static(name)
+            elif action == 'dir':
+                self._dir(name)
+            elif action == 'get_xml':
+                with open(name + '.xml', 'rb') as fobj:
+                    self._send(fobj.read(), 'text/xml')
+            elif action == 'get_num_frames':
+                framesize, headerwords = self._format(name)
+                nframe = os.path.getsize(name + '.dat') // framesize
+                self._send(('<?xml version="1.0"?>\n<get_num_frames nframes="' +
+                            str(nframe) + '"/>\n').encode('utf-8'), 'text/xml')
+            elif action == 'get_frame':
+                framesize, headerwords = self._format(name)
+                nf = int(query['frame'][0])
+                buff = self._read(name, nf*framesize, framesize)
+                if len(buff) != framesize:
+                    self.send_error(404, 'frame ' + str(nf) + ' not found')
+                else:
+                    self._send(buff)
+            elif action == 'get_timing':
+                framesize, headerwords = self._format(name)
+                nf = int(query['frame'][0])
+                nframe = int(query.get('nframe', ['1'])[0])
+                nbytes = 2*headerwords
+                ntot   = os.path.getsize(name + '.dat') // framesize
+                tbytes = [self._read(name, n*framesize, nbytes)
+                          for n in range(nf, min(nf+nframe, ntot))]
+                self._send(b''.join(tbytes))
+            else:
+                self.send_error(400, 'action = ' + str(action) + ' not recognised')
+        except (IOError, OSError, KeyError, ValueError) as err:
+            self.send_error(404, str(err))
+
+    def _parse(self):
+        # path on disk and query, guarding against attempts to escape the root
+        url  = urlparse(self.path)
+        root = os.path.abspath(self.server.root)
+        name = os.path.abspath(os.path.join(root, url.path.lstrip('/')))
+        if name != root and not name.startswith(root + os.sep):
+            self.send_error(403)
+            return (None, None)
+        return (name, parse_qs(url.query))
+
+    def _static(self, name):
+        # a plain file, or part of one if a Range is specified
+        size = os.path.getsize(name)
+        mat  = RANGE_RE.match(self.headers.get('Range', ''))
+        if not self.server.ranges or not mat or mat.group(1) == mat.group(2) == '':
+            with open(name, 'rb') as fobj:
+                self._send(fobj.read())
+            return
+
+        if mat.group(1) == '':
+            # suffix range: the last N bytes
+            first = max(0, size - int(mat.group(2)))
+            last  = size - 1
+        else:
+            first = int(mat.group(1))
+            last  = size - 1 if mat.group(2) == '' else min(size - 1, int(mat.group(2)))
+
+        if first >= size or first > last:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */' + str(size))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        with open(name, 'rb') as fobj:
+            fobj.seek(first)
+            buff = fobj.read(last-first+1)
+        self.send_response(206)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Range', 'bytes ' + str(first) + '-' + str(last) + '/' + str(size))
+        self.send_header('Content-Length', str(len(buff)))
+        self.end_headers()
+        self.wfile.write(buff)
+
+    def _send(self, buff, ctype='application/octet-stream'):
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(buff)))
+        self.end_headers()
+        self.wfile.write(buff)
+
+    def _read(self, name, offset, nbytes):
+        with open(name + '.dat', 'rb') as fobj:
+            fobj.seek(offset)
+            return fobj.read(nbytes)
+
+    def _format(self, name):
+        # framesize and headerwords from the xml file, cached by the server
+        if name not in self.server.formats:
+            udom = xml.dom.minidom.parse(name + '.xml')
+            node = udom.getElementsByTagName('data_status')[0]
+            framesize   = int(node.getAttribute('framesize'))
+            headerwords = int(node.getElementsByTagName('header_status')[0].getAttribute('headerwords'))
+            self.server.formats[name] = (framesize, headerwords)
+        return self.server.formats[name]
+
+    def _dir(self, name):
+        # The ETag and Last-Modified are derived from the run names and the
+        # time the directory last changed alone, so that a run being written
+        # does not invalidate the listing with every frame, and an unchanged
+        # listing is answered without looking at any of the runs. The price
+        # is that the frame counts of a listing still held by a client go
+        # stale; get_num_frames gives the current number for a run.
+        mtime = os.stat(name).st_mtime
+        runs  = [fname[:-4] for fname in os.listdir(name) if fname.startswith('run')
+                 and fname.endswith('.xml')]
+        runs.sort()
+        etag  = '"' + hashlib.md5((repr(mtime) + ' ' + ' '.join(runs)).encode('utf-8')).hexdigest() + '"'
+        lmod  = email.utils.formatdate(mtime, usegmt=True)
+
+        # support conditional requests; If-None-Match takes precedence
+        match = self.headers.get('If-None-Match')
+        since = self.headers.get('If-Modified-Since')
+        if match is not None:
+            unchanged = match == etag
+        elif since is not None:
+            since = email.utils.parsedate_tz(since)
+            unchanged = since is not None and int(mtime) <= email.utils.mktime_tz(since)
+        else:
+            unchanged = False
+        if unchanged:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', lmod)
+            self.end_headers()
+            return
+
+        entries = []
+        for run in runs:
+            try:
+                framesize, headerwords = self._format(os.path.join(name, run))
+                nframe = os.path.getsize(os.path.join(name, run + '.dat')) // framesize
+                entries.append('<li><a href="' + run + '?action=getdata">' + run +
+                               '</a> <span nframes="' + str(nframe) + '"/></li>\n')
+            except (IOError, OSError, IndexError, ValueError, xml.parsers.expat.ExpatError):
+                entries.append('<li><a href="' + run + '?action=getdata">' + run + '</a></li>\n')
+        body = ('<html><body><ul>\n' + ''.join(entries) + '</ul></body></html>\n').encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', lmod)
+        self.end_headers()
+        self.wfile.write(body)
+
+class Fserver(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Stand-in FileServer. Serves runs in directory 'root' on a given port
+    (0 to let the system choose one). The URL to set ULTRACAM_DEFAULT_URL
+    to is available as the attribute 'url'. Use 'start' to serve in a
+    background thread, or the standard 'serve_forever'. Set 'ranges' False
+    to ignore Range requests on static files, as some servers do.
+    """
+    daemon_threads = True
+
+    def __init__(self, root='.', port=8007, host='localhost', verbose=False, ranges=True):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), FileServerHandler)
+        self.root    = root
+        self.verbose = verbose
+        self.ranges  = ranges
+        self.formats = {}
+        self.url     = 'http://' + host + ':' + str(self.server_address[1]) + '/'
+
+    def start(self):
+        """
+        Starts serving in a daemon thread, returning the thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+        self.shutdown()
+        self.server_close()
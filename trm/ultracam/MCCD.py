@@ -4,6 +4,8 @@ Classes to represent multiple CCDs
 from __future__ import absolute_import
 from __future__ import print_function
 
+import os
+import mmap as _mmap
 import struct
 import six
 from six.moves import range
@@ -31,9 +33,77 @@ from trm.ultracam.Uhead import Uhead
 from trm.ultracam.Window import Window
 from trm.ultracam.CCD import CCD
 from trm.ultracam.Odict import Odict
-from trm.ultracam.Utils import write_string, read_string, check_ucm
+from trm.ultracam.Utils import write_buffers
 from trm.ultracam.UErrors import UltracamError
 
+# precompiled formats for parsing ucm files, by endian-ness
+UCM_FORMATS = dict((endian, dict((key, struct.Struct(endian + fmt)) for key, fmt in
+                                 (('i','i'), ('I','I'), ('d','d'), ('f','f'), ('B','B'),
+                                  ('c','c'), ('H','H'), ('id','id'), ('win','9i'))))
+                   for endian in '<>')
+
+# ucm header item types of fixed size and of variable length vectors
+UCM_ITYPES = {ITYPE_DOUBLE : 'd', ITYPE_INT : 'i', ITYPE_UINT : 'I', ITYPE_FLOAT : 'f',
+              ITYPE_BOOL : 'B', ITYPE_TIME : 'id', ITYPE_UCHAR : 'c', ITYPE_USINT : 'H'}
+UCM_VTYPES = {ITYPE_DVECTOR : 'd', ITYPE_IVECTOR : 'i', ITYPE_FVECTOR : 'f'}
+
+# formats used when writing ucm files, in native byte order
+UCM_PACK_INT = struct.Struct('=i')
+UCM_PACK_WIN = struct.Struct('=9i')
+
+def unpack_head(buff, off, endian):
+    """
+    Parses a header as stored in a ucm file (see Uhead.pack), returning the
+    Uhead and the offset of the byte following it.
+
+    buff   -- buffer containing the header, e.g. the bytes of a file
+
+    off    -- offset of the start of the header in buff
+
+    endian -- '<' or '>' for little- or big-endian.
+
+    Raises struct.error if the buffer is too short.
+    """
+    fmts  = UCM_FORMATS[endian]
+    unpi  = fmts['i'].unpack_from
+    mview = memoryview(buff)
+
+    def rstring(off):
+        nchar = unpi(buff, off)[0]
+        return (mview[off+4:off+4+nchar].tobytes().decode('utf-8'), off+4+nchar)
+
+    lmap = unpi(buff, off)[0]
+    off += 4
+
+    head = Uhead()
+    for i in range(lmap):
+        name, off    = rstring(off)
+        itype        = unpi(buff, off)[0]
+        comment, off = rstring(off+4)
+
+        if itype == ITYPE_STRING:
+            value, off = rstring(off)
+        elif itype == ITYPE_DIR:
+            value = None
+        elif itype in UCM_ITYPES:
+            fmt   = fmts[UCM_ITYPES[itype]]
+            value = fmt.unpack_from(buff, off)
+            if itype != ITYPE_TIME:
+                value = value[0]
+            off  += fmt.size
+        elif itype in UCM_VTYPES:
+            nvec  = unpi(buff, off)[0]
+            fmt   = endian + str(nvec) + UCM_VTYPES[itype]
+            value = struct.unpack_from(fmt, buff, off+4)
+            off  += 4 + struct.calcsize(fmt)
+        else:
+            raise UltracamError('ultracam.MCCD.unpack_head: do not recognize itype = ' + str(itype))
+
+        # store header information, fast method
+        Odict.__setitem__(head, name, (value, itype, comment))
+
+    return (head, off)
+
 class MCCD(object):
     """
     Represents multiple CCD frame. The idea is that one has an instrument
@@ -73,7 +143,7 @@ class MCCD(object):
         return rep
 
     @classmethod
-    def rucm(cls, fname, flt=True):
+    def rucm(cls, fname, flt=True, mmap=False):
         """
         Factory method to produce an MCCD from a ucm file.
 
@@ -86,86 +156,82 @@ class MCCD(object):
                   will be retained. The latter is unsafe when arithematic is involved
                   hence the default is to convert to 4-byte floats.
 
-        Exceptions are thrown if the file cannot be found, or an error during the
-        read occurs.
-        """    
+        mmap   -- memory map the file rather than reading it. The windows are
+                  then read-only views of the file, which keeps large frames off
+                  the heap; the file is only read as the data are accessed. Any
+                  conversion (2-byte ints to floats if flt=True, or byte swapping)
+                  makes an ordinary in-memory copy.
+
+        The file is read in one go and parsed from the buffer. Unless memory
+        mapped, the data of each CCD are then copied into contiguous storage
+        (see CCD.pack). Exceptions are thrown if the file cannot be found, or
+        an error during the read occurs.
+        """
 
-        # Assume it is a file object, if that fails, assume it is
-        # the name of a file.
         if not fname.endswith('.ucm'): fname += '.ucm'
-        uf = open(fname, 'rb')
-        start_format = check_ucm(uf)
-
-        # read the header
-        lmap = struct.unpack(start_format + 'i', uf.read(4))[0]
-
-        head = Uhead()
-        for i in range(lmap):
-            name    = read_string(uf, start_format)
-            itype   = struct.unpack(start_format + 'i', uf.read(4))[0]
-            comment = read_string(uf, start_format)
-
-            if itype == ITYPE_DOUBLE:
-                value = struct.unpack(start_format + 'd', uf.read(8))[0]
-            elif itype == ITYPE_INT:
-                value = struct.unpack(start_format + 'i', uf.read(4))[0]
-            elif itype == ITYPE_UINT:
-                value = struct.unpack(start_format + 'I', uf.read(4))[0]
-            elif itype == ITYPE_FLOAT:
-                value = struct.unpack(start_format + 'f', uf.read(4))[0]
-            elif itype == ITYPE_STRING:
-                value = read_string(uf, start_format)
-            elif itype == ITYPE_BOOL:
-                value = struct.unpack(start_format + 'B', uf.read(1))[0]
-            elif itype == ITYPE_DIR:
-                value = None
-            elif itype == ITYPE_TIME:
-                value = struct.unpack(start_format + 'id', uf.read(12))
-            elif itype == ITYPE_DVECTOR:
-                nvec  = struct.unpack(start_format + 'i', uf.read(4))[0]
-                value = struct.unpack(start_format + str(nvec) + 'd', uf.read(8*nvec))
-            elif itype == ITYPE_UCHAR:
-                value = struct.unpack(start_format + 'c', uf.read(1))[0]
-            elif itype == ITYPE_USINT:
-                value = struct.unpack(start_format + 'H', uf.read(2))[0]
-            elif itype == ITYPE_IVECTOR:
-                nvec  = struct.unpack(start_format + 'i', uf.read(4))[0]
-                value = struct.unpack(start_format + str(nvec) + 'i', uf.read(4*nvec))
-            elif itype == ITYPE_FVECTOR:
-                nvec  = struct.unpack(start_format + 'i', uf.read(4))[0]
-                value = struct.unpack(start_format + str(nvec) + 'f', uf.read(4*nvec))
+        with open(fname, 'rb') as uf:
+            if mmap:
+                buff = _mmap.mmap(uf.fileno(), 0, access=_mmap.ACCESS_READ)
             else:
-                raise UltracamError('ultracam.MCCD.rucm: do not recognize itype = ' + str(itype))
-
-            # store header information, fast method
-            Odict.__setitem__(head, name, (value, itype, comment))
-
-        # now for the data
-        data  = []
-
-        # read number of CCDs
-        nccd = struct.unpack(start_format + 'i', uf.read(4))[0]
-
-        for nc in range(nccd):
-            # read number of wndows
-            nwin = struct.unpack(start_format + 'i', uf.read(4))[0]
-            wins  = []
-            for nw in range(nwin):
-                llx,lly,nx,ny,xbin,ybin,nxmax,nymax,iout = struct.unpack(start_format + '9i', uf.read(36))
-                if iout == 0:
-                    win = np.fromfile(file=uf, dtype=np.float32, count=nx*ny)
-                elif iout == 1:
-                    if flt:
-                        win = np.fromfile(file=uf, dtype=np.uint16, count=nx*ny).astype(np.float32)
-                    else:
-                        win = np.fromfile(file=uf, dtype=np.uint16, count=nx*ny)
+                # bytearray so that the windows are writable
+                buff = bytearray(os.fstat(uf.fileno()).st_size)
+                if uf.readinto(buff) != len(buff):
+                    raise UltracamError('MCCD.rucm: failed to read ' + fname)
+
+        if len(buff) >= 4 and UCM_FORMATS['<']['i'].unpack_from(buff, 0)[0] == MAGIC:
+            endian = '<'
+        elif len(buff) >= 4 and UCM_FORMATS['>']['i'].unpack_from(buff, 0)[0] == MAGIC:
+            endian = '>'
+        else:
+            raise UltracamError('MCCD.rucm: could not recognise first 4 bytes of ' +
+                                fname + ' as a ucm file')
+        fmts  = UCM_FORMATS[endian]
+        unpi  = fmts['i'].unpack_from
+
+        try:
+            # read the header
+            head, off = unpack_head(buff, 4, endian)
+
+            # now for the data
+            data  = []
+
+            # read number of CCDs
+            nccd = unpi(buff, off)[0]
+            off += 4
+            unpw = fmts['win'].unpack_from
+            dtypes = (np.dtype(endian + 'f4'), np.dtype(endian + 'u2'))
+
+            for nc in range(nccd):
+                # read number of windows
+                nwin = unpi(buff, off)[0]
+                off += 4
+                wins   = []
+                otypes = set()
+                for nw in range(nwin):
+                    llx,lly,nx,ny,xbin,ybin,nxmax,nymax,iout = unpw(buff, off)
+                    off += 36
+                    if iout != 0 and iout != 1:
+                        raise UltracamError('ultracam.MCCD.rucm: iout = ' + str(iout) + ' not recognised')
+                    dtype = dtypes[iout]
+                    win   = np.frombuffer(buff, dtype, nx*ny, off).reshape((ny,nx))
+                    off  += dtype.itemsize*nx*ny
+                    wins.append(Window(win,llx,lly,xbin,ybin))
+                    otypes.add(np.dtype(np.float32) if iout == 1 and flt else dtype.newbyteorder('='))
+
+                ccd = CCD(wins,None,nxmax,nymax,True,None)
+                if not mmap and len(otypes) == 1:
+                    # copy into contiguous storage, converting on the way
+                    ccd.pack(otypes.pop())
                 else:
-                    raise UltracamError('ultracam.MCCD.rucm: iout = ' + str(iout) + ' not recognised')
-                win = win.reshape((ny,nx))
-                wins.append(Window(win,llx,lly,xbin,ybin))
+                    for win in wins:
+                        if win.dtype == dtypes[1] and flt:
+                            win.data = win.data.astype(np.float32)
+                        elif not win.dtype.isnative:
+                            win.data = win.data.astype(win.dtype.newbyteorder('='))
+                data.append(ccd)
 
-            data.append(CCD(wins,None,nxmax,nymax,True,None))
-        uf.close()
+        except (struct.error, ValueError) as err:
+            raise UltracamError('MCCD.rucm: failed to read ' + fname + ': ' + str(err))
 
         return cls(data, head)
 
@@ -223,17 +289,21 @@ class MCCD(object):
             ccds.append(ccd.cropTo(ccdo))
         return MCCD(ccds, self.head)
 
-    def __eq__(self, other):
+    @property
+    def fsig(self):
         """
-        Equality operator tests same number of CCDs and that each CCD matches.
+        Format signature of the MCCD, a tuple of the signatures of its CCDs
+        (see CCD.fsig). Signatures are hashable and equal for MCCDs of the same
+        format.
         """
+        return tuple(ccd.fsig for ccd in self._data)
 
-        if len(self) != len(other): return False
-
-        for sccd, occd in zip(self._data,other._data):
-            if sccd != occd:
-                return False
-        return True
+    def __eq__(self, other):
+        """
+        Equality operator tests same number of CCDs and that each CCD matches,
+        i.e. that the format signatures match.
+        """
+        return self.fsig == other.fsig
 
     def __ne__(self, other):
         """
@@ -251,85 +321,10 @@ class MCCD(object):
         or 16-bit unsigned integers according to the internal types.
 
         fname  -- file to write to. '.ucm' will be appended if necessary.
-        """
 
-        if not fname.strip().endswith('.ucm'):
-            fname = fname.strip() + '.ucm'
-        uf = open(fname, 'wb')
-
-        # write the format code
-        uf.write(struct.pack('i',MAGIC))
-
-        # write the header, starting with the number of entries
-        if self.head is None:
-            uf.write(struct.pack('i',0))
-        else:
-            lmap = len(self.head)
-            uf.write(struct.pack('i',lmap))
-
-            for key,val in six.iteritems(self.head):
-                write_string(uf, key)
-
-                value, itype, comment = val
-
-                uf.write(struct.pack('i',itype))
-                write_string(uf, comment)
-
-                if itype == ITYPE_DOUBLE:
-                    uf.write(struct.pack('d', value))
-                elif itype == ITYPE_INT:
-                    uf.write(struct.pack('i', value))
-                elif itype == ITYPE_UINT:
-                    uf.write(struct.pack('I', value))
-                elif itype == ITYPE_FLOAT:
-                    uf.write(struct.pack('f', value))
-                elif itype == ITYPE_STRING:
-                    write_string(uf, value)
-                elif itype == ITYPE_BOOL:
-                    uf.write(struct.pack('B', value))
-                elif itype == ITYPE_DIR:
-                    pass
-                elif itype == ITYPE_TIME:
-                    uf.write(struct.pack('i', value[0]))
-                    uf.write(struct.pack('d', value[1]))
-                elif itype == ITYPE_DVECTOR:
-                    uf.write(struct.pack('i', len(value)))
-                    uf.write(struct.pack(str(len(value))+'d', *value))
-                elif itype == ITYPE_UCHAR:
-                    uf.write(struct.pack('B', value))
-                elif itype == ITYPE_USINT:
-                    uf.write(struct.pack('H', value))
-                elif itype == ITYPE_IVECTOR:
-                    uf.write(struct.pack('i', len(value)))
-                    uf.write(struct.pack(str(len(value))+'i', *value))
-                elif itype == ITYPE_FVECTOR:
-                    uf.write(struct.pack('i', len(value)))
-                    uf.write(struct.pack(str(len(value))+'f', *value))
-                else:
-                    raise UltracamError('Hitem: type =' + str(itype) +
-                                        'not recognised')
-
-        # number of CCDs
-        nccd = len(self)
-        uf.write(struct.pack('i', nccd))
-
-        iout = 0 if self.anyFloat() else 1
-
-        for ccd in self._data:
-
-            # number of windows
-            nwin = len(ccd)
-            uf.write(struct.pack('i', nwin))
-
-            for win in ccd:
-                uf.write(struct.pack('9i',win.llx,win.lly,win.nx,win.ny,win.xbin,win.ybin,
-                                     ccd.nxmax,ccd.nymax,iout))
-                if iout == 0:
-                    win.astype(np.float32).tofile(uf)
-                elif iout == 1:
-                    win.astype(np.uint16).tofile(uf)
-
-        uf.close()
+        See UcmWriter for writing many frames of the same format.
+        """
+        UcmWriter().write(self, fname)
 
     def rback(self, nc=-1):
         """
@@ -418,54 +413,99 @@ class MCCD(object):
             mn.append(ccd.median())
         return tuple(mn)
 
-    # arithematic
+    def pack(self, dtype=None):
+        """
+        Moves the data of each CCD into contiguous storage (see CCD.pack), so
+        that arithematic and statistics act on all the pixels of a CCD at once.
+
+        dtype -- data type to store the data as, None to keep the types of the
+                 Windows.
+        """
+        for ccd in self._data:
+            ccd.pack(dtype)
+
+    # arithematic. Each CCD is operated on with a single numpy call when
+    # the CCDs involved have contiguous storage of matching format (see
+    # CCD._arith), rather than Window by Window.
+
+    def _arith(self, other, op, out=None, reverse=False):
+        """
+        Applies the numpy ufunc 'op' to the MCCD and 'other' (an MCCD or a
+        constant), CCD by CCD; see CCD._arith. If out is None a new MCCD is
+        returned, else the result goes into the MCCD out which is returned.
+        """
+        ismccd = isinstance(other, MCCD)
+        if ismccd and len(other) != len(self):
+            raise UltracamError('MCCD._arith: number of CCDs do not match')
+        if out is not None and len(out) != len(self):
+            raise UltracamError('MCCD._arith: number of CCDs of out does not match')
+
+        tccd = []
+        for nc, ccd in enumerate(self._data):
+            tccd.append(ccd._arith(other._data[nc] if ismccd else other, op,
+                                   None if out is None else out._data[nc], reverse))
+        if out is None:
+            return MCCD(tccd, self.head)
+        return out
+
+    def add(self, other, out=None):
+        """
+        Adds 'other' (an MCCD or constant) to the MCCD, storing the result in
+        the MCCD 'out' if set (which can be the MCCD itself), else returning a
+        new MCCD.
+        """
+        return self._arith(other, np.add, out)
+
+    def sub(self, other, out=None):
+        """
+        Subtracts 'other' (an MCCD or constant) from the MCCD, storing the
+        result in the MCCD 'out' if set (which can be the MCCD itself), else
+        returning a new MCCD.
+        """
+        return self._arith(other, np.subtract, out)
+
+    def mul(self, other, out=None):
+        """
+        Multiplies the MCCD by 'other' (an MCCD or constant), storing the
+        result in the MCCD 'out' if set (which can be the MCCD itself), else
+        returning a new MCCD.
+        """
+        return self._arith(other, np.multiply, out)
+
+    def div(self, other, out=None):
+        """
+        Divides the MCCD by 'other' (an MCCD or constant), storing the result
+        in the MCCD 'out' if set (which can be the MCCD itself), else returning
+        a new MCCD.
+        """
+        return self._arith(other, np.true_divide, out)
+
     def __iadd__(self, other):
         """
         Adds 'other' to the MCCD in place (+=)
         """
-        if isinstance(other, MCCD):
-            for ccd,occd in zip(self._data,other._data):
-                ccd += occd
-        else:
-            for ccd in self._data:
-                ccd += other
-        return self
+        return self._arith(other, np.add, self)
 
     def __isub__(self, other):
         """
         Subtracts 'other' from the MCCD in place (-=)
         """
-        if isinstance(other, MCCD):
-            for ccd,occd in zip(self._data,other._data):
-                ccd -= occd
-        else:
-            for ccd in self._data:
-                ccd -= other
-        return self
+        return self._arith(other, np.subtract, self)
 
     def __imul__(self, other):
         """
         Multiplies the MCCD by 'other' in place (\*=)
         """
-        if isinstance(other, MCCD):
-            for ccd,occd in zip(self._data,other._data):
-                ccd *= occd
-        else:
-            for ccd in self._data:
-                ccd *= other
-        return self
+        return self._arith(other, np.multiply, self)
 
     def __idiv__(self, other):
         """
         Divides the MCCD by 'other' in place (/=)
         """
-        if isinstance(other, MCCD):
-            for ccd,occd in zip(self._data,other._data):
-                ccd /= occd
-        else:
-            for ccd in self._data:
-                ccd /= other
-        return self
+        return self._arith(other, np.true_divide, self)
+
+    def __itruediv__(self, other):
+        return self.__idiv__(other)
 
     def __str__(self):
         ret = ''
@@ -481,96 +521,56 @@ class MCCD(object):
         """
         Adds 'other' to the MCCD (+)
         """
-        tccd = []
-        if isinstance(other, MCCD):
-            for ccd,occd in zip(self._data,other._data):
-                tccd.append(ccd + occd)
-        else:
-            for ccd in self._data:
-                tccd.append(ccd + other)
-        return MCCD(tccd, self.head)
+        return self._arith(other, np.add)
 
     def __sub__(self, other):
         """
         Subtract 'other' from the MCCD (-)
         """
-        tccd = []
-        if isinstance(other, MCCD):
-            for ccd,occd in zip(self._data,other._data):
-                tccd.append(ccd - occd)
-        else:
-            for ccd in self._data:
-                tccd.append(ccd - other)
-        return MCCD(tccd, self.head)
+        return self._arith(other, np.subtract)
 
     def __mul__(self, other):
         """
         Multiply 'other' by the MCCD (*)
         """
-        tccd = []
-        if isinstance(other, MCCD):
-            for ccd,occd in zip(self._data,other._data):
-                tccd.append(ccd * occd)
-        else:
-            for ccd in self._data:
-                tccd.append(ccd * other)
-        return MCCD(tccd, self.head)
+        return self._arith(other, np.multiply)
 
     def __div__(self, other):
         """
         Divide MCCD by 'other' from the MCCD (/)
         """
-        tccd = []
-        if isinstance(other, MCCD):
-            for ccd,occd in zip(self._data,other._data):
-                tccd.append(ccd / occd)
-        else:
-            for ccd in self._data:
-                tccd.append(ccd / other)
-        return MCCD(tccd, self.head)
-        
+        return self._arith(other, np.true_divide)
+
     def __truediv__(self,other):
-    	"""
-    	Divide MCCD by 'other' from the MCCD (/) when future division used
-    	"""
-    	return self.__div__(other)
+        """
+        Divide MCCD by 'other' from the MCCD (/) when future division used
+        """
+        return self.__div__(other)
 
     def __radd__(self, other):
         """
         Returns other + MCCD (an MCCD)
         """
-        tccds = []
-        for ccd in self._data:
-            tccds.append(other + ccd)
-        return MCCD(tccds, self.head)
+        return self._arith(other, np.add, reverse=True)
 
     def __rsub__(self, other):
         """
         Returns other - MCCD (an MCCD)
         """
-        tccds = []
-        for ccd in self._data:
-            tccds.append(other - ccd)
-        return MCCD(tccds, self.head)
+        return self._arith(other, np.subtract, reverse=True)
 
     def __rmul__(self, other):
         """
         Returns other * MCCD (an MCCD)
         """
-        tccds = []
-        for ccd in self._data:
-            tccds.append(other * ccd)
-        return MCCD(tccds, self.head)
+        return self._arith(other, np.multiply, reverse=True)
 
     def __rdiv__(self, other):
         """
         Returns other / MCCD (an MCCD)
         """
-        tccds = []
-        for ccd in self._data:
-            tccds.append(other / ccd)
-        return MCCD(tccds, self.head)
-        
+        return self._arith(other, np.true_divide, reverse=True)
+
     def __rtruediv__(self,other):
         return self.__rdiv__(other)
 
@@ -630,7 +630,7 @@ class MCCD(object):
 
             # Determine intensity range to display
             if method == 'p':
-                vmin, vmax = ccd.centile((vlo,vhi))
+                vmin, vmax = ccd.centile((vlo,vhi), approx=True)
             elif method == 'a':
                 vmin, vmax = ccd.min(), ccd.max()
             elif method == 'd':
@@ -748,13 +748,13 @@ class UCAM(MCCD):
            for winl, winr in zip(ccd[::2],ccd[1::2]):
 
                # check the modes
-               hist  = np.bincount(winl.flatten())
+               hist  = np.bincount(winl.data.ravel())
                nmode = hist[np.argmax(hist)]
                if nmode > winl.size // 4:
                    ret.append((True,'a window has >25% pixels of same value'))
                    break
 
-               hist = np.bincount(winr.flatten())
+               hist = np.bincount(winr.data.ravel())
                nmode = hist[np.argmax(hist)]
                if nmode > winl.size // 4:
                    ret.append((True,'a window has >25% pixels of same value'))
@@ -803,6 +803,77 @@ class UCAM(MCCD):
 
         return ret
 
+class UcmWriter(object):
+    """
+    Writes MCCDs to ucm files. Each file is assembled as a list of buffers
+    (header, window descriptors and the window data themselves, uncopied if
+    already of the type to be written) and written in one go. The window
+    descriptors are kept and re-used while the format stays the same, as is
+    the serialised key, type and comment of each header item, so a writer is
+    best kept for writing long sequences of frames, e.g.::
+
+      writer = UcmWriter()
+      for n, mccd in enumerate(frames):
+         writer.write(mccd, 'frame_{0:04d}'.format(n+1))
+
+    MCCD.wucm uses a new UcmWriter for each call.
+    """
+
+    def __init__(self):
+        self._key      = None
+        self._descs    = None
+        self._prefixes = {}
+
+    def write(self, mccd, fname):
+        """
+        Writes an MCCD to a ucm file. The data are saved as 32-bit floats or
+        16-bit unsigned integers according to the internal types.
+
+        mccd   -- the MCCD to write
+
+        fname  -- file to write to. '.ucm' will be appended if necessary.
+        """
+        if not fname.strip().endswith('.ucm'):
+            fname = fname.strip() + '.ucm'
+
+        iout  = 0 if mccd.anyFloat() else 1
+        dtype = np.float32 if iout == 0 else np.uint16
+
+        # window descriptors, re-made only if the format has changed. The
+        # numbers of CCDs and windows are included in those of the windows
+        # following them. 'tail' covers any trailing CCDs without windows.
+        key = (iout, mccd.fsig)
+        if key != self._key:
+            descs = []
+            desc  = UCM_PACK_INT.pack(len(mccd))
+            for ccd in mccd._data:
+                desc += UCM_PACK_INT.pack(len(ccd))
+                for win in ccd:
+                    desc += UCM_PACK_WIN.pack(win.llx,win.lly,win.nx,win.ny,win.xbin,
+                                              win.ybin,ccd.nxmax,ccd.nymax,iout)
+                    descs.append(desc)
+                    desc = b''
+            self._key   = key
+            self._descs = (descs, desc)
+
+        # header, including the format code
+        if mccd.head is None:
+            buffs = [UCM_PACK_INT.pack(MAGIC) + UCM_PACK_INT.pack(0)]
+        else:
+            buffs = [UCM_PACK_INT.pack(MAGIC), mccd.head.pack(self._prefixes)]
+
+        descs, tail = self._descs
+        nw = 0
+        for ccd in mccd._data:
+            for win in ccd:
+                buffs.append(descs[nw])
+                buffs.append(np.ascontiguousarray(win.astype(dtype, copy=False)))
+                nw += 1
+        if tail:
+            buffs.append(tail)
+
+        write_buffers(fname, buffs)
+
 if __name__ == '__main__':
     import trm.ultracam.Time as Time
     uhead = Uhead()
@@ -0,0 +1,410 @@
+"""
+Multi-frame ucm containers, for storing sequences of frames of the same
+format in one file rather than one ucm file per frame.
+
+A container (extension '.mucm') starts with a preamble holding the number of
+frames, a header shared by all frames (stored as in ucm files) and a format
+block (CCD dimensions and windows). It is followed by one fixed-size record
+per frame, so the offset of any frame follows directly from its number. Each
+record holds the Time of every CCD, a reserved slot for header items specific
+to the frame (an 'overlay' on the shared header) and the pixel data. In
+detail (native byte order, as for ucm files)::
+
+  int32  MAGIC_MUCM
+  int32  version
+  int64  number of frames, updated after each frame is written
+  int32  iout, 0 for 4-byte floats, 1 for unsigned 2-byte ints
+  int32  noverlay, bytes reserved for header overlays in each record
+  ...    shared header, as written by Uhead.pack
+  int32  nccd, then for each CCD: nxmax, nymax, nwin, then for each window
+         llx, lly, nx, ny, xbin, ybin (all int32)
+  ...    padding to a multiple of 64 bytes
+
+  records, each of 'stride' bytes, made of: for each CCD, a time block
+  (mjd, exposure, flags, reason); the overlay size (int32, 4 bytes padding)
+  and noverlay bytes for it; then the data of each window in turn. Records
+  are padded to a multiple of 8 bytes.
+
+Frames are only counted once completely written, so a container can be read
+while it is being appended to.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import mmap as _mmap
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    print('Failed to import numpy; some routines will fail')
+
+from trm.ultracam.Constants import *
+from trm.ultracam.Odict import Odict
+from trm.ultracam.Uhead import Uhead
+from trm.ultracam.Time import Time
+from trm.ultracam.Window import Window
+from trm.ultracam.CCD import CCD
+from trm.ultracam.MCCD import MCCD, unpack_head
+from trm.ultracam.Utils import write_buffers
+from trm.ultracam.UErrors import UltracamError
+
+MUCM_VERSION = 1
+
+# byte order of this machine, that of containers written here
+NATIVE = '<' if sys.byteorder == 'little' else '>'
+
+# offset of the number of frames
+NFRAME_OFFSET = 8
+
+# start of preamble, by endian-ness
+PRE_FORMATS  = dict((endian, struct.Struct(endian + 'iiqii')) for endian in '<>')
+
+# time block of each CCD: mjd, exposure, flags, reason (truncated to 44 bytes)
+TIME_FORMATS = dict((endian, struct.Struct(endian + 'ddBBBx44s')) for endian in '<>')
+TIME_HAS     = 1
+TIME_CCDGOOD = 2
+
+class _Layout(object):
+    """
+    Layout of a container: format, record size and offsets, derived from
+    its preamble.
+    """
+
+    def __init__(self, fmt, iout, noverlay, endian):
+        self.fmt      = fmt
+        self.iout     = iout
+        self.noverlay = noverlay
+        self.endian   = endian
+        self.dtype    = np.dtype(endian + ('f4' if iout == 0 else 'u2'))
+        self.tstruct  = TIME_FORMATS[endian]
+        self.ntime    = len(fmt)*self.tstruct.size
+        self.wins     = []
+        off = self.ntime + 8 + noverlay
+        for nc, (nxmax, nymax, wins) in enumerate(fmt):
+            for (llx,lly,nx,ny,xbin,ybin) in wins:
+                self.wins.append((nc, off, llx, lly, nx, ny, xbin, ybin))
+                off += self.dtype.itemsize*nx*ny
+        self.stride = 8*((off+7)//8)
+        self.start  = None
+
+    def pack_format(self):
+        fmt = [len(self.fmt)]
+        for nxmax, nymax, wins in self.fmt:
+            fmt += [nxmax, nymax, len(wins)]
+            for win in wins:
+                fmt += list(win)
+        return struct.pack(self.endian + str(len(fmt)) + 'i', *fmt)
+
+def _read_preamble(buff):
+    """
+    Parses the preamble of a container, returning the shared header, the
+    layout and the number of frames. Raises struct.error if the buffer is too
+    short to hold it.
+    """
+    for endian in '<>':
+        magic, version, nframe, iout, noverlay = PRE_FORMATS[endian].unpack_from(buff, 0)
+        if magic == MAGIC_MUCM:
+            break
+    else:
+        raise UltracamError('Mucm: could not recognise the first 4 bytes as those of a mucm file')
+    if version != MUCM_VERSION:
+        raise UltracamError('Mucm: version = ' + str(version) + ' not recognised')
+
+    head, off = unpack_head(buff, PRE_FORMATS[endian].size, endian)
+
+    unpi  = struct.Struct(endian + 'i').unpack_from
+    nccd  = unpi(buff, off)[0]
+    off  += 4
+    fmt   = []
+    for nc in range(nccd):
+        nxmax, nymax, nwin = struct.unpack_from(endian + '3i', buff, off)
+        off += 12
+        wins = []
+        for nw in range(nwin):
+            wins.append(struct.unpack_from(endian + '6i', buff, off))
+            off += 24
+        fmt.append((nxmax, nymax, tuple(wins)))
+
+    layout = _Layout(tuple(fmt), iout, noverlay, endian)
+    layout.start = 64*((off+63)//64)
+    return (head, layout, nframe)
+
+class Mucm(object):
+    """
+    Reads frames from a multi-frame ucm container. Frames are accessed by
+    indexing as a list (starting from 0), returning MCCDs, e.g.::
+
+      mucm = Mucm('abc')
+      print(len(mucm))
+      last = mucm[-1]
+      for mccd in mucm:
+         ...
+
+    Frames are located directly from their number. The number of frames is
+    re-read from the file each time it is needed, so frames appended by a
+    MucmWriter (in any process) become visible as they are completed.
+
+    Attributes:
+
+      fname  -- the name of the file
+      head   -- the header shared by all frames
+      flt    -- read data as 4-byte floats
+    """
+
+    def __init__(self, fname, flt=True, mmap=True):
+        """
+        fname -- container file name. '.mucm' will be appended if not supplied.
+
+        flt   -- convert the data to 4-byte floats whatever the type on disk,
+                 as for MCCD.rucm.
+
+        mmap  -- memory map the file. The windows are then read-only views of
+                 the file unless a type conversion is needed. Otherwise frames
+                 are read into memory one by one.
+        """
+        if not fname.endswith('.mucm'): fname += '.mucm'
+        self.fname = fname
+        self.flt   = flt
+        self._fobj = open(fname, 'rb', 0)
+        self._mm   = None
+        self._nmap = 0
+
+        # read enough of the file to parse the preamble
+        nread = 4096
+        while True:
+            self._fobj.seek(0)
+            buff = self._fobj.read(nread)
+            try:
+                self.head, self._layout, nframe = _read_preamble(buff)
+                break
+            except struct.error:
+                if len(buff) < nread:
+                    raise UltracamError('Mucm.__init__: ' + fname + ' is too short to be a mucm file')
+                nread *= 4
+
+        self._nfmt = struct.Struct(self._layout.endian + 'q')
+        if mmap:
+            self._map()
+
+    def _map(self):
+        # (re-)map the whole of the file
+        size = os.fstat(self._fobj.fileno()).st_size
+        if size:
+            self._mm   = _mmap.mmap(self._fobj.fileno(), 0, access=_mmap.ACCESS_READ)
+            self._nmap = size
+
+    def __len__(self):
+        """
+        Returns the number of frames written so far
+        """
+        if self._mm is not None:
+            return self._nfmt.unpack_from(self._mm, NFRAME_OFFSET)[0]
+        self._fobj.seek(NFRAME_OFFSET)
+        return self._nfmt.unpack(self._fobj.read(8))[0]
+
+    def _record(self, n):
+        """
+        Returns a buffer and offset of record n (starting from 0)
+        """
+        nframe = len(self)
+        if n < 0:
+            n += nframe
+        if n < 0 or n >= nframe:
+            raise IndexError('Mucm: frame index ' + str(n) + ' out of range')
+
+        lay = self._layout
+        off = lay.start + n*lay.stride
+        if self._mm is not None:
+            if off + lay.stride > self._nmap:
+                # file has grown
+                self._map()
+            return (self._mm, off)
+        else:
+            buff = bytearray(lay.stride)
+            self._fobj.seek(off)
+            if self._fobj.readinto(buff) != lay.stride:
+                raise UltracamError('Mucm: failed to read frame ' + str(n) + ' of ' + self.fname)
+            return (buff, 0)
+
+    def _times(self, buff, off):
+        lay   = self._layout
+        times = []
+        for nc in range(len(lay.fmt)):
+            mjd, expose, flags, good, ccdgood, reason = lay.tstruct.unpack_from(
+                buff, off + nc*lay.tstruct.size)
+            time = Time(mjd, expose, bool(good), reason.rstrip(b'\0').decode('utf-8')) \
+                   if flags & TIME_HAS else None
+            times.append((time, bool(flags & TIME_CCDGOOD)))
+        return times
+
+    def time(self, n):
+        """
+        Returns the list of Times of the CCDs of frame n (from 0), without
+        reading the data.
+        """
+        buff, off = self._record(n)
+        return [time for time, good in self._times(buff, off)]
+
+    def __getitem__(self, n):
+        """
+        Returns frame n (starting from 0) as an MCCD.
+        """
+        buff, off = self._record(n)
+        lay = self._layout
+
+        # header: the shared one plus any overlay
+        head = self.head.copy()
+        nover = struct.unpack_from(lay.endian + 'i', buff, off + lay.ntime)[0]
+        if nover:
+            over, end = unpack_head(buff, off + lay.ntime + 8, lay.endian)
+            for key in over:
+                Odict.__setitem__(head, key, over[key])
+
+        wins = [[] for nc in range(len(lay.fmt))]
+        for (nc, woff, llx, lly, nx, ny, xbin, ybin) in lay.wins:
+            data = np.frombuffer(buff, lay.dtype, nx*ny, off + woff).reshape((ny,nx))
+            if lay.iout == 1 and self.flt:
+                data = data.astype(np.float32)
+            elif not lay.dtype.isnative:
+                data = data.astype(lay.dtype.newbyteorder('='))
+            wins[nc].append(Window(data,llx,lly,xbin,ybin))
+
+        ccds = [CCD(cwins, time, nxmax, nymax, good, None) for cwins, (nxmax, nymax, fwins), (time, good)
+                in zip(wins, lay.fmt, self._times(buff, off))]
+        return MCCD(ccds, head)
+
+    def __iter__(self):
+        n = 0
+        while n < len(self):
+            yield self[n]
+            n += 1
+
+    def close(self):
+        """
+        Closes the file. Windows of frames already read stay valid.
+        """
+        self._mm = None
+        self._fobj.close()
+
+class MucmWriter(object):
+    """
+    Writes frames to a multi-frame ucm container, creating it or appending to
+    an existing one. All frames must have the same format as the first.
+    Readers see each frame once it is completely written. e.g.::
+
+      writer = MucmWriter('abc', mccd)
+      writer.append(mccd)
+      ...
+      writer.close()
+    """
+
+    def __init__(self, fname, mccd=None, noverlay=1024):
+        """
+        fname    -- container file name. '.mucm' will be appended if not supplied.
+
+        mccd     -- MCCD defining the format and shared header of a new
+                    container, which overwrites any existing file. If None,
+                    an existing container is opened for appending. The frame
+                    itself is not written (see 'append').
+
+        noverlay -- bytes to reserve in each frame for header items specific
+                    to it (see 'append'). Rounded up to a multiple of 8.
+        """
+        if not fname.endswith('.mucm'): fname += '.mucm'
+        self.fname = fname
+
+        if mccd is None:
+            mucm = Mucm(fname, mmap=False)
+            self.head    = mucm.head
+            self._layout = mucm._layout
+            self._nframe = len(mucm)
+            mucm.close()
+            if self._layout.endian != NATIVE:
+                raise UltracamError('MucmWriter.__init__: cannot append to ' + fname +
+                                    ' as it was written with the opposite byte order')
+            self._fobj = open(fname, 'r+b', 0)
+        else:
+            iout   = 0 if mccd.anyFloat() else 1
+            endian = NATIVE
+            layout = _Layout(mccd.fsig, iout, 8*((noverlay+7)//8), endian)
+            self.head = mccd.head if mccd.head is not None else Uhead()
+            pre = PRE_FORMATS[endian].pack(MAGIC_MUCM, MUCM_VERSION, 0, iout, layout.noverlay) + \
+                  self.head.pack() + layout.pack_format()
+            layout.start = 64*((len(pre)+63)//64)
+            self._layout = layout
+            self._nframe = 0
+            self._fobj   = open(fname, 'w+b', 0)
+            self._fobj.write(pre + (layout.start-len(pre))*b'\0')
+
+        self._nfmt  = struct.Struct(self._layout.endian + 'q')
+        self._otype = np.float32 if self._layout.iout == 0 else np.uint16
+
+    def __len__(self):
+        return self._nframe
+
+    def append(self, mccd, overlay=None):
+        """
+        Appends a frame. Data are converted to the type of the container if
+        need be (rounding floats if it holds integers). The header of the
+        MCCD is ignored; header items specific to the frame are passed
+        separately.
+
+        mccd    -- the frame. Must have the format of the container.
+
+        overlay -- Uhead of items to add to (or replace in) the shared header
+                   when the frame is read, e.g. a time stamp. Directories
+                   must already exist in the shared header. It must fit in the
+                   space reserved when the container was created.
+        """
+        lay = self._layout
+        if mccd.fsig != lay.fmt:
+            raise UltracamError('MucmWriter.append: frame format does not match that of ' + self.fname)
+
+        buffs = []
+        for ccd in mccd:
+            flags = TIME_CCDGOOD if ccd.good else 0
+            if ccd.time is not None:
+                time = ccd.time
+                buffs.append(lay.tstruct.pack(time.mjd, time.expose, flags | TIME_HAS,
+                                              1 if time.good else 0, 0,
+                                              time.reason.encode('utf-8')[:44]))
+            else:
+                buffs.append(lay.tstruct.pack(0., 0., flags, 0, 0, b''))
+
+        obytes = b'' if overlay is None or not len(overlay) else overlay.pack()
+        if len(obytes) > lay.noverlay:
+            raise UltracamError('MucmWriter.append: overlay of ' + str(len(obytes)) +
+                                ' bytes is larger than the ' + str(lay.noverlay) + ' reserved')
+        buffs.append(struct.pack(lay.endian + 'i4x', len(obytes)) + obytes +
+                     (lay.noverlay-len(obytes))*b'\0')
+
+        nbytes = lay.ntime + 8 + lay.noverlay
+        for ccd in mccd:
+            for win in ccd:
+                data = np.ascontiguousarray(win.astype(self._otype, copy=False))
+                buffs.append(data)
+                nbytes += data.nbytes
+        if nbytes < lay.stride:
+            buffs.append((lay.stride-nbytes)*b'\0')
+
+        # write the record, then count it
+        self._fobj.seek(lay.start + self._nframe*lay.stride)
+        write_buffers(self._fobj, buffs)
+        self._nframe += 1
+        self._fobj.seek(NFRAME_OFFSET)
+        self._fobj.write(self._nfmt.pack(self._nframe))
+
+    def close(self):
+        self._fobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+if __name__ == '__main__':
+    print('test passed')
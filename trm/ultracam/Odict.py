@@ -19,6 +19,11 @@ class Odict(dict):
     nincr   = 5
     nlength = 20
 
+    # modification count, incremented whenever items are set or removed so
+    # that anything derived from the dictionary can be cached (see
+    # Uhead.pack). In-place changes to mutable values are not noticed.
+    _stamp  = 0
+
     def __init__(self, dct = None):
         if dct == None:
             self._keys = []
@@ -42,9 +47,11 @@ class Odict(dict):
     def __delitem__(self, key):
         dict.__delitem__(self, key)
         self._keys.remove(key)
+        self._stamp += 1
 
     def __setitem__(self, key, item):
         dict.__setitem__(self, key, item)
+        self._stamp += 1
         # 'try' needed to avoid error with pickling with protocol = 2
         try:
             if key not in self._keys: self._keys.append(key)
@@ -68,6 +75,7 @@ class Odict(dict):
     def clear(self):
         dict.clear(self)
         self._keys = []
+        self._stamp += 1
 
     def copy(self):
         newInstance = Odict()
@@ -92,7 +100,9 @@ class Odict(dict):
         return (key, val)
 
     def setdefault(self, key, failobj = None):
-        if key not in self._keys: self._keys.append(key)
+        if key not in self._keys:
+            self._keys.append(key)
+            self._stamp += 1
         return dict.setdefault(self, key, failobj)
 
     def update(self, dct):
@@ -118,6 +128,7 @@ class Odict(dict):
         at the start of the list.
         """
         dict.__setitem__(self, key, item)
+        self._stamp += 1
         # 'try' needed to avoid error with pickling with protocol = 2
         try:
             if key not in self._keys: self._keys.insert(index, key)
@@ -0,0 +1,235 @@
+"""
+Reading runs from static web or archive servers with HTTP Range requests.
+
+Runs served as plain run###.xml / run###.dat files (rather than through the
+ATC FileServer) can be read by giving Rdata, Rtime or Rhead the URL of the
+run, e.g. Rdata('http://archive.org/ultracam/2012-03-04/run045'). Only the
+bytes needed are fetched. Reads are rounded out to whole blocks, runs of
+missing blocks are fetched with a single request, and blocks are kept in a
+process-wide cache so that random access (praw, u2ds9) does not fetch the
+same bytes twice.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import re
+from six.moves import urllib
+
+from trm.ultracam.Server import FrameCache
+from trm.ultracam.UErrors import UltracamError
+
+# Block cache shared by all RangeFiles, size set in MB by ULTRACAM_RANGE_CACHE
+BLOCK_CACHE = FrameCache(
+    1024*1024*int(os.environ.get('ULTRACAM_RANGE_CACHE', '64')))
+
+CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+def is_url(run):
+    """
+    Returns True if run (e.g. 'run045' or 'http://archive.org/run045') is a URL
+    """
+    return run.startswith('http://') or run.startswith('https://')
+
+def get_url(url):
+    """
+    Returns the contents of a URL (e.g. an xml file) as bytes
+    """
+    resp = urllib.request.urlopen(url)
+    try:
+        return resp.read()
+    finally:
+        resp.close()
+
+class RangeFile(object):
+    """
+    Read-only, seekable file-like object on a file served over HTTP, reading
+    with Range requests. It supports read, readinto, seek and tell, which is
+    all that Rdata and Rtime need. The size of the file is refreshed on
+    seeking relative to the end, so files that are growing can be followed.
+
+    Servers that ignore Range and return the whole file are coped with by
+    keeping the whole file in memory; this is noted in the attribute 'ranges',
+    which is set False.
+
+    Attributes:
+
+      url      -- the URL of the file
+      blocksize -- size of the blocks in which the file is read
+      nrequest -- number of GET requests made so far
+      nbytes   -- number of bytes fetched so far
+    """
+
+    def __init__(self, url, blocksize=256*1024, cache=None):
+        """
+        url       -- URL of the file
+
+        blocksize -- reads are rounded out to whole blocks of this many bytes
+
+        cache     -- FrameCache to keep blocks in. Defaults to the process-wide
+                     BLOCK_CACHE.
+        """
+        if blocksize < 1:
+            raise UltracamError('RangeFile.__init__: blocksize must be > 0')
+        self.url       = url
+        self.blocksize = blocksize
+        self.cache     = BLOCK_CACHE if cache is None else cache
+        self.ranges    = True
+        self.nrequest  = 0
+        self.nbytes    = 0
+        self.closed    = False
+        self._pos      = 0
+        self._size     = None
+        self._whole    = None
+
+    def size(self, refresh=False):
+        """
+        Returns the size of the file in bytes, finding it with a HEAD request
+        if it is not yet known or refresh is True.
+        """
+        if self._whole is not None and not refresh:
+            return len(self._whole)
+        if self._size is None or refresh:
+            req = urllib.request.Request(self.url)
+            req.get_method = lambda : 'HEAD'
+            resp = urllib.request.urlopen(req)
+            try:
+                length = resp.info().get('Content-Length')
+            finally:
+                resp.close()
+            if length is None:
+                raise UltracamError('RangeFile.size: no Content-Length for ' + self.url)
+            self._size = int(length)
+        return self._size
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        elif whence == 2:
+            self._pos = self.size(True) + offset
+        else:
+            raise UltracamError('RangeFile.seek: whence = ' + str(whence) + ' not recognised')
+        if self._pos < 0:
+            self._pos = 0
+            raise IOError('RangeFile.seek: attempt to seek before start of file')
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, nbytes=-1):
+        """
+        Reads up to nbytes bytes from the current position, fewer if the end of
+        the file is reached. nbytes < 0 reads to the end of the file.
+        """
+        if nbytes < 0:
+            nbytes = max(0, self.size() - self._pos)
+        if nbytes == 0:
+            return b''
+
+        if self._whole is not None:
+            buff = self._whole[self._pos:self._pos+nbytes]
+            self._pos += len(buff)
+            return buff
+
+        # blocks spanned by the read, found in the cache or fetched.
+        b1 = self._pos // self.blocksize
+        b2 = (self._pos + nbytes - 1) // self.blocksize
+        blocks = [self.cache.get((self.url, nb)) for nb in range(b1, b2+1)]
+        nb = 0
+        while nb < len(blocks):
+            if blocks[nb] is None:
+                # fetch this block and any missing ones following it in one go
+                ne = nb + 1
+                while ne < len(blocks) and blocks[ne] is None:
+                    ne += 1
+                fetched = self._fetch(b1+nb, b1+ne)
+                if self._whole is not None:
+                    # server ignored the Range request
+                    return self.read(nbytes)
+                blocks[nb:ne] = fetched
+                if len(fetched) < ne-nb:
+                    # end of file reached
+                    del blocks[nb+len(fetched):]
+                    break
+                nb = ne
+            else:
+                nb += 1
+
+        start = self._pos - b1*self.blocksize
+        buff  = b''.join(blocks)[start:start+nbytes]
+        self._pos += len(buff)
+        return buff
+
+    def readinto(self, buff):
+        """
+        Reads into a pre-allocated, writable buffer, returning the number of
+        bytes read.
+        """
+        mv   = memoryview(buff)
+        if mv.ndim != 1 or mv.itemsize != 1:
+            raise UltracamError('RangeFile.readinto: buffer must be 1D and of bytes')
+        data = self.read(len(mv))
+        mv[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.closed = True
+        self._whole = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _fetch(self, b1, b2):
+        """
+        Fetches blocks b1 to b2-1 with one request, stores the complete ones in
+        the cache and returns them as a list, which is short at the end of the
+        file. The final block of a file is not cached as it may grow.
+        """
+        first = b1*self.blocksize
+        last  = b2*self.blocksize - 1
+        req   = urllib.request.Request(self.url, headers={'Range' : 'bytes=' + str(first) + '-' + str(last)})
+        try:
+            resp = urllib.request.urlopen(req)
+        except urllib.error.HTTPError as err:
+            if err.code == 416:
+                # range not satisfiable: beyond the end of the file
+                return []
+            raise
+
+        try:
+            self.nrequest += 1
+            buff  = resp.read()
+            self.nbytes += len(buff)
+            if resp.getcode() == 200:
+                # whole file returned
+                self.ranges = False
+                self._whole = buff
+                self._size  = len(buff)
+                return []
+
+            mat = CONTENT_RANGE_RE.match(resp.info().get('Content-Range', ''))
+            if not mat or int(mat.group(1)) != first:
+                raise UltracamError('RangeFile._fetch: unexpected Content-Range from ' + self.url)
+            if mat.group(3) != '*':
+                self._size = int(mat.group(3))
+        finally:
+            resp.close()
+
+        blocks = []
+        for n, nb in enumerate(range(b1, b2)):
+            block = buff[n*self.blocksize:(n+1)*self.blocksize]
+            if not len(block):
+                break
+            if len(block) == self.blocksize:
+                self.cache.put((self.url, nb), block)
+            blocks.append(block)
+        return blocks
+
+if __name__ == '__main__':
+    print('test passed')
@@ -4,8 +4,12 @@ Section for handling the raw ULTRACAM data and xml files
 from __future__ import absolute_import
 from __future__ import print_function
 
+import io
+import os
+import copy
 import struct
 import warnings
+import threading
 import xml.dom.minidom
 from six.moves import zip
 from six.moves import urllib
@@ -20,12 +24,202 @@ except ImportError:
 from trm.ultracam.Constants import *
 from trm.ultracam.CCD import CCD
 from trm.ultracam.MCCD import MCCD, UCAM
-from trm.ultracam.Server import get_nframe_from_server, URL
+from trm.ultracam.Server import get_nframe_from_server, get_frame_from_server, \
+    get_timing_from_server, get_xml_from_server
+from trm.ultracam.Range import RangeFile, is_url, get_url
+from trm.ultracam.Zdat import ZdatFile
+from trm.ultracam.Cdat import CdatFile, find_cdat
 from trm.ultracam.Time import Time
 from trm.ultracam.Window import Window
 from trm.ultracam.Uhead import Uhead
+from trm.ultracam.Utils import thread_pool, set_dict_state
 from trm.ultracam.UErrors import PowerOnOffError, UendError, UltracamError
 
+# file types np.fromfile can read from directly
+REAL_FILES = (io.FileIO,) if six.PY3 else (io.FileIO, file)
+
+def open_dat(rhead, raw=True):
+    """
+    Opens the data file of a run for random-access binary reading, returning
+    a file-like object. Besides a local run###.dat file, this can be:
+
+      a run on a web server, if the run name is a URL, read with HTTP Range
+      requests (a RangeFile, see Range.py);
+
+      a compressed .zdat file (a ZdatFile, see Zdat.py);
+
+      a .dat file compressed with gzip, bzip2 or xz, e.g. run###.dat.gz
+      (a CdatFile, see Cdat.py).
+
+    Local files are tried in that order if there is no .dat file.
+
+    rhead -- the Rhead of the run
+
+    raw   -- for plain files, True for an unbuffered file. This is needed in
+             Python 3 because `open()` returns an `io.BufferedReader` by default,
+             which does not cope with the mix of np.fromfile and seeks that Rdata
+             uses.
+    """
+    run = rhead.run
+    if is_url(run):
+        return RangeFile(run + '.dat')
+    elif not os.path.exists(run + '.dat'):
+        if os.path.exists(run + '.zdat'):
+            return ZdatFile(run + '.zdat')
+        cname = find_cdat(run)
+        if cname is not None:
+            return CdatFile(cname, rhead.framesize, rhead.headerwords)
+
+    if raw and six.PY3:
+        return open(run + '.dat', 'rb', buffering=0)
+    else:
+        return open(run + '.dat', 'rb')
+
+def dat_exists(run):
+    """
+    Returns True if a local run has a data file that open_dat can read,
+    whether a plain .dat file or a compressed one.
+
+    run -- run name, e.g. 'run045'
+    """
+    return os.path.exists(run + '.dat') or os.path.exists(run + '.zdat') or \
+        find_cdat(run) is not None
+
+def read_u2(fobj, count):
+    """
+    Reads up to count little-endian unsigned 2-byte ints from a file object as
+    returned by open_dat, returning them as a numpy array.
+    """
+    if isinstance(fobj, REAL_FILES):
+        return np.fromfile(fobj,'<u2',count)
+    buff = fobj.read(2*count)
+    return np.frombuffer(buff[:2*(len(buff)//2)],'<u2').copy()
+
+class Rfile(object):
+    """
+    Handle on the data file of a run which can be shared between threads.
+    Reads are positional (os.pread / os.preadv on plain files), so there is no
+    shared file position to disturb, and any number of readers (see
+    Rdata.cursor) can read different frames at once. Other kinds of file
+    (see open_dat) are read with a seek and read under a lock.
+
+    The file is opened when first needed. An Rfile pickles as just the name
+    of the run and its frame size, so that it (and an Rdata holding it) can
+    be sent to another process, where the file is opened again.
+
+    Attributes:
+
+      run         -- the run
+      framesize   -- bytes per frame
+      headerwords -- number of 2-byte timing words per frame
+    """
+
+    def __init__(self, rhead):
+        """
+        rhead -- the Rhead of the run
+        """
+        self.run         = rhead.run
+        self.framesize   = rhead.framesize
+        self.headerwords = rhead.headerwords
+        self._lock = threading.Lock()
+        self._fobj = None
+        self._fd   = None
+
+    def __getstate__(self):
+        return (self.run, self.framesize, self.headerwords)
+
+    def __setstate__(self, state):
+        self.run, self.framesize, self.headerwords = state
+        self._lock = threading.Lock()
+        self._fobj = None
+        self._fd   = None
+
+    def _open(self):
+        # open_dat only needs the run, framesize and headerwords
+        with self._lock:
+            if self._fobj is None:
+                fobj = open_dat(self)
+                if isinstance(fobj, REAL_FILES) and hasattr(os, 'pread'):
+                    self._fd = fobj.fileno()
+                self._fobj = fobj
+
+    def readinto(self, buff, offset):
+        """
+        Reads into the writable buffer buff from byte offset in the file,
+        returning the number of bytes read, fewer than the size of buff only
+        at the end of the file.
+        """
+        if self._fobj is None:
+            self._open()
+        mv    = memoryview(buff).cast('B')
+        nread = 0
+        if self._fd is not None:
+            while nread < len(mv):
+                if hasattr(os, 'preadv'):
+                    n = os.preadv(self._fd, [mv[nread:]], offset+nread)
+                else:
+                    data = os.pread(self._fd, len(mv)-nread, offset+nread)
+                    n = len(data)
+                    mv[nread:nread+n] = data
+                if n == 0:
+                    break
+                nread += n
+        else:
+            with self._lock:
+                self._fobj.seek(offset)
+                while nread < len(mv):
+                    n = self._fobj.readinto(mv[nread:])
+                    if not n:
+                        break
+                    nread += n
+        return nread
+
+    def read_frame(self, nf):
+        """
+        Reads frame nf (from 1), returning (tbytes, data): the timing bytes and
+        a numpy array of the data as little-endian unsigned 2-byte ints. Near
+        the end of the file either can be short.
+        """
+        hbytes = 2*self.headerwords
+        buff   = np.empty(self.framesize, np.uint8)
+        nread  = self.readinto(buff, self.framesize*(nf-1))
+        tbytes = buff[:min(nread,hbytes)].tobytes()
+        ndata  = max(0, nread-hbytes) // 2
+        return (tbytes, buff[hbytes:hbytes+2*ndata].view('<u2'))
+
+    def read_timing(self, nf):
+        """
+        Returns the timing bytes of frame nf (from 1), short at the end of the
+        file.
+        """
+        if self._fobj is None:
+            self._open()
+        if self._fd is None:
+            # the file may have a faster route to timing bytes (see CdatFile)
+            with self._lock:
+                self._fobj.seek(self.framesize*(nf-1))
+                return self._fobj.read(2*self.headerwords)
+        buff = bytearray(2*self.headerwords)
+        return bytes(buff[:self.readinto(buff, self.framesize*(nf-1))])
+
+    def nframe(self):
+        """
+        Returns the number of complete frames in the file
+        """
+        if self._fobj is None:
+            self._open()
+        if self._fd is not None:
+            return os.fstat(self._fd).st_size // self.framesize
+        with self._lock:
+            self._fobj.seek(0,2)
+            return self._fobj.tell() // self.framesize
+
+    def close(self):
+        if self._fobj is not None:
+            self._fobj.close()
+            self._fobj = None
+            self._fd   = None
+
 class Rwin(object):
     """
     Trivial container class for basic window info
@@ -34,12 +228,22 @@ class Rwin(object):
     pixel of a window and its binned dimensions.
     Used in the 'wins' attribute of Rhead
     """
+
+    __slots__ = ('llx', 'lly', 'nx', 'ny')
+
     def __init__(self, llx, lly, nx, ny):
         self.llx = llx
         self.lly = lly
         self.nx  = nx
         self.ny  = ny
 
+    def __getstate__(self):
+        return (self.llx, self.lly, self.nx, self.ny)
+
+    def __setstate__(self, state):
+        if not set_dict_state(self, state):
+            self.llx, self.lly, self.nx, self.ny = state
+
     def __str__(self):
         return str(self.llx) + ',' + str(self.lly) + ',' + str(self.nx) + ',' + str(self.ny)
 
@@ -124,13 +328,12 @@ class Rhead (object):
         self.run    = run
         self.server = server
         if server:
-            if URL is None:
-                raise UltracamError('Rhead.__init__: no url for server found.' +
-                                    ' Have you set the ULTRACAM_DEFAULT_URL environment variable?')
             # get from server
-            full_url = URL + run + '?action=get_xml'
-            sxml = urllib.request.urlopen(full_url).read()
+            sxml = get_xml_from_server(run)
             udom = xml.dom.minidom.parseString(sxml)
+        elif is_url(run):
+            # static file on a web server
+            udom = xml.dom.minidom.parseString(get_url(run + '.xml'))
         else:
             # local disk file
             udom = xml.dom.minidom.parse(run + '.xml')
@@ -476,10 +679,18 @@ class Rdata (Rhead):
       for frm in Rdata('run045'):
          print 'nccd = ',frm.nccd()
 
-    Rdata maintains an internal file object that is always at the start of a
-    frame. This enables sequential reads to be swift. If an attempt is made
-    to access a frame that does not exist, it defaults to the start of the
-    file.
+    Rdata keeps a count of the next frame to read, which makes sequential
+    reads simple. If an attempt is made to access a frame that does not
+    exist, it defaults to the start of the file.
+
+    The data file is read through an :class:`trm.ultracam.Rfile` with
+    positional reads, which can be shared between threads. An Rdata itself
+    holds the position and timing state of one reader and should be used by
+    one thread at a time; others can be given their own readers of the same
+    open file with cursor, e.g.::
+
+      rdat = Rdata('run045')
+      cur  = rdat.cursor(100)
 
     The above code returns :class:`trm.ultracam.MCCD` objects for ULTRACAM data. By default
     the frames are always read as :class:`trm.ultracam.MCCD` objects, however there is
@@ -491,7 +702,8 @@ class Rdata (Rhead):
 
     """
 
-    def __init__(self, run, nframe=1, flt=True, server=False, ccd=False):
+    def __init__(self, run, nframe=1, flt=True, server=False, ccd=False, calib=None,
+                 nthreads=1):
         """
         Connects to a raw data file for reading. The file is kept open.
         The file pointer is set to the start of frame nframe. The Rdata
@@ -499,7 +711,9 @@ class Rdata (Rhead):
         as a function or iterator.
 
         Args:
-          run (string) : run name, e.g. 'run036'.
+          run (string) : run name, e.g. 'run036', or the URL of a run served
+                         as static files, e.g. 'http://archive.org/run036',
+                         which is then read with HTTP Range requests.
 
           nframe (int) : frame number for first read, starting at 1 as the first.
 
@@ -515,6 +729,17 @@ class Rdata (Rhead):
           ccd (bool) : flag to read data as a :class:`trm.ultracam.CCD` rather
                        than a :class:`trm.ultracam.MCCD` object if only one CCD
                        per frame. Default is always to read as an MCCD.
+
+          calib (Calib) : calibration (bias, dark, flat) to apply to each frame
+                          as it is decoded from the raw data, giving float32
+                          data regardless of flt. See :class:`trm.ultracam.Calib`.
+
+          nthreads (int) : number of threads over which to spread the copying
+                           (and calibration) of the CCDs of each frame once
+                           read. numpy releases the GIL for this work, so
+                           ULTRACAM frames, with 3 CCDs, are finished up to 3
+                           times faster with nthreads=3, which is most useful
+                           for large formats.
         """
 
         Rhead.__init__(self, run, server)
@@ -523,33 +748,39 @@ class Rdata (Rhead):
 
         # Attributes set are:
         #
-        # _fobj   -- file object opened on data file (set to None if using server)
+        # _fobj   -- Rfile on the data file, shared by cursors (None if using server)
         # _nf     -- next frame to be read
         # _run    -- name of run
         # _flt    -- whether to read as float (else uint16)
-        # _tstamp -- list of immediately preceding times
+        # _tstate -- timing state carried from frame to frame (see utimer)
+        # _calib  -- calibration applied to each frame, or None
+        # _nthreads -- number of threads used to finish each frame's CCDs
+        # _dplan  -- decode plan used by iter_arrays, found when first needed
         if server:
             self._fobj   = None
         else:
-            if six.PY3:
-                """
-                This exists because in Python 3, `open()` returns an
-                `io.BufferedReader` by default.  This is bad, because
-                `io.BufferedReader` doesn't support random access, which we may need in
-                some cases.  In the Python 3 case (implemented in the py3compat module)
-                we must call open with buffering=0 to get a raw random-access file
-                """
-                self._fobj   = open(run + '.dat', 'rb', buffering=0)
-            else:
-                self._fobj   = open(run + '.dat', 'rb')
+            self._fobj   = Rfile(self)
 
         self._nf     = nframe
         self._run    = run
         self._flt    = flt
-        self._tstamp = []
+        self._tstate = Tstate()
         self._ccd    = ccd
-        if not server and nframe != 1:
-            self._fobj.seek(self.framesize*(nframe-1))
+        self._calib  = calib
+        self._nthreads = nthreads
+        self._dplan  = None
+
+    def cursor(self, nframe=1):
+        """
+        Returns a new reader of the run, with the same settings and sharing
+        the open data file, but with its own position (starting at frame
+        nframe) and timing state. The two can then be used independently, e.g.
+        from different threads.
+        """
+        cur = copy.copy(self)
+        cur._nf     = nframe
+        cur._tstate = Tstate()
+        return cur
 
     def __iter__(self):
         """
@@ -566,7 +797,7 @@ class Rdata (Rhead):
 
     def set(self, nframe=1):
         """
-        Sets the internal file pointer to point at frame nframe.
+        Sets the next frame to be read to nframe.
 
         Args:
           nframe (int) : frame number to get, starting at 1. 0 for the
@@ -585,17 +816,8 @@ class Rdata (Rhead):
                 if self.server:
                     self._nf = get_nframe_from_server(self.run)
                 else:
-                    # wind to end of file, work out where we are
-                    # to deduce number of frames
-                    self._fobj.seek(0,2)
-                    fp = self._fobj.tell()
-                    nf = fp // self.framesize
-                    self._fobj.seek(self.framesize*(nf-1)-fp,2)
-                    self._nf = nf
-
-            elif self._nf != nframe:
-                if not self.server:
-                    self._fobj.seek(self.framesize*(nframe-1))
+                    self._nf = self._fobj.nframe()
+            else:
                 self._nf = nframe
 
     def __call__(self, nframe=None, flt=None):
@@ -614,7 +836,8 @@ class Rdata (Rhead):
                   disk as unsigned 2-byte ints. If you are not doing much to
                   the data, and wish to keep them in this form for speed and
                   efficiency, then set flt=False. If None then the value used when
-                  constructing the MCCD will be used.
+                  constructing the MCCD will be used. Ignored if a calibration
+                  was set, as calibrated data are always float32.
 
         Returns a UCAM object for ULTRACAM, CCD for ULTRASPEC.
         """
@@ -624,42 +847,13 @@ class Rdata (Rhead):
         # position read pointer
         self.set(nframe)
 
-        if self.server:
-            # read timing and data in one go from the server
-            full_url = URL + self.run + '?action=get_frame&frame=' + str(self._nf-1)
-            buff     = urllib.request.urlopen(full_url).read()
-            if len(buff) != self.framesize:
-                self._nf = 1
-                raise UltracamError('Rdata.__call__: failed to read frame ' + str(self._nf) +
-                                    ' from FileServer. Buffer length vs expected = '
-                                    + str(len(buff)) + ' vs ' + str(self.framesize) + ' bytes.')
-
-            # have data. Re-format into the timing bytes and unsigned 2 byte
-            # int data buffer
-            tbytes = buff[:2*self.headerwords]
-            buff   = np.fromstring(buff[2*self.headerwords:],dtype='uint16')
-        else:
-            # read timing bytes
-            tbytes = self._fobj.read(2*self.headerwords)
-            if len(tbytes) != 2*self.headerwords:
-                self._fobj.seek(0)
-                self._nf = 1
-                raise UendError('Rdata.__call__: failed to read timing bytes')
-
-            # read data
-            buff = np.fromfile(self._fobj,'<u2',int(self.framesize/2-self.headerwords))
-            if len(buff) != self.framesize/2-self.headerwords:
-                self._fobj.seek(0)
-                self._nf = 1
-                raise UltracamError('Rdata.__call__: failed to read frame ' + str(self._nf) +
-                                    '. Buffer length vs attempted = '
-                                    + str(len(buff)) + ' vs ' + str(self.framesize/2-self.headerwords))
+        tbytes, buff = self._read()
 
         # OK from this point, both server and local disk methods are the same
         if self.instrument == 'ULTRACAM':
-            time,info,blueTime,badBlue = utimer(tbytes, self, self._nf)
+            time,info,blueTime,badBlue = utimer(tbytes, self, self._nf, self._tstate)
         elif self.instrument == 'ULTRASPEC':
-            time,info = utimer(tbytes, self, self._nf)
+            time,info = utimer(tbytes, self, self._nf, self._tstate)
 
         # move frame counter on by one
         self._nf += 1
@@ -723,7 +917,69 @@ class Rdata (Rhead):
         head.add_entry('Frame.ferror',info['frameError'],ITYPE_BOOL,
                        'problem with frame numbers found')
 
-        # interpret data
+        # interpret data. Windows are made as views of the raw data (see
+        # _windows), then copied into contiguous storage per CCD (see
+        # CCD.pack), or calibrated straight from the raw data into it (see
+        # Calib.apply)
+        dtype = np.float32 if flt else np.uint16
+        wins  = self._windows(buff)
+        if self.instrument == 'ULTRACAM':
+            ccds = [CCD(wins[0], time, self.nxmax, self.nymax, True, None),
+                    CCD(wins[1], time, self.nxmax, self.nymax, True, None),
+                    CCD(wins[2], blueTime, self.nxmax, self.nymax, not badBlue, None)]
+            ccds = self._finish(ccds, dtype)
+
+            # Return a UCAM object
+            return UCAM(ccds, head)
+
+        else:
+            ccd = self._finish([CCD(wins[0], time, self.nxmax, self.nymax, True, head)], dtype)[0]
+            if self._ccd:
+                return ccd
+            else:
+                return MCCD([ccd,], head)
+
+    def _read(self):
+        """
+        Reads frame _nf, returning (tbytes, buff), its timing bytes and a 1D
+        array of its data as unsigned 2-byte ints.
+        """
+        if self.server:
+            # read timing and data in one go from the server
+            buff = get_frame_from_server(self.run, self._nf, self.framesize)
+            if len(buff) != self.framesize:
+                self._nf = 1
+                raise UltracamError('Rdata.__call__: failed to read frame ' + str(self._nf) +
+                                    ' from FileServer. Buffer length vs expected = '
+                                    + str(len(buff)) + ' vs ' + str(self.framesize) + ' bytes.')
+
+            # have data. Re-format into the timing bytes and unsigned 2 byte
+            # int data buffer
+            tbytes = buff[:2*self.headerwords]
+            # (copied since the cached buffer is shared and immutable)
+            buff   = np.frombuffer(buff,'<u2',offset=2*self.headerwords).copy()
+        else:
+            # read timing bytes and data
+            tbytes, buff = self._fobj.read_frame(self._nf)
+            if len(tbytes) != 2*self.headerwords:
+                self._nf = 1
+                raise UendError('Rdata.__call__: failed to read timing bytes')
+
+            if len(buff) != self.framesize/2-self.headerwords:
+                self._nf = 1
+                raise UltracamError('Rdata.__call__: failed to read frame ' + str(self._nf) +
+                                    '. Buffer length vs attempted = '
+                                    + str(len(buff)) + ' vs ' + str(self.framesize/2-self.headerwords))
+        return (tbytes, buff)
+
+    def _windows(self, buff):
+        """
+        Interprets the data of a frame, returning a list of lists of
+        :class:`trm.ultracam.Window`, one list per CCD, with data that are
+        views of buff (some overscan windows excepted).
+
+        buff -- 1D array of the data of a frame
+        """
         xbin, ybin = self.xbin, self.ybin
         if self.instrument == 'ULTRACAM':
             # 3 CCDs. Windows come in pairs. Data from equivalent windows come out
@@ -740,72 +996,15 @@ class Rdata (Rhead):
                 noff = 0
                 for wl, wr in zip(self.win[::2],self.win[1::2]):
                     npix = 6*wl.nx*wl.ny
-                    if flt:
+                    for nc, wins in enumerate((wins1,wins2,wins3)):
+                        left  = np.reshape(buff[noff+2*nc:noff+npix:6],(wl.ny,wl.nx))
+                        right = np.reshape(buff[noff+2*nc+1:noff+npix:6],(wr.ny,wr.nx))
                         if strip_outer:
-                            wins1.append(
-                                Window(np.reshape(buff[noff:noff+npix:6].astype(np.float32),
-                                                  (wl.ny,wl.nx))[:,1:],wl.llx,wl.lly,xbin,ybin))
-                            wins1.append(
-                                Window(np.reshape(buff[noff+1:noff+npix:6].astype(np.float32),
-                                                  (wr.ny,wr.nx))[:,-2::-1],wr.llx+xbin,wr.lly,xbin,ybin))
-                            wins2.append(
-                                Window(np.reshape(buff[noff+2:noff+npix:6].astype(np.float32),
-                                                  (wl.ny,wl.nx))[:,1:],wl.llx,wl.lly,xbin,ybin))
-                            wins2.append(
-                                Window(np.reshape(buff[noff+3:noff+npix:6].astype(np.float32),
-                                                  (wr.ny,wr.nx))[:,-2::-1],wr.llx+xbin,wr.lly,xbin,ybin))
-                            wins3.append(
-                                Window(np.reshape(buff[noff+4:noff+npix:6].astype(np.float32),
-                                                  (wl.ny,wl.nx))[:,1:],wl.llx,wl.lly,xbin,ybin))
-                            wins3.append(
-                                Window(np.reshape(buff[noff+5:noff+npix:6].astype(np.float32),
-                                                  (wr.ny,wr.nx))[:,-2::-1],wr.llx+xbin,wr.lly,xbin,ybin))
+                            wins.append(Window(left[:,1:],wl.llx,wl.lly,xbin,ybin))
+                            wins.append(Window(right[:,-2::-1],wr.llx+xbin,wr.lly,xbin,ybin))
                         else:
-                            wins1.append(
-                                Window(np.reshape(buff[noff:noff+npix:6].astype(np.float32),
-                                                  (wl.ny,wl.nx)),wl.llx,wl.lly,xbin,ybin))
-                            wins1.append(
-                                Window(np.reshape(buff[noff+1:noff+npix:6].astype(np.float32),
-                                                  (wr.ny,wr.nx))[:,::-1],wr.llx,wr.lly,xbin,ybin))
-                            wins2.append(
-                                Window(np.reshape(buff[noff+2:noff+npix:6].astype(np.float32),
-                                                  (wl.ny,wl.nx)),wl.llx,wl.lly,xbin,ybin))
-                            wins2.append(
-                                Window(np.reshape(buff[noff+3:noff+npix:6].astype(np.float32),
-                                                  (wr.ny,wr.nx))[:,::-1],wr.llx,wr.lly,xbin,ybin))
-                            wins3.append(
-                                Window(np.reshape(buff[noff+4:noff+npix:6].astype(np.float32),
-                                                  (wl.ny,wl.nx)),wl.llx,wl.lly,xbin,ybin))
-                            wins3.append(
-                                Window(np.reshape(buff[noff+5:noff+npix:6].astype(np.float32),
-                                                  (wr.ny,wr.nx))[:,::-1],wr.llx,wr.lly,xbin,ybin))
-                    else:
-                        if strip_outer:
-                            wins1.append(Window(np.reshape(buff[noff:noff+npix:6],(wl.ny,wl.nx))[:,1:],
-                                                wl.llx,wl.lly,xbin,ybin))
-                            wins1.append(Window(np.reshape(buff[noff+1:noff+npix:6],(wr.ny,wr.nx))[:,-2::-1],
-                                                wr.llx+xbin,wr.lly,xbin,ybin))
-                            wins2.append(Window(np.reshape(buff[noff+2:noff+npix:6],(wl.ny,wl.nx))[:,1:],
-                                                wl.llx,wl.lly,xbin,ybin))
-                            wins2.append(Window(np.reshape(buff[noff+3:noff+npix:6],(wr.ny,wr.nx))[:,-2::-1],
-                                                wr.llx+xbin,wr.lly,xbin,ybin))
-                            wins3.append(Window(np.reshape(buff[noff+4:noff+npix:6],(wl.ny,wl.nx))[:,1:],
-                                                wl.llx,wl.lly,xbin,ybin))
-                            wins3.append(Window(np.reshape(buff[noff+5:noff+npix:6],(wr.ny,wr.nx))[:,-2::-1],
-                                                wr.llx+xbin,wr.lly,xbin,ybin))
-                        else:
-                            wins1.append(Window(np.reshape(buff[noff:noff+npix:6],(wl.ny,wl.nx)),
-                                                wl.llx,wl.lly,xbin,ybin))
-                            wins1.append(Window(np.reshape(buff[noff+1:noff+npix:6],(wr.ny,wr.nx))[:,::-1],
-                                                wr.llx,wr.lly,xbin,ybin))
-                            wins2.append(Window(np.reshape(buff[noff+2:noff+npix:6],(wl.ny,wl.nx)),
-                                                wl.llx,wl.lly,xbin,ybin))
-                            wins2.append(Window(np.reshape(buff[noff+3:noff+npix:6],(wr.ny,wr.nx))[:,::-1],
-                                                wr.llx,wr.lly,xbin,ybin))
-                            wins3.append(Window(np.reshape(buff[noff+4:noff+npix:6],(wl.ny,wl.nx)),
-                                                wl.llx,wl.lly,xbin,ybin))
-                            wins3.append(Window(np.reshape(buff[noff+5:noff+npix:6],(wr.ny,wr.nx))[:,::-1],
-                                                wr.llx,wr.lly,xbin,ybin))
+                            wins.append(Window(left,wl.llx,wl.lly,xbin,ybin))
+                            wins.append(Window(right[:,::-1],wr.llx,wr.lly,xbin,ybin))
                     noff += npix
             else:
                 # Overscan modes need special re-formatting. See the description under Rhead
@@ -815,20 +1014,12 @@ class Rdata (Rhead):
                 nxb  = 540 // xbin
                 nyb  = 1032 // ybin
                 npix = 6*nxb*nyb
-                if flt:
-                    winl1 = np.reshape(buff[:npix:6].astype(np.float32),(nyb,nxb))
-                    winr1 = np.reshape(buff[1:npix:6].astype(np.float32),(nyb,nxb))[:,::-1]
-                    winl2 = np.reshape(buff[2:npix:6].astype(np.float32),(nyb,nxb))
-                    winr2 = np.reshape(buff[3:npix:6].astype(np.float32),(nyb,nxb))[:,::-1]
-                    winl3 = np.reshape(buff[4:npix:6].astype(np.float32),(nyb,nxb))
-                    winr3 = np.reshape(buff[5:npix:6].astype(np.float32),(nyb,nxb))[:,::-1]
-                else:
-                    winl1 = np.reshape(buff[:npix:6],(nyb,nxb))
-                    winr1 = np.reshape(buff[1:npix:6],(nyb,nxb))[:,::-1]
-                    winl2 = np.reshape(buff[2:npix:6],(nyb,nxb))
-                    winr2 = np.reshape(buff[3:npix:6],(nyb,nxb))[:,::-1]
-                    winl3 = np.reshape(buff[4:npix:6],(nyb,nxb))
-                    winr3 = np.reshape(buff[5:npix:6],(nyb,nxb))[:,::-1]
+                winl1 = np.reshape(buff[:npix:6],(nyb,nxb))
+                winr1 = np.reshape(buff[1:npix:6],(nyb,nxb))[:,::-1]
+                winl2 = np.reshape(buff[2:npix:6],(nyb,nxb))
+                winr2 = np.reshape(buff[3:npix:6],(nyb,nxb))[:,::-1]
+                winl3 = np.reshape(buff[4:npix:6],(nyb,nxb))
+                winr3 = np.reshape(buff[5:npix:6],(nyb,nxb))[:,::-1]
 
                 # For the reasons outlined in Rhead, we actually want to chop up
                 # these 2 "data windows" into 6 per CCD. This is what we do next:
@@ -892,13 +1083,7 @@ class Rdata (Rhead):
                 wins2.append(Window(winr2[yoff:yoff+w.ny,xoff:xoff+w.nx],w.llx,w.lly,xbin,ybin))
                 wins3.append(Window(winr3[yoff:yoff+w.ny,xoff:xoff+w.nx],w.llx,w.lly,xbin,ybin))
 
-            # Build the CCDs
-            ccd1 = CCD(wins1, time, self.nxmax, self.nymax, True, None)
-            ccd2 = CCD(wins2, time, self.nxmax, self.nymax, True, None)
-            ccd3 = CCD(wins3, blueTime, self.nxmax, self.nymax, not badBlue, None)
-
-            # Return a UCAM object
-            return UCAM([ccd1,ccd2,ccd3], head)
+            return [wins1, wins2, wins3]
 
         elif self.instrument == 'ULTRASPEC':
 
@@ -918,25 +1103,15 @@ class Rdata (Rhead):
 
                     if self.output == 'N':
                         # normal output, multi windows.
-                        if flt:
-                            wins.append(
-                                Window(np.reshape(buff[noff:noff+npix].astype(np.float32),
-                                                  (w.ny,w.nx))[:,nchop:],llx,w.lly,xbin,ybin))
-                        else:
-                            wins.append(
-                                Window(np.reshape(buff[noff:noff+npix],(w.ny,w.nx))[:,nchop:],
-                                       llx,w.lly,xbin,ybin))
+                        wins.append(
+                            Window(np.reshape(buff[noff:noff+npix],(w.ny,w.nx))[:,nchop:],
+                                   llx,w.lly,xbin,ybin))
 
                     elif self.output == 'A':
                         # avalanche output, multi windows.
-                        if flt:
-                            wins.append(
-                                Window(np.reshape(buff[noff:noff+npix].astype(np.float32),
-                                                  (w.ny,w.nx))[:,nchop::-1],llx,w.lly,xbin,ybin))
-                        else:
-                            wins.append(
-                                Window(np.reshape(buff[noff:noff+npix],
-                                                  (w.ny,w.nx))[:,nchop::-1],llx,w.lly,xbin,ybin))
+                        wins.append(
+                            Window(np.reshape(buff[noff:noff+npix],
+                                              (w.ny,w.nx))[:,nchop::-1],llx,w.lly,xbin,ybin))
 
                     noff += npix
 
@@ -960,29 +1135,113 @@ class Rdata (Rhead):
 
                 if self.output == 'N':
                     # normal output, drift
-                    if flt:
-                        comb = np.reshape(buff[:npix].astype(np.float32),(wl.ny,wl.nx+wr.nx))
-                    else:
-                        comb = np.reshape(buff[:npix],(wl.ny,wl.nx+wr.nx))
+                    comb = np.reshape(buff[:npix],(wl.ny,wl.nx+wr.nx))
 
                 elif self.output == 'A':
                     # avalanche output, drift
-                    if flt:
-                        comb = np.reshape(buff[:npix].astype(np.float32)[:,::-1],(wl.ny,wl.nx+wr.nx))
-                    else:
-                        comb = np.reshape(buff[:npix],(wl.ny,wl.nx+wr.nx)[:,::-1])
+                    comb = np.reshape(buff[:npix],(wl.ny,wl.nx+wr.nx))[:,::-1]
 
                 wins.append(Window(comb[:,nchopl:wl.nx],llxl,wl.lly,xbin,ybin))
                 wins.append(Window(comb[:,wl.nx+nchopr:],llxr,wl.lly,xbin,ybin))
 
-            if self._ccd:
-                return CCD(wins, time, self.nxmax, self.nymax, True, head)
-            else:
-                return MCCD([CCD(wins, time, self.nxmax, self.nymax, True, head),], head)
+            return [wins]
 
         else:
             raise UltracamError('Rdata.__init__: have not implemented anything for ' + self.instrument)
 
+    def _plan(self):
+        """
+        Returns the decode plan of the run, worked out once by interpreting an
+        array of the indices of the raw data of a frame (see _windows). For
+        each CCD it holds what picks its pixels out of the raw data in the
+        order of CCD.pack -- a slice if they form a contiguous block, else an
+        index array -- and the (start, end, shape) of each window within them.
+        """
+        if self._dplan is None:
+            index = np.arange(self.framesize//2-self.headerwords, dtype=np.intp)
+            plan  = []
+            for wins in self._windows(index):
+                if len(wins):
+                    sel = np.concatenate([win.data.ravel() for win in wins])
+                else:
+                    sel = np.empty(0, np.intp)
+                if len(sel) and (sel == np.arange(sel[0],sel[0]+len(sel))).all():
+                    sel = slice(sel[0], sel[0]+len(sel))
+                spans, off = [], 0
+                for win in wins:
+                    spans.append((off, off+win.size, (win.ny,win.nx)))
+                    off += win.size
+                plan.append((sel, tuple(spans)))
+            self._dplan = tuple(plan)
+        return self._dplan
+
+    def iter_arrays(self, flt=None):
+        """
+        Generator of the frames of the run as bare numpy arrays, for pipelines
+        that only need pixels and times. This skips the headers and the
+        Window, CCD and MCCD objects built by __call__, picking out each CCD
+        with one numpy operation according to a decode plan worked out once
+        for the run. Reading starts from the next frame (see set) and goes to
+        the end of the file. Each frame is yielded as a tuple of
+
+          nframe -- the frame number
+
+          times  -- tuple of the Time of each CCD. For ULTRACAM with nblue >
+                    1, the Time of the blue CCD is None for the frames with
+                    junk blue data.
+
+          arrays -- tuple per CCD of tuples of the 2D data arrays of its
+                    windows, in the order of the windows of the CCDs returned
+                    by __call__. The arrays of a CCD are views of one array
+                    (of the raw data of the frame if flt=False and the pixels
+                    are in one block).
+
+        flt -- True for float32 data, False for unsigned 2-byte ints, None
+               for the value set when constructing the Rdata. Any calibration
+               set is not applied.
+        """
+        if flt is None: flt = self._flt
+        plan = self._plan()
+        try:
+            while 1:
+                tbytes, buff = self._read()
+                if self.instrument == 'ULTRACAM':
+                    time,info,blueTime,badBlue = utimer(tbytes, self, self._nf, self._tstate)
+                    times = (time, time, None if badBlue else blueTime)
+                else:
+                    time,info = utimer(tbytes, self, self._nf, self._tstate)
+                    times = (time,)
+                nf = self._nf
+                self._nf += 1
+
+                arrays = []
+                for sel, spans in plan:
+                    data = buff[sel].astype(np.float32) if flt else buff[sel]
+                    arrays.append(tuple(data[start:end].reshape(shape) for start, end, shape in spans))
+                yield (nf, times, tuple(arrays))
+
+        except UendError:
+            pass
+        except urllib.error.HTTPError:
+            pass
+
+    def _finish(self, ccds, dtype):
+        """
+        Copies the data of CCDs, whose Windows are views of the raw data, into
+        contiguous storage of type dtype, or calibrates them into it if a
+        calibration was set. The CCDs are processed in parallel if nthreads >
+        1. Returns the list of finished CCDs.
+        """
+        def finish(nc):
+            if self._calib is None:
+                ccds[nc].pack(dtype)
+                return ccds[nc]
+            return self._calib.apply(ccds[nc], nc)
+
+        if self._nthreads > 1 and len(ccds) > 1:
+            return thread_pool(min(self._nthreads, len(ccds))).map(finish, range(len(ccds)))
+        return [finish(nc) for nc in range(len(ccds))]
+
     def ntotal(self):
         """
         Returns total number of frames in data file
@@ -990,9 +1249,7 @@ class Rdata (Rhead):
         if self.server:
             ntot = get_nframe_from_server(self.run)
         else:
-            self._fobj.seek(0,2)
-            ntot = self._fobj.tell() // self.framesize
-            self._fobj.seek(self.framesize*(self._nf-1))
+            ntot = self._fobj.nframe()
 
         return ntot
 
@@ -1020,30 +1277,20 @@ class Rdata (Rhead):
         self.set(nframe)
 
         if self.server:
-            # somewhat inefficiently in the server case, we have to read the whole
-            # frame because there are no options for timing data alone, although
-            # at least no data re-formatting is required.
-            full_url = URL + self.run + '?action=get_frame&frame=' + str(self._nf-1)
-            buff     = urllib.request.urlopen(full_url).read()
-            if len(buff) != self.framesize:
+            # timing bytes alone if the server supports it, else read from the
+            # whole frame
+            tbytes = get_timing_from_server(self.run, self._nf, self.headerwords, self.framesize)
+            if len(tbytes) != 2*self.headerwords:
                 self._nf = 1
-                raise UltracamError('Rdata.time: failed to read frame ' + str(self._nf) +
-                                    ' from FileServer. Buffer length vs expected = '
-                                    + str(len(buff)) + ' vs ' + str(self.framesize) + ' bytes.')
-            tbytes = buff[:2*self.headerwords]
+                raise UendError('Rdata.time: failed to read timing bytes from FileServer')
         else:
             # read timing bytes alone
-            tbytes = self._fobj.read(2*self.headerwords)
+            tbytes = self._fobj.read_timing(self._nf)
             if len(tbytes) != 2*self.headerwords:
-                self._fobj.seek(0)
                 self._nf = 1
                 raise UendError('Rdata.time: failed to read timing bytes')
 
-        tinfo = utimer(tbytes, self, self._nf)
-
-        # step to start of next frame
-        if not self.server:
-            self._fobj.seek(self.framesize-2*self.headerwords,1)
+        tinfo = utimer(tbytes, self, self._nf, self._tstate)
 
         # move frame counter on by one
         self._nf += 1
@@ -1062,7 +1309,7 @@ class Rtime (Rhead):
         Arguments:
 
         run     -- as in 'run036'. Will try to access equivalent .xml and .dat
-                   files
+                   files. Can be the URL of a run on a web server.
 
         nframe  -- frame to position for next read, starting at 1 as the first.
 
@@ -1077,12 +1324,14 @@ class Rtime (Rhead):
         # _fobj   -- file object opened on data file
         # _nf     -- next frame to be read
         # _run    -- name of run
+        # _tstate -- timing state carried from frame to frame (see utimer)
         if server:
             self._fobj   = None
         else:
-            self._fobj   = open(run + '.dat', 'rb')
+            self._fobj   = open_dat(self, raw=False)
         self._nf     = nframe
         self._run    = run
+        self._tstate = Tstate()
         if not server and nframe != 1:
             self._fobj.seek(self.framesize*(nframe-1))
 
@@ -1140,18 +1389,12 @@ class Rtime (Rhead):
         self.set(nframe)
 
         if self.server:
-            # have to read both timing and data in one go from the server
-            # and just ignore the data
-            full_url = URL + self.run + '?action=get_frame&frame=' + str(self._nf-1)
-            buff     = urllib.request.urlopen(full_url).read()
-            if len(buff) != self.framesize:
+            # timing bytes alone, batched, if the server supports it. Otherwise
+            # the whole frame has to be read and the data ignored
+            tbytes = get_timing_from_server(self.run, self._nf, self.headerwords, self.framesize)
+            if len(tbytes) != 2*self.headerwords:
                 self._nf = 1
-                raise UltracamError('Rtime.__call__: failed to read frame ' + str(self._nf) +
-                                    ' from FileServer. Buffer length vs expected = '
-                                    + str(len(buff)) + ' vs ' + str(self.framesize) + ' bytes.')
-
-            # have data. Re-format into the timing bytes and unsigned 2 byte int data buffer
-            tbytes = buff[:2*self.headerwords]
+                raise UendError('Rtime.__call__: failed to read timing bytes from FileServer')
         else:
             # read timing bytes
             tbytes = self._fobj.read(2*self.headerwords)
@@ -1163,7 +1406,7 @@ class Rtime (Rhead):
             # step to start of next frame
             self._fobj.seek(self.framesize-2*self.headerwords,1)
 
-        tinfo = utimer(tbytes, self, self._nf)
+        tinfo = utimer(tbytes, self, self._nf, self._tstate)
 
         # move frame counter on by one
         self._nf += 1
@@ -1177,7 +1420,35 @@ class Rtime (Rhead):
         """
         self._fobj.close()
 
-def utimer(tbytes, rhead, fnum):
+class Tstate(object):
+    """
+    Timing state carried from frame to frame by utimer, which needs the times
+    of preceding frames for many readout modes. Attributes:
+
+      run                 -- run the state applies to, None to start
+      previousFrameNumber -- frame number of the preceding frame read, 0 if none
+      tstamp              -- list of raw GPS times of preceding frames, [0] most recent
+      blueTimes           -- list of modified times of preceding frames, [0] most recent
+    """
+
+    __slots__ = ('run', 'previousFrameNumber', 'tstamp', 'blueTimes')
+
+    def __init__(self):
+        self.run                 = None
+        self.previousFrameNumber = 0
+        self.tstamp              = []
+        self.blueTimes           = []
+
+    def __getstate__(self):
+        return (self.run, self.previousFrameNumber, self.tstamp, self.blueTimes)
+
+    def __setstate__(self, state):
+        self.run, self.previousFrameNumber, self.tstamp, self.blueTimes = state
+
+# state used by utimer when none is passed to it
+UTIMER_STATE = Tstate()
+
+def utimer(tbytes, rhead, fnum, state=None):
     """
     Computes the Time corresponding of the most recently read frame,
     None if no frame has been read. For the Time to be reliable
@@ -1190,6 +1461,10 @@ def utimer(tbytes, rhead, fnum):
 
      fnum    -- frame number we think we are on.
 
+     state   -- Tstate holding the times of preceding frames, which is updated.
+                Each reader of a run should have its own (as Rdata and Rtime
+                do). If None, a single module-level Tstate is used.
+
     Returns (time,info,blueTime,badBlue) for ULTRACAM or (time,info) for ULTRASPEC
 
      time         : the Time as best as can be determined
@@ -1249,23 +1524,16 @@ def utimer(tbytes, rhead, fnum):
     else:
         frameError = False
 
-    # initialize some attributes of utimer which are used as the equivalent
-    # of static variables in C++. They are:
-    #
-    #  previousFrameNumber  -- frame number of immediately preceding frame read, 0 if none
-    #  tstamp               -- list of raw GPS times of preceding frames, [0] most recent
-    #  blueTimes            -- list of modified times of preceding frames, [0] most recent
-
-    if hasattr(utimer,'previousFrameNumber'):
-        if frameNumber != utimer.previousFrameNumber + 1 or utimer.run != rhead._run:
-            utimer.tstamp    = []
-            utimer.blueTimes = []
-    else:
-        utimer.tstamp    = []
-        utimer.blueTimes = []
-    utimer.run = rhead._run
+    # the times of preceding frames, the equivalent of static variables in
+    # C++ (see Tstate), are only valid if this frame follows on
+    if state is None:
+        state = UTIMER_STATE
+    if frameNumber != state.previousFrameNumber + 1 or state.run != rhead._run:
+        state.tstamp    = []
+        state.blueTimes = []
+    state.run = rhead._run
 
-    utimer.previousFrameNumber = frameNumber
+    state.previousFrameNumber = frameNumber
 
     if format == 1:
         nsec, nnsec = struct.unpack('<II', tbytes[9:17])
@@ -1350,7 +1618,7 @@ def utimer(tbytes, rhead, fnum):
             # Correct 10 second error that affected the May 2002 run.
             # Only possible if we have read the previous frames, with
             # time stored in an attribute called tstamp of this function
-            if len(utimer.tstamp) and mjd < utimer.tstamp[0]: mjd += 10./DSEC
+            if len(state.tstamp) and mjd < state.tstamp[0]: mjd += 10./DSEC
 
             # Fix problem with very first night
             if mjd < MAY2002+5.5:
@@ -1413,7 +1681,7 @@ def utimer(tbytes, rhead, fnum):
     defTstamp = mjd < TSTAMP_CHANGE1 or (mjd > TSTAMP_CHANGE2 and mjd < TSTAMP_CHANGE3)
 
     # Push time to front of tstamp list
-    utimer.tstamp.insert(0,mjd)
+    state.tstamp.insert(0,mjd)
 
     if rhead.instrument == 'ULTRACAM':
         VCLOCK_STORAGE = vclock_frame
@@ -1437,11 +1705,11 @@ def utimer(tbytes, rhead, fnum):
             (rhead.mode == 'FFCLR' or rhead.mode == 'FFOVER' or rhead.mode == '1-PCLR'):
 
         # never need more than two times
-        if len(utimer.tstamp) > 2: utimer.tstamp.pop()
+        if len(state.tstamp) > 2: state.tstamp.pop()
         ntmin = 2
 
         if defTstamp:
-            mjdCentre  = utimer.tstamp[0]
+            mjdCentre  = state.tstamp[0]
             mjdCentre += rhead.exposeTime/DSEC/2.
             exposure   = rhead.exposeTime
 
@@ -1472,11 +1740,11 @@ def utimer(tbytes, rhead, fnum):
             # Frame transfer time
             frameTransfer = 1033.*vclock_frame
 
-            if len(utimer.tstamp) == 1:
+            if len(state.tstamp) == 1:
 
                 # Case where we have not got a previous timestamp. Hop back over the
                 # readout and frame transfer and half the exposure delay
-                mjdCentre  = utimer.tstamp[0]
+                mjdCentre  = state.tstamp[0]
                 mjdCentre -= (frameTransfer+readoutTime+rhead.exposeTime/2.)/DSEC
                 if goodTime:
                     goodTime = False
@@ -1487,7 +1755,7 @@ def utimer(tbytes, rhead, fnum):
                 # Case where we have got previous timestamp is somewhat easier and perhaps
                 # more reliable since we merely need to step forward over the clear time and
                 # half the exposure time.
-                mjdCentre  = utimer.tstamp[1]
+                mjdCentre  = state.tstamp[1]
                 mjdCentre += (clearTime + rhead.exposeTime/2.)/DSEC
 
             exposure = rhead.exposeTime
@@ -1497,7 +1765,7 @@ def utimer(tbytes, rhead, fnum):
              or rhead.mode == '2-PAIR' or rhead.mode == '3-PAIR'):
 
         # never need more than three times
-        if len(utimer.tstamp) > 3: utimer.tstamp.pop()
+        if len(state.tstamp) > 3: state.tstamp.pop()
         ntmin = 3
 
         # Time taken to move 1033 rows.
@@ -1562,20 +1830,20 @@ def utimer(tbytes, rhead, fnum):
 
         if defTstamp:
             if frameNumber == 1:
-                mjdCentre  = utimer.tstamp[0]
+                mjdCentre  = state.tstamp[0]
                 exposure   = rhead.exposeTime
                 mjdCentre -= (frameTransfer+exposure/2.)/DSEC
 
             else:
-                if len(utimer.tstamp) > 1:
-                    texp = DSEC*(utimer.tstamp[0] - utimer.tstamp[1]) - frameTransfer
-                    mjdCentre  = utimer.tstamp[1]
+                if len(state.tstamp) > 1:
+                    texp = DSEC*(state.tstamp[0] - state.tstamp[1]) - frameTransfer
+                    mjdCentre  = state.tstamp[1]
                     mjdCentre += texp/2./DSEC
                     exposure   = texp
 
                 else:
                     texp       = readoutTime + rhead.exposeTime
-                    mjdCentre  = utimer.tstamp[0]
+                    mjdCentre  = state.tstamp[0]
                     mjdCentre -= (frameTransfer+texp/2.)/DSEC
                     exposure   = texp
 
@@ -1585,7 +1853,7 @@ def utimer(tbytes, rhead, fnum):
 
         else:
             if frameNumber == 1:
-                mjdCentre  = utimer.tstamp[0]
+                mjdCentre  = state.tstamp[0]
                 exposure   = rhead.exposeTime
                 mjdCentre -= (frameTransfer+readoutTime+exposure/2.)/DSEC
 
@@ -1595,15 +1863,15 @@ def utimer(tbytes, rhead, fnum):
 
             else:
 
-                if len(utimer.tstamp) > 2:
-                    texp       = DSEC*(utimer.tstamp[1] - utimer.tstamp[2]) - frameTransfer
-                    mjdCentre  = utimer.tstamp[1]
+                if len(state.tstamp) > 2:
+                    texp       = DSEC*(state.tstamp[1] - state.tstamp[2]) - frameTransfer
+                    mjdCentre  = state.tstamp[1]
                     mjdCentre += (rhead.exposeTime - texp/2.)/DSEC
                     exposure   = texp
 
-                elif len(utimer.tstamp) == 2:
-                    texp = DSEC*(utimer.tstamp[0] - utimer.tstamp[1]) - frameTransfer
-                    mjdCentre  = utimer.tstamp[1]
+                elif len(state.tstamp) == 2:
+                    texp = DSEC*(state.tstamp[0] - state.tstamp[1]) - frameTransfer
+                    mjdCentre  = state.tstamp[1]
                     mjdCentre += (rhead.exposeTime - texp/2.)/DSEC
                     exposure   = texp
 
@@ -1613,7 +1881,7 @@ def utimer(tbytes, rhead, fnum):
 
                 else:
                     texp       = readoutTime + rhead.exposeTime
-                    mjdCentre  = utimer.tstamp[0]
+                    mjdCentre  = state.tstamp[0]
                     mjdCentre += (rhead.exposeTime-texp-frameTransfer-texp/2.)/DSEC
                     exposure   = texp
 
@@ -1659,15 +1927,15 @@ def utimer(tbytes, rhead, fnum):
         readoutTime = ((nyu/ybin)*line_read + pipe_shift*VCLOCK_STORAGE)/1.e6
 
         # Never need more than nwins+2 times
-        if len(utimer.tstamp) > nwins+2: utimer.tstamp.pop()
+        if len(state.tstamp) > nwins+2: state.tstamp.pop()
         ntmin = nwins+2
 
         if defTstamp:
 
             # Pre board change or post-bug fix
-            if len(utimer.tstamp) > nwins:
-                texp = DSEC*(utimer.tstamp[nwins-1] - utimer.tstamp[nwins]) - frameTransfer
-                mjdCentre  = utimer.tstamp[nwins]
+            if len(state.tstamp) > nwins:
+                texp = DSEC*(state.tstamp[nwins-1] - state.tstamp[nwins]) - frameTransfer
+                mjdCentre  = state.tstamp[nwins]
                 mjdCentre += texp/2./DSEC
                 exposure   = texp
 
@@ -1682,17 +1950,17 @@ def utimer(tbytes, rhead, fnum):
 
         else:
 
-            if len(utimer.tstamp) > nwins+1:
+            if len(state.tstamp) > nwins+1:
 
-                texp = DSEC*(utimer.tstamp[nwins] - utimer.tstamp[nwins+1]) - frameTransfer
-                mjdCentre  = utimer.tstamp[nwins]
+                texp = DSEC*(state.tstamp[nwins] - state.tstamp[nwins+1]) - frameTransfer
+                mjdCentre  = state.tstamp[nwins]
                 mjdCentre += (rhead.exposeTime-texp/2.)/DSEC
                 exposure   = texp
 
-            elif len(utimer.tstamp) == nwins+1:
+            elif len(state.tstamp) == nwins+1:
 
-                texp       = DSEC*(utimer.tstamp[nwins-1] - utimer.tstamp[nwins]) - frameTransfer
-                mjdCentre  = utimer.tstamp[nwins]
+                texp       = DSEC*(state.tstamp[nwins-1] - state.tstamp[nwins]) - frameTransfer
+                mjdCentre  = state.tstamp[nwins]
                 mjdCentre += (rhead.exposeTime-texp/2.)/DSEC
                 exposure   = texp
 
@@ -1713,23 +1981,23 @@ def utimer(tbytes, rhead, fnum):
     elif rhead.instrument == 'ULTRASPEC' and rhead.mode.startswith('USPEC'):
 
         # Avoid excessive accumulation of timestamps.
-        if len(utimer.tstamp) > 3: utimer.tstamp.pop()
+        if len(state.tstamp) > 3: state.tstamp.pop()
         ntmin = 3
 
-        if utimer.tstamp[0] < USPEC_CHANGE:
+        if state.tstamp[0] < USPEC_CHANGE:
             goodTime = False
             reason = 'timestamp too early'
             readoutTime = 0.
             texp = readoutTime + rhead.exposeTime
-            mjdCentre = utimer.tstamp[0]
+            mjdCentre = state.tstamp[0]
             if rhead.en_clr or frameNumber == 1:
 
                 mjdCentre -= rhead.exposeTime/2./DSEC
                 exposure   = rhead.exposeTime
 
-            elif len(utimer.tstamp) > 1:
+            elif len(state.tstamp) > 1:
 
-                texp = DSEC*(utimer.tstamp[0] - utimer.tstamp[1]) - USPEC_FT_TIME
+                texp = DSEC*(state.tstamp[0] - state.tstamp[1]) - USPEC_FT_TIME
                 mjdCentre -= text/2./DSEC
                 exposure   = texp
 
@@ -1748,32 +2016,32 @@ def utimer(tbytes, rhead, fnum):
             if rhead.en_clr or frameNumber == 1:
                 # Special case for the first frame or if clears are enabled.
                 exposure = rhead.exposeTime
-                if len(utimer.tstamp) == 1:
-                    mjdCentre = utimer.tstamp[0]
+                if len(state.tstamp) == 1:
+                    mjdCentre = state.tstamp[0]
                     mjdCentre -= (-USPEC_FT_TIME-rhead.exposeTime/2.)/DSEC
                     if goodTime:
                         reason = 'cannot establish an accurate time without at least 1 prior timestamp'
                         goodTime = False
                 else:
-                    mjdCentre  = utimer.tstamp[1]
+                    mjdCentre  = state.tstamp[1]
                     mjdCentre += (USPEC_CLR_TIME+rhead.exposeTime/2.)/DSEC
 
-            elif len(utimer.tstamp) > 2:
+            elif len(state.tstamp) > 2:
 
                 # Can backtrack two frames to get a good exposure time.
-                texp = DSEC*(utimer.tstamp[1] - utimer.tstamp[2]) - USPEC_FT_TIME
-                mjdCentre  = utimer.tstamp[1]
+                texp = DSEC*(state.tstamp[1] - state.tstamp[2]) - USPEC_FT_TIME
+                mjdCentre  = state.tstamp[1]
                 mjdCentre += (rhead.exposeTime-texp/2.)/DSEC
                 exposure   = texp
 
-            elif len(utimer.tstamp) == 2:
+            elif len(state.tstamp) == 2:
 
                 # Can only back up one, so estimate of exposure time is
                 # actually based on the exposure following the one of
                 # interest. Probably not too bad, but technically unreliable
                 # as a time.
-                texp = DSEC*(utimer.tstamp[0] - utimer.tstamp[1]) - USPEC_FT_TIME
-                mjdCentre  = utimer.tstamp[1]
+                texp = DSEC*(state.tstamp[0] - state.tstamp[1]) - USPEC_FT_TIME
+                mjdCentre  = state.tstamp[1]
                 mjdCentre += (rhead.exposeTime-texp/2.)/DSEC
                 exposure   = texp
 
@@ -1784,7 +2052,7 @@ def utimer(tbytes, rhead, fnum):
             else:
 
                 # Only one time
-                mjdCentre  = utimer.tstamp[0]
+                mjdCentre  = state.tstamp[0]
                 mjdCentre -= (rhead.exposeTime/2.+rhead.exposeTime)/DSEC
                 exposure   = rhead.exposeTime
 
@@ -1801,22 +2069,22 @@ def utimer(tbytes, rhead, fnum):
         frameTransfer = USPEC_FT_ROW*(ystart+nyu-1.)+USPEC_FT_OFF
 
         # Never need more than nwins+2 times
-        if len(utimer.tstamp) > nwins+2: utimer.tstamp.pop()
+        if len(state.tstamp) > nwins+2: state.tstamp.pop()
         ntmin = nwins+2
 
         # Non-standard mode
 
-        if len(utimer.tstamp) > nwins+1:
+        if len(state.tstamp) > nwins+1:
 
-            texp       = DSEC*(utimer.tstamp[nwins] - utimer.tstamp[nwins+1]) - frameTransfer
-            mjdCentre  = utimer.tstamp[nwins]
+            texp       = DSEC*(state.tstamp[nwins] - state.tstamp[nwins+1]) - frameTransfer
+            mjdCentre  = state.tstamp[nwins]
             mjdCentre += (rhead.exposeTime-texp/2.)/DSEC
             exposure   = texp
 
-        elif len(utimer.tstamp) == nwins+1:
+        elif len(state.tstamp) == nwins+1:
 
-            texp          = DSEC*(utimer.tstamp[nwins-1] - utimer.tstamp[nwins]) - frameTransfer
-            mjdCentre     = utimer.tstamp[nwins]
+            texp          = DSEC*(state.tstamp[nwins-1] - state.tstamp[nwins]) - frameTransfer
+            mjdCentre     = state.tstamp[nwins]
             mjdCentre     = (rhead.exposeTime-texp/2.)/DSEC
             exposure      = texp
             if goodTime:
@@ -1841,7 +2109,7 @@ def utimer(tbytes, rhead, fnum):
 
             # The mid-exposure time for the OK blue frames in this case is computed by averaging the
             # mid-exposure times of all the contributing frames, if they are available.
-            utimer.blueTimes.insert(0,time)
+            state.blueTimes.insert(0,time)
 
             if badBlue:
 
@@ -1857,9 +2125,9 @@ def utimer(tbytes, rhead, fnum):
                 # contributing exposure.  Corrections are made if there are too
                 # few contributing exposures (even though the final value will
                 # still be flagged as unreliable
-                ncont  = min(rhead.nblue, len(utimer.blueTimes))
-                start  = utimer.blueTimes[ncont-1].mjd - utimer.blueTimes[ncont-1].expose/2./DSEC
-                end    = utimer.blueTimes[0].mjd       + utimer.blueTimes[0].expose/2./DSEC
+                ncont  = min(rhead.nblue, len(state.blueTimes))
+                start  = state.blueTimes[ncont-1].mjd - state.blueTimes[ncont-1].expose/2./DSEC
+                end    = state.blueTimes[0].mjd       + state.blueTimes[0].expose/2./DSEC
                 expose = DSEC*(end - start)
 
                 # correct the times
@@ -1870,13 +2138,13 @@ def utimer(tbytes, rhead, fnum):
                     start   = end - expose/DSEC
                     reason  = 'not all contributing frames found'
                 else:
-                    ok = utimer.blueTimes[0].good and utimer.blueTimes[ncont-1].good
+                    ok = state.blueTimes[0].good and state.blueTimes[ncont-1].good
                     if not ok: reason  = 'time of start or end frame was unreliable'
 
                 blueTime = Time((start+end)/2., expose, ok, reason)
 
             # Avoid wasting memory storing past times
-            if len(utimer.blueTimes) > rhead.nblue: utimer.blueTimes.pop()
+            if len(state.blueTimes) > rhead.nblue: state.blueTimes.pop()
 
         else:
             blueTime = time
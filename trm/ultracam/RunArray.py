@@ -0,0 +1,270 @@
+"""
+Array-like access to whole runs, e.g. for the time series of pixels.
+
+Frames of a run are all the same size, with the pixels of each window at
+the same place in every frame, so a pixel of frame n lies at a fixed offset
+from the start of the frame. A RunArray makes use of this to slice out any
+range of frames and region of a window like a numpy array, reading only the
+part of each frame holding the rows wanted rather than decoding whole
+frames::
+
+  cube = RunArray('run045')
+  data = cube[1,0][1000:2000, 10:20, 30:40]
+
+returns the 10x10 pixel region of the first window of the second CCD from
+the 1001st to the 2000th frames as a 1000x10x10 array. Operations over a
+whole run can be made a chunk of frames at a time with map.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import functools
+
+try:
+    import numpy as np
+except ImportError:
+    print('Failed to import numpy; some routines will fail')
+
+from trm.ultracam.Raw import Rdata
+from trm.ultracam.Utils import thread_pool
+from trm.ultracam.UErrors import UltracamError
+
+# size of the blocks of whole frames read in one go, bytes
+RUNARRAY_BLOCK = 4*1024*1024
+
+# consecutive frames are read in blocks of whole frames rather than frame by
+# frame if more than 1/RUNARRAY_SPARSE of each frame is needed
+RUNARRAY_SPARSE = 4
+
+class RunArray(object):
+    """
+    Read-only view of a run (on local disk) as a set of arrays, one per
+    window, indexed as run[nccd, nwin] (both from 0), each of which behaves
+    like a numpy array of shape (nframe, ny, nx) (see WinArray). Nothing is
+    read until a WinArray is sliced. Frames are numbered from 0 in the
+    arrays, i.e. index n is frame n+1 of the run. The windows are those of
+    the frames returned by Rdata, so for instance the outer columns affected
+    by readout problems in old ULTRACAM data are dropped in the same way.
+
+    The number of frames is fixed when the RunArray is created; reads of
+    frames beyond it raise an IndexError.
+
+    Attributes:
+
+      rdat   -- the Rdata of the run
+      nframe -- number of frames
+      nccd   -- number of CCDs
+      dtype  -- type of the arrays returned
+    """
+
+    def __init__(self, run, flt=True):
+        """
+        run -- run name, e.g. 'run045'
+
+        flt -- True for float32 data, False for the raw unsigned 2-byte ints
+        """
+        self.rdat = Rdata(run, flt=flt)
+        if self.rdat.server:
+            raise UltracamError('RunArray: only runs on local disk are supported')
+        self.nframe = self.rdat.ntotal()
+        self.dtype  = np.float32 if flt else np.uint16
+
+        # geometry of each window and the indices within the data of a frame
+        # of each of its pixels, found as for Rdata.iter_arrays
+        index = np.arange(self.rdat.framesize//2-self.rdat.headerwords, dtype=np.intp)
+        self._wins = self.rdat._windows(index)
+        self.nccd  = len(self._wins)
+
+    def __len__(self):
+        return self.nframe
+
+    def __getitem__(self, key):
+        """
+        Returns the WinArray of window nwin of CCD nccd given key = (nccd, nwin)
+        """
+        try:
+            nc, nw = key
+        except (TypeError, ValueError):
+            raise UltracamError('RunArray: index with [nccd, nwin]')
+        return WinArray(self, nc, nw)
+
+    def nwin(self, nc):
+        """
+        Returns the number of windows of CCD nc
+        """
+        return len(self._wins[nc])
+
+    def _frames(self, key):
+        # frame numbers (from 1) given an index of the frames
+        nfs = np.arange(1, self.nframe+1)[key]
+        return (nfs, np.ndim(nfs) == 0)
+
+    def _words(self, nfs, lo, hi):
+        """
+        Returns words lo to hi of the data of frames nfs (frame numbers from
+        1), as an array of shape (len(nfs), hi-lo) of little-endian unsigned
+        2-byte ints. Runs of consecutive frames of which much is wanted are
+        read in blocks of whole frames, others a part frame at a time.
+        """
+        fsize, hw = self.rdat.framesize, self.rdat.headerwords
+        fobj  = self.rdat._fobj
+        out   = np.empty((len(nfs), hi-lo), '<u2')
+        if len(nfs) > 1 and (np.diff(nfs) == 1).all() and RUNARRAY_SPARSE*2*(hi-lo) >= fsize:
+            nblock = max(1, RUNARRAY_BLOCK // fsize)
+            buff   = np.empty(min(nblock, len(nfs))*fsize, np.uint8)
+            for n in range(0, len(nfs), nblock):
+                nb = min(nblock, len(nfs)-n)
+                if fobj.readinto(buff[:nb*fsize], fsize*(nfs[n]-1)) != nb*fsize:
+                    raise UltracamError('RunArray: failed to read frames ' + str(nfs[n]) +
+                                        ' to ' + str(nfs[n]+nb-1))
+                out[n:n+nb] = buff[:nb*fsize].view('<u2').reshape((nb,fsize//2))[:,hw+lo:hw+hi]
+        else:
+            for n, nf in enumerate(nfs):
+                if fobj.readinto(out[n], fsize*(nf-1)+2*(hw+lo)) != 2*(hi-lo):
+                    raise UltracamError('RunArray: failed to read frame ' + str(nf))
+        return out
+
+    def _gather(self, nfs, index):
+        """
+        Returns the data of frames nfs at the pixels of the index array
+        'index' (as from _windows), with shape (len(nfs),) + index.shape
+        """
+        if index.size == 0:
+            return np.empty((len(nfs),) + index.shape, self.dtype)
+        lo, hi = index.min(), index.max()+1
+        words  = self._words(nfs, lo, hi)
+        return words[:,index-lo].astype(self.dtype)
+
+    def map(self, func, frames=slice(None), reduce=None, maxmem=64, nthreads=1):
+        """
+        Applies a function to the run a chunk of frames at a time. func is
+        called with a tuple per CCD of tuples of the 3D arrays (nframe, ny,
+        nx) of each window over the frames of the chunk, in frame order.
+        Returns the list of the values returned by func, or, if reduce is
+        set, the result of combining them with functools.reduce(reduce,
+        values). For example the sum of all pixels of CCD 2::
+
+          total = rarr.map(lambda arrs: sum(arr.sum() for arr in arrs[1]),
+                           reduce=operator.add)
+
+        frames   -- index of the frames to include (from 0), e.g.
+                    slice(1000,2000)
+
+        maxmem   -- approximate size of the chunks of frames, MB
+
+        nthreads -- number of threads in which to read and process chunks in
+                    parallel
+        """
+        index = [np.concatenate([win.data.ravel() for win in wins]) if len(wins) else
+                 np.empty(0, np.intp) for wins in self._wins]
+
+        def chunk(nfs):
+            arrays = []
+            for nc, wins in enumerate(self._wins):
+                data = self._gather(nfs, index[nc])
+                off, arrs = 0, []
+                for win in wins:
+                    arrs.append(data[:,off:off+win.size].reshape((len(nfs),win.ny,win.nx)))
+                    off += win.size
+                arrays.append(tuple(arrs))
+            return func(tuple(arrays))
+
+        npix = sum(len(ind) for ind in index)
+        return _map(self, chunk, frames, npix, reduce, maxmem, nthreads)
+
+    def close(self):
+        """
+        Closes the data file
+        """
+        if self.rdat._fobj is not None:
+            self.rdat._fobj.close()
+
+class WinArray(object):
+    """
+    One window of a RunArray over all frames of the run, which is indexed
+    like a read-only numpy array of shape (nframe, ny, nx). Indexing reads
+    the data and returns an ordinary numpy array, e.g. warr[:,10,20] is the
+    time series of one pixel, warr[-1] the last frame of the window. The
+    frame index may be an integer, slice or a sequence of integers; the
+    pixel indices can be anything that indexes a 2D numpy array.
+
+    Attributes:
+
+      nccd, nwin             -- the CCD and window (from 0)
+      shape                  -- (nframe, ny, nx)
+      dtype                  -- type of the arrays returned
+      llx, lly, xbin, ybin   -- window position and binning factors
+    """
+
+    def __init__(self, rarr, nc, nw):
+        win = rarr._wins[nc][nw]
+        self.nccd  = nc
+        self.nwin  = nw
+        self.shape = (rarr.nframe, win.ny, win.nx)
+        self.dtype = rarr.dtype
+        self.llx, self.lly, self.xbin, self.ybin = win.llx, win.lly, win.xbin, win.ybin
+        self._rarr  = rarr
+        self._index = win.data
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return 3
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 3:
+            raise UltracamError('WinArray: too many indices')
+        nfs, single = self._rarr._frames(key[0])
+        index = self._index[key[1:]]
+        if single:
+            return self._rarr._gather(np.atleast_1d(nfs), index)[0]
+        return self._rarr._gather(nfs, index)
+
+    def map(self, func, key=(), reduce=None, maxmem=64, nthreads=1):
+        """
+        Applies a function to the window a chunk of frames at a time, e.g.
+        for light curves of long runs. func is called with the 3D array of
+        each chunk, as returned by indexing with key (frames first), in frame
+        order. Returns the list of the values returned by func, or, if reduce
+        is set, the result of combining them with functools.reduce(reduce,
+        values). For example the light curve of a 10x10 pixel box::
+
+          lc = np.concatenate(warr.map(lambda d: d.sum(axis=(1,2)),
+                                       np.s_[:,10:20,30:40]))
+
+        key      -- index of the frames and region wanted
+
+        maxmem   -- approximate size of the chunks of frames, MB
+
+        nthreads -- number of threads in which to read and process chunks in
+                    parallel
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        frames = key[0] if len(key) else slice(None)
+        index  = self._index[key[1:]]
+
+        def chunk(nfs):
+            return func(self._rarr._gather(nfs, index))
+
+        return _map(self._rarr, chunk, frames, index.size, reduce, maxmem, nthreads)
+
+def _map(rarr, chunk, frames, npix, reduce, maxmem, nthreads):
+    # applies chunk to the frames of a RunArray split into chunks of about
+    # maxmem MB given npix pixels per frame
+    nfs, single = rarr._frames(frames)
+    nfs    = np.atleast_1d(nfs)
+    nchunk = max(1, int(1024*1024*maxmem) // max(1, 4*npix))
+    chunks = [nfs[n:n+nchunk] for n in range(0, len(nfs), nchunk)]
+    if nthreads > 1 and len(chunks) > 1:
+        values = thread_pool(nthreads).map(chunk, chunks)
+    else:
+        values = [chunk(nfs) for nfs in chunks]
+    if reduce is not None:
+        return functools.reduce(reduce, values)
+    return values
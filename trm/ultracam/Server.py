@@ -5,6 +5,12 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import os
+import re
+import time
+import struct
+import hashlib
+import threading
+import collections
 from six.moves import urllib
 
 from trm.ultracam.UErrors import UltracamError
@@ -25,6 +31,173 @@ urllib.request.install_opener(opener)
 # an UltracamError
 URL = os.environ['ULTRACAM_DEFAULT_URL'] if 'ULTRACAM_DEFAULT_URL' in os.environ else None
 
+class FrameCache(object):
+    """
+    Byte-bounded, least-recently-used cache of raw frame buffers. It is
+    intended to sit between the FileServer and all readers in a process so
+    that a frame fetched by one reader (e.g. an Rtime) is served locally to
+    any other (e.g. an Rdata) that asks for it. Keys are arbitrary hashables,
+    typically (url, run, frame). Buffers evicted from memory can optionally be
+    spilled to disk from where they are recovered if asked for again.
+
+    The cache is safe to share between threads.
+    """
+
+    def __init__(self, maxbytes=64*1024*1024, spill=None, maxspill=1024*1024*1024):
+        """
+        maxbytes -- maximum number of bytes to hold in memory.
+
+        spill    -- directory to spill evicted buffers to. None to just
+                    discard them. The directory will be created if need be.
+
+        maxspill -- maximum number of bytes to hold in the spill directory.
+        """
+        self.maxbytes = maxbytes
+        self.maxspill = maxspill
+        self.spill    = spill
+        self.nbytes   = 0
+        self.nspill   = 0
+        self.hits     = 0
+        self.misses   = 0
+        self._mem     = collections.OrderedDict()
+        self._disk    = collections.OrderedDict()
+        self._lock    = threading.Lock()
+        if spill is not None and not os.path.isdir(spill):
+            os.makedirs(spill)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._mem) + len(self._disk)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._mem or key in self._disk
+
+    def get(self, key):
+        """
+        Returns the buffer stored under key, or None if there is none.
+        """
+        with self._lock:
+            if key in self._mem:
+                # re-insert to mark as most recently used
+                buff = self._mem.pop(key)
+                self._mem[key] = buff
+                self.hits += 1
+                return buff
+
+            if key in self._disk:
+                fname, nbyte = self._disk.pop(key)
+                self.nspill -= nbyte
+                try:
+                    with open(fname, 'rb') as fobj:
+                        buff = fobj.read()
+                    os.remove(fname)
+                except (IOError, OSError):
+                    buff = None
+                if buff is not None and len(buff) == nbyte:
+                    self.hits += 1
+                    self._store(key, buff)
+                    return buff
+
+            self.misses += 1
+            return None
+
+    def put(self, key, buff):
+        """
+        Stores buff under key, evicting least recently used buffers
+        if needed. Buffers larger than the cache are not stored, but
+        still replace anything stored under key before.
+        """
+        with self._lock:
+            if key in self._mem:
+                self.nbytes -= len(self._mem.pop(key))
+            if key in self._disk:
+                fname, nbyte = self._disk.pop(key)
+                self.nspill -= nbyte
+                try:
+                    os.remove(fname)
+                except OSError:
+                    pass
+            if len(buff) <= self.maxbytes:
+                self._store(key, buff)
+
+    def clear(self):
+        """
+        Empties the cache, including any spilled buffers.
+        """
+        with self._lock:
+            self._mem.clear()
+            self.nbytes = 0
+            for fname, nbyte in self._disk.values():
+                try:
+                    os.remove(fname)
+                except OSError:
+                    pass
+            self._disk.clear()
+            self.nspill = 0
+
+    def _store(self, key, buff):
+        # must be called with the lock held
+        self._mem[key] = buff
+        self.nbytes   += len(buff)
+        while self.nbytes > self.maxbytes:
+            okey, obuff = self._mem.popitem(last=False)
+            self.nbytes -= len(obuff)
+            self._spill(okey, obuff)
+
+    def _spill(self, key, buff):
+        # must be called with the lock held
+        if self.spill is None or len(buff) > self.maxspill:
+            return
+        fname = os.path.join(self.spill, hashlib.md5(repr(key).encode('utf-8')).hexdigest())
+        try:
+            with open(fname, 'wb') as fobj:
+                fobj.write(buff)
+        except (IOError, OSError):
+            return
+        self._disk[key] = (fname, len(buff))
+        self.nspill    += len(buff)
+        while self.nspill > self.maxspill:
+            okey, (oname, onbyte) = self._disk.popitem(last=False)
+            self.nspill -= onbyte
+            try:
+                os.remove(oname)
+            except OSError:
+                pass
+
+# The process-wide cache used by all server-mode readers. Its size in MB can
+# be set with ULTRACAM_CACHE_SIZE, and a spill directory with ULTRACAM_CACHE_DIR
+FRAME_CACHE = FrameCache(
+    int(float(os.environ.get('ULTRACAM_CACHE_SIZE', 64))*1024*1024),
+    os.environ.get('ULTRACAM_CACHE_DIR'))
+
+def get_frame_from_server(run, nframe, framesize=None):
+    """
+    Returns the raw bytes (timing and data) of frame nframe of a run via the
+    FileServer, going through FRAME_CACHE so that repeated requests from any
+    reader in the process are served locally.
+
+    run       -- run name, e.g. 'run045'
+
+    nframe    -- frame number, starting at 1.
+
+    framesize -- expected number of bytes. Only buffers of this length are
+                 cached (incomplete or error responses are returned but not
+                 stored). None to cache whatever comes back.
+    """
+    if URL is None:
+        raise UltracamError('get_frame_from_server: no url for server found.' +
+                            ' Have you set the ULTRACAM_DEFAULT_URL environment variable?')
+
+    key  = (URL, run, nframe)
+    buff = FRAME_CACHE.get(key)
+    if buff is None:
+        full_url = URL + run + '?action=get_frame&frame=' + str(nframe-1)
+        buff = urllib.request.urlopen(full_url).read()
+        if framesize is None or len(buff) == framesize:
+            FRAME_CACHE.put(key, buff)
+    return buff
+
 def get_nframe_from_server(run):
     """
     Returns the number of frames in the run via the FileServer
@@ -35,7 +208,7 @@ def get_nframe_from_server(run):
                             ' Have you set the ULTRACAM_DEFAULT_URL environment variable?')
     # get from FileServer
     full_url = URL + run + '?action=get_num_frames'
-    resp = urllib.request.urlopen(full_url).read()
+    resp = urllib.request.urlopen(full_url).read().decode('utf-8')
 
     # parse the response
     loc = resp.find('nframes="')
@@ -45,6 +218,100 @@ def get_nframe_from_server(run):
     else:
         raise UltracamError('get_nframe_from_server: failed to parse server response to ' + full_url)
 
+# Cache of timing bytes from get_timing requests, and a record of whether
+# the server at a given URL supports the action (None = not yet known).
+TIMING_CACHE  = FrameCache(4*1024*1024)
+TIMING_ACTION = {}
+
+def get_timing_from_server(run, nframe, headerwords, framesize=None, nbatch=100):
+    """
+    Returns the timing bytes (2*headerwords of them) of frame nframe of a run
+    via the FileServer. If the server supports the header-only 'get_timing'
+    action, the timing bytes of nbatch frames from nframe onwards are fetched
+    in one request and cached, so sequential reads of times need only one
+    request per nbatch frames. Otherwise this falls back to fetching the whole
+    frame through get_frame_from_server. Frames already in FRAME_CACHE are
+    never re-fetched. An empty string is returned if the frame does not exist.
+
+    run         -- run name, e.g. 'run045'
+
+    nframe      -- frame number, starting at 1.
+
+    headerwords -- number of 2-byte words of timing info per frame
+
+    framesize   -- number of bytes per frame (only needed for the fallback)
+
+    nbatch      -- number of frames' worth of times to get per request
+    """
+    if URL is None:
+        raise UltracamError('get_timing_from_server: no url for server found.' +
+                            ' Have you set the ULTRACAM_DEFAULT_URL environment variable?')
+
+    nbytes = 2*headerwords
+    buff   = FRAME_CACHE.get((URL, run, nframe))
+    if buff is not None:
+        return buff[:nbytes]
+
+    key   = (URL, run, nframe)
+    tbytes = TIMING_CACHE.get(key)
+    if tbytes is not None:
+        return tbytes
+
+    undecided = False
+    if TIMING_ACTION.get(URL, True):
+        full_url = URL + run + '?action=get_timing&frame=' + str(nframe-1) + \
+                   '&nframe=' + str(nbatch)
+        try:
+            resp = urllib.request.urlopen(full_url).read()
+        except urllib.error.HTTPError:
+            # not supported, unless the server has shown that it is
+            if TIMING_ACTION.get(URL):
+                raise
+            TIMING_ACTION[URL] = False
+        else:
+            if TIMING_ACTION.get(URL):
+                # a bad reply from a server known to support the action is
+                # an error for this request alone
+                if len(resp) % nbytes:
+                    raise UltracamError('get_timing_from_server: reply of ' + str(len(resp)) +
+                                        ' bytes for frame ' + str(nframe) + ' of ' + run +
+                                        ' is not a whole number of frames of timing bytes')
+            elif len(resp) and len(resp) % nbytes == 0 and \
+                    struct.unpack('<I', resp[4:8])[0] == nframe:
+                # until the server has shown it supports the action, check
+                # that the reply looks like timing bytes by testing the frame
+                # number.
+                TIMING_ACTION[URL] = True
+            else:
+                # an empty reply could mean either that the frame does not
+                # exist yet or that the action is not understood; the frame
+                # itself settles which.
+                undecided = len(resp) == 0
+                if not undecided:
+                    TIMING_ACTION[URL] = False
+
+            if TIMING_ACTION.get(URL):
+                for n in range(len(resp) // nbytes):
+                    TIMING_CACHE.put((URL, run, nframe+n), resp[n*nbytes:(n+1)*nbytes])
+                return resp[:nbytes]
+
+    try:
+        buff = get_frame_from_server(run, nframe, framesize)
+    except urllib.error.HTTPError:
+        return b''
+    if undecided and len(buff):
+        TIMING_ACTION[URL] = False
+    return buff[:nbytes]
+
+def get_xml_from_server(run):
+    """
+    Returns the contents of the xml file of a run via the FileServer
+    """
+    if URL is None:
+        raise UltracamError('get_xml_from_server: no url for server found.' +
+                            ' Have you set the ULTRACAM_DEFAULT_URL environment variable?')
+    return urllib.request.urlopen(URL + run + '?action=get_xml').read()
+
 def get_runs_from_server(dir=None):
     """
     Returns with a list of runs from the server
@@ -59,15 +326,133 @@ def get_runs_from_server(dir=None):
         full_url = URL + '?action=dir'
     else:
         full_url = URL + dir + '?action=dir'
-    resp = urllib.request.urlopen(full_url).read()
+    resp = urllib.request.urlopen(full_url).read().decode('utf-8')
 
     # parse response from server
+    return [rinfo.run for rinfo in parse_runs(resp)]
+
+# Record of a run in a server directory listing. nframe is None
+# if the listing does not say.
+Runinfo = collections.namedtuple('Runinfo', ['run', 'nframe'])
+
+NFRAMES_RE = re.compile(r'nframes="(\d+)"')
+
+def parse_runs(resp):
+    """
+    Parses a directory listing from the FileServer, returning a list of Runinfo
+    records sorted by run name.
+    """
     ldir = resp.split('<li>')
-    runs = [entry[entry.find('>run')+1:entry.find('>run')+7] for entry in ldir
-            if entry.find('getdata">run') > -1]
+    runs = []
+    for entry in ldir:
+        if entry.find('getdata">run') > -1:
+            run = entry[entry.find('>run')+1:entry.find('>run')+7]
+            mat = NFRAMES_RE.search(entry)
+            runs.append(Runinfo(run, int(mat.group(1)) if mat else None))
     runs.sort()
     return runs
 
+class RunList(object):
+    """
+    Cached list of the runs on the FileServer, for scripts that need to check
+    for new runs every few seconds. The listing is only downloaded and parsed
+    when it may have changed. Once it is more than 'maxage' seconds old, a
+    conditional request is made if the server supplied an ETag or
+    Last-Modified header last time, so that an unchanged listing costs just
+    a '304 Not Modified' reply. Otherwise, a cheap probe is made to see
+    whether the run following the last one listed exists. A full refresh is
+    made regardless every 'maxfull' seconds.
+
+    Example::
+
+      rlist = RunList()
+      while True:
+         print(rlist.runs()[-1])
+         time.sleep(5)
+    """
+
+    def __init__(self, dir=None, maxage=2., maxfull=300.):
+        """
+        dir     -- name of sub-directory on server
+
+        maxage  -- age in seconds beyond which the listing is checked for changes
+
+        maxfull -- age in seconds beyond which the listing is downloaded anyway
+        """
+        self.dir     = dir
+        self.maxage  = maxage
+        self.maxfull = maxfull
+        self._runs   = None
+        self._etag   = None
+        self._lmod   = None
+        self._tcheck = 0.
+        self._tfull  = 0.
+        self.nfull   = 0
+
+    def runs(self, force=False):
+        """
+        Returns a list of Runinfo records (run, nframe), sorted by run name.
+        The numbers of frames are those when the listing was last downloaded,
+        which is not done just because frames have been added to a run; use
+        get_nframe_from_server for the current number.
+
+        force -- True to download the listing regardless
+        """
+        now = time.time()
+        if force or self._runs is None or now - self._tfull > self.maxfull:
+            self._fetch(now)
+        elif now - self._tcheck > self.maxage:
+            self._tcheck = now
+            if self._etag is not None or self._lmod is not None:
+                self._fetch(now, True)
+            elif self._changed():
+                self._fetch(now)
+        return self._runs
+
+    def names(self, force=False):
+        """
+        Returns a list of run names, e.g. ['run001', 'run002'], sorted.
+        """
+        return [rinfo.run for rinfo in self.runs(force)]
+
+    def _fetch(self, now, conditional=False):
+        if URL is None:
+            raise UltracamError('RunList: no url for server found.' +
+                                ' Have you set the ULTRACAM_DEFAULT_URL environment variable?')
+        full_url = URL + ('' if self.dir is None else self.dir) + '?action=dir'
+        req = urllib.request.Request(full_url)
+        if conditional:
+            if self._etag is not None:
+                req.add_header('If-None-Match', self._etag)
+            if self._lmod is not None:
+                req.add_header('If-Modified-Since', self._lmod)
+        try:
+            resp = urllib.request.urlopen(req)
+        except urllib.error.HTTPError as err:
+            if conditional and err.code == 304:
+                return
+            raise
+        self._runs   = parse_runs(resp.read().decode('utf-8'))
+        self._etag   = resp.headers.get('ETag')
+        self._lmod   = resp.headers.get('Last-Modified')
+        self._tcheck = now
+        self._tfull  = now
+        self.nfull  += 1
+
+    def _changed(self):
+        # probe for the run following the last one known
+        if len(self._runs):
+            nrun = 'run{0:03d}'.format(int(self._runs[-1].run[3:])+1)
+        else:
+            nrun = 'run001'
+        if self.dir is not None:
+            nrun = self.dir + '/' + nrun
+        try:
+            urllib.request.urlopen(URL + nrun + '?action=get_num_frames').read()
+            return True
+        except urllib.error.HTTPError:
+            return False
+
 if __name__ == '__main__':
     print(get_runs_from_server())
     print('test passed')
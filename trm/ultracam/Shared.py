@@ -0,0 +1,457 @@
+"""
+Passing frames between processes through shared memory, either one at a
+time (ShmFrame) or by publishing them to any number of readers through a
+ring buffer (RingWriter, RingReader).
+
+Sending an MCCD through a multiprocessing Queue pickles every pixel, copies
+the bytes through a pipe and unpickles them into new arrays. A ShmFrame
+instead places the pixel data in a block of shared memory, using the
+out-of-band buffers of pickle protocol 5 (so any object whose pixel data are
+contiguous numpy arrays, such as packed MCCDs, CCDs or lists of them, can be
+sent). Only the ShmFrame itself, which carries the rest of the pickle and the
+name of the block, goes through the queue, and the receiving process gets
+an object whose arrays are views of the shared memory with no copying::
+
+  # reading process
+  for mccd in Rdata('run045'):
+     queue.put(ShmFrame(mccd))
+
+  # worker process
+  mccd = queue.get().get()
+
+The block is freed once the receiver has called get() and no longer holds
+any of the arrays. A ShmFrame which is never received should be freed with
+release().
+
+During observing, several programs may want the same live frames. A
+RingWriter publishes objects into a fixed number of slots of a named block of
+shared memory, overwriting the oldest, and any number of RingReaders attached
+by name read them without going back to the data. The writer never waits
+for readers: a reader that falls more than a ring's length behind skips to
+the oldest frame still held, counting the frames it missed (see the ufanout
+script).
+
+Needs Python 3.8 or later.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import mmap
+import time
+import struct
+import pickle
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+from trm.ultracam.UErrors import UltracamError
+
+# alignment of each buffer within the block, bytes
+SHM_ALIGN = 64
+
+# ring buffer layout: a header of magic, version, number of slots, bytes per
+# slot, number of objects written and a closed flag, then the slots, each
+# starting with a sequence counter, the size of the pickle and the number of
+# buffers, followed by the (offset, size) of each buffer.
+RING_MAGIC   = b'URNG'
+RING_VERSION = 1
+RING_HEAD    = struct.Struct('<4sIQQQQ')
+RING_SLOT    = struct.Struct('<QQQ')
+RING_SPAN    = struct.Struct('<QQ')
+RING_COUNT   = struct.Struct('<Q')
+RING_NHEAD   = 64
+
+# Blocks are handed between processes, so none is left registered with the
+# resource tracker (shared by a process and its children), which would
+# otherwise remove them when the process that made or attached them ends.
+
+def _open(name, create=False, size=0):
+    """
+    Creates or attaches to a block of shared memory, untracked
+    """
+    try:
+        return shared_memory.SharedMemory(name, create, size, track=False)
+    except TypeError:
+        # before Python 3.13
+        shm = shared_memory.SharedMemory(name, create, size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+def _unlink(shm):
+    """
+    Closes and removes a block opened with _open
+    """
+    shm.close()
+    if getattr(shm, '_track', True):
+        # unlink unregisters the block before Python 3.13
+        resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+
+def _pickle(obj):
+    """
+    Returns (meta, views): the protocol 5 pickle of obj without its
+    contiguous buffers, and memoryviews of the buffers.
+    """
+    views = []
+    def oob(pbuf):
+        try:
+            views.append(pbuf.raw())
+            return False
+        except BufferError:
+            # non-contiguous: pickled in-band
+            return True
+    return (pickle.dumps(obj, protocol=5, buffer_callback=oob), views)
+
+def _align(nbytes):
+    return -(-nbytes // SHM_ALIGN)*SHM_ALIGN
+
+def _attach(name):
+    """
+    Returns an mmap of the named block of shared memory. Unlike the memory
+    of a SharedMemory, this lasts as long as anything uses it.
+    """
+    shm = _open(name)
+    try:
+        if os.name == 'nt':
+            mbuf = mmap.mmap(-1, shm.size, tagname=name)
+        else:
+            mbuf = mmap.mmap(shm._fd, shm.size)
+    finally:
+        shm.close()
+    return mbuf
+
+class ShmFrame(object):
+    """
+    Handle on an object, typically an MCCD, whose numpy array data have been
+    moved into a block of shared memory. It is cheap to pickle, and so can be
+    passed between processes, e.g. through a multiprocessing Queue.
+
+    Attributes:
+
+      name   -- name of the shared memory block
+      nbytes -- number of bytes of array data held in it
+    """
+
+    def __init__(self, obj):
+        """
+        Copies the array data of obj into a new block of shared memory.
+        Contiguous arrays are moved out of the pickle; anything else is
+        pickled normally.
+        """
+        if shared_memory is None:
+            raise UltracamError('ShmFrame: multiprocessing.shared_memory is not available')
+
+        self._meta, views = _pickle(obj)
+
+        # lay the buffers out, aligned
+        self._spans = []
+        off = 0
+        for view in views:
+            self._spans.append((off, view.nbytes))
+            off += _align(view.nbytes)
+        self.nbytes = off
+
+        shm = _open(None, True, max(1, off))
+        try:
+            for view, (off, nbytes) in zip(views, self._spans):
+                shm.buf[off:off+nbytes] = view
+        except Exception:
+            _unlink(shm)
+            raise
+        self.name = shm.name
+        shm.close()
+
+    def __getstate__(self):
+        return (self.name, self.nbytes, self._meta, self._spans)
+
+    def __setstate__(self, state):
+        self.name, self.nbytes, self._meta, self._spans = state
+
+    def get(self, unlink=True):
+        """
+        Returns the object, with its arrays as views of the shared memory.
+        The memory stays valid while any of them exist.
+
+        unlink -- remove the name of the block, so that its memory is freed
+                  as soon as no process uses it. Only one process can then
+                  get() the object. Set False to let several processes share
+                  it, in which case one of them must call release() later.
+        """
+        mbuf = _attach(self.name)
+        if unlink:
+            self.release()
+
+        mview   = memoryview(mbuf)
+        buffers = [mview[off:off+nbytes] for off, nbytes in self._spans]
+        return pickle.loads(self._meta, buffers=buffers)
+
+    def release(self):
+        """
+        Frees the shared memory of a ShmFrame whose object has not been
+        received (or which was received with unlink=False).
+        """
+        try:
+            shm = _open(self.name)
+        except (OSError, ValueError):
+            return
+        _unlink(shm)
+
+class RingWriter(object):
+    """
+    Publishes objects, e.g. (run, nframe, MCCD) tuples, into a ring buffer in
+    a named block of shared memory, from which any number of RingReaders can
+    read them. Each object goes into the next of nslot slots, overwriting the
+    oldest, so the writer never waits for readers. Each slot has a sequence
+    counter which is odd while it is being written; readers check it before
+    and after reading a slot to detect being overtaken (a 'seqlock').
+
+    Attributes:
+
+      name     -- name of the block
+      nslot    -- number of slots
+      slotsize -- maximum bytes per object (pickle plus array data)
+      nwrite   -- number of objects written
+    """
+
+    def __init__(self, name, nslot=16, slotsize=32*1024*1024):
+        """
+        Creates the ring, replacing any block of the same name left by an
+        earlier writer.
+
+        name     -- name of the block, by which readers find it
+
+        nslot    -- number of slots, i.e. the number of most recent objects
+                    held. Readers falling further behind than this miss some.
+
+        slotsize -- bytes per slot, which must hold the largest object
+        """
+        if shared_memory is None:
+            raise UltracamError('RingWriter: multiprocessing.shared_memory is not available')
+        if nslot < 2:
+            raise UltracamError('RingWriter: need at least 2 slots')
+
+        self.name     = name
+        self.nslot    = nslot
+        self.slotsize = _align(slotsize)
+        self.nwrite   = 0
+        size = RING_NHEAD + nslot*self.slotsize
+        try:
+            self._shm = _open(name, True, size)
+        except FileExistsError:
+            _unlink(_open(name))
+            self._shm = _open(name, True, size)
+        self._buf = self._shm.buf
+        self._buf[:RING_NHEAD] = bytes(RING_NHEAD)
+        self._head(0)
+
+    def _head(self, closed):
+        RING_HEAD.pack_into(self._buf, 0, RING_MAGIC, RING_VERSION, self.nslot,
+                            self.slotsize, self.nwrite, closed)
+
+    def put(self, obj):
+        """
+        Publishes an object. Raises an UltracamError if it is too large for a
+        slot.
+        """
+        meta, views = _pickle(obj)
+        nhead = RING_SLOT.size + RING_SPAN.size*len(views)
+        spans = []
+        off   = _align(nhead + len(meta))
+        for view in views:
+            spans.append((off, view.nbytes))
+            off += _align(view.nbytes)
+        if off > self.slotsize:
+            raise UltracamError('RingWriter.put: object needs ' + str(off) +
+                                ' bytes, more than the slot size of ' + str(self.slotsize))
+
+        buf  = self._buf
+        seq  = self.nwrite
+        base = RING_NHEAD + (seq % self.nslot)*self.slotsize
+        RING_SLOT.pack_into(buf, base, 2*seq+1, len(meta), len(views))
+        for n, span in enumerate(spans):
+            RING_SPAN.pack_into(buf, base+RING_SLOT.size+RING_SPAN.size*n, *span)
+        buf[base+nhead:base+nhead+len(meta)] = meta
+        for view, (off, nbytes) in zip(views, spans):
+            buf[base+off:base+off+nbytes] = view
+        RING_COUNT.pack_into(buf, base, 2*seq+2)
+
+        self.nwrite += 1
+        self._head(0)
+
+    def close(self):
+        """
+        Marks the ring as closed, so that readers stop once they have read
+        what is left, and removes its name.
+        """
+        if self._buf is not None:
+            self._head(1)
+            self._buf.release()
+            self._buf = None
+            _unlink(self._shm)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class RingReader(object):
+    """
+    Reads objects from a ring buffer written by a RingWriter, in order,
+    skipping any that were overwritten before they could be read. Iterating
+    over a RingReader yields objects until the writer closes the ring::
+
+      for run, nframe, mccd in RingReader('ultracam'):
+         ...
+
+    Attributes:
+
+      name     -- name of the ring
+      nslot    -- number of slots
+      next     -- sequence number (from 0) of the next object to read
+      nread    -- number of objects read
+      ndropped -- number of objects missed by falling too far behind
+    """
+
+    def __init__(self, name, oldest=False, poll=0.05):
+        """
+        name   -- name of the ring
+
+        oldest -- True to start with the oldest object still held, else with
+                  the next one written
+
+        poll   -- interval between checks for new objects, seconds
+        """
+        if shared_memory is None:
+            raise UltracamError('RingReader: multiprocessing.shared_memory is not available')
+        self.name  = name
+        self._poll = poll
+        self._mbuf = _attach(name)
+        self._buf  = memoryview(self._mbuf)
+        magic, version, self.nslot, self._slotsize, nwrite, closed = \
+            RING_HEAD.unpack_from(self._buf)
+        if magic != RING_MAGIC or version != RING_VERSION:
+            raise UltracamError('RingReader: ' + name + ' is not a ring buffer of the right version')
+        self.next     = max(0, nwrite - self.nslot + 1) if oldest else nwrite
+        self.nread    = 0
+        self.ndropped = 0
+
+    def _state(self):
+        # returns (number written, closed)
+        return RING_HEAD.unpack_from(self._buf)[4:]
+
+    def valid(self, seq):
+        """
+        Returns True if the object with sequence number seq is still held,
+        i.e. any views of it returned by get(copy=False) are still good.
+        """
+        base = RING_NHEAD + (seq % self.nslot)*self._slotsize
+        return RING_COUNT.unpack_from(self._buf, base)[0] == 2*seq+2
+
+    def get(self, block=True, timeout=None, copy=True):
+        """
+        Returns (seq, obj), the sequence number and the next object, or None
+        if there is none within the timeout or if the ring is closed and all
+        of it has been read.
+
+        block   -- wait for an object if there is none yet
+
+        timeout -- maximum time to wait, seconds, None to wait indefinitely
+
+        copy    -- copy the array data of the object out of the ring. If False
+                   its arrays are views of the slot, which are only good until
+                   the writer reaches it again; check with valid(seq) after
+                   using them.
+        """
+        tend = None if timeout is None else time.time() + timeout
+        while True:
+            nwrite, closed = self._state()
+            if self.next >= nwrite:
+                if closed or not block or (tend is not None and time.time() > tend):
+                    return None
+                time.sleep(self._poll)
+                continue
+
+            # skip to the oldest object not about to be overwritten
+            oldest = nwrite - self.nslot + 1
+            if self.next < oldest:
+                self.ndropped += oldest - self.next
+                self.next = oldest
+
+            seq  = self.next
+            base = RING_NHEAD + (seq % self.nslot)*self._slotsize
+            count, nmeta, nbuf = RING_SLOT.unpack_from(self._buf, base)
+            if count == 2*seq+2:
+                nhead = RING_SLOT.size + RING_SPAN.size*nbuf
+                meta  = bytes(self._buf[base+nhead:base+nhead+nmeta])
+                buffers = []
+                for n in range(nbuf):
+                    off, nbytes = RING_SPAN.unpack_from(self._buf, base+RING_SLOT.size+RING_SPAN.size*n)
+                    view = self._buf[base+off:base+off+nbytes]
+                    buffers.append(bytearray(view) if copy else view)
+                if self.valid(seq):
+                    self.next  += 1
+                    self.nread += 1
+                    return (seq, pickle.loads(meta, buffers=buffers))
+
+            # overtaken by the writer while reading
+            self.ndropped += 1
+            self.next += 1
+
+    def __iter__(self):
+        while True:
+            item = self.get()
+            if item is None:
+                return
+            yield item[1]
+
+    def frames(self, latest=False, tick=None):
+        """
+        Generator for rings of (run, nframe, item) tuples as written by the
+        ufanout script, mirroring follow(): it yields the tuples and, if tick
+        is set, a (run, None, None) tuple each time tick seconds pass without
+        one, 'run' being the last run seen. It ends when the ring is closed.
+
+        latest -- True to skip to the most recent tuple each time, e.g. for
+                  monitoring. Tuples skipped in this way are not counted as
+                  dropped.
+        """
+        run = None
+        while True:
+            if latest:
+                self.next = max(self.next, self._state()[0]-1)
+            item = self.get(timeout=tick)
+            if item is not None:
+                run = item[1][0]
+                yield item[1]
+            elif self._state()[1] and self.next >= self._state()[0]:
+                return
+            else:
+                yield (run, None, None)
+
+    def close(self):
+        """
+        Detaches from the ring. Views returned by get(copy=False) remain
+        usable (though not necessarily valid).
+        """
+        self._buf.release()
+
+if __name__ == '__main__':
+    import numpy as np
+    arrs = [np.arange(10, dtype=np.float32), np.ones((3,4), np.uint16)]
+    got  = ShmFrame(arrs).get()
+    assert (got[0] == arrs[0]).all() and (got[1] == arrs[1]).all()
+
+    name   = 'ultracam_test_' + str(os.getpid())
+    writer = RingWriter(name, 4, 1024)
+    reader = RingReader(name)
+    for n in range(6):
+        writer.put((n, arrs[0]+n))
+    writer.close()
+    got = [item for item in reader]
+    assert [item[0] for item in got] == [3,4,5] and reader.ndropped == 3
+    assert (got[-1][1] == arrs[0]+5).all()
+    print('test passed')
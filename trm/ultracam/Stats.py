@@ -0,0 +1,349 @@
+"""
+Statistics of pixel data: histogram-based statistics of frames (Hstats) and
+per-pixel statistics accumulated over runs (RunningStats).
+
+Raw ULTRACAM and ULTRASPEC data are unsigned 2-byte integers, for which a
+histogram of the values (one call to numpy.bincount) holds everything
+needed for the minimum, maximum, mean, mode and any number of exact
+percentiles, without the sorting or partitioning that np.median and
+np.percentile need. Floating point data are binned finely instead, which
+gives percentiles good to a small fraction of the range of the data.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import six
+
+try:
+    import numpy as np
+except ImportError:
+    print('Failed to import numpy; some routines will fail')
+
+from trm.ultracam.UErrors import UltracamError
+
+# number of bins used for floating point data
+HSTATS_NBIN = 65536
+
+class Hstats(object):
+    """
+    Histogram-based statistics of one or more arrays. For non-negative
+    integer data (e.g. raw unsigned 2-byte data) each bin holds one value and
+    all statistics are exact, with percentiles matching those of
+    np.percentile. For floating point data, the range of the first array added
+    is divided into nbin equal bins; the minimum, maximum and mean remain
+    exact but percentiles and the mode are then approximate, to within about
+    one bin width, and later data outside the range are counted in the end
+    bins.
+
+    Typical use is:
+
+     hs = Hstats()
+     for win in ccd:
+        hs.add(win.data)
+     p5, med, p95 = hs.centile((5,50,95))
+
+    Attributes:
+
+      n     -- number of values added
+      hist  -- numpy array of the counts in each bin
+      lo    -- value of the centre of the first bin
+      width -- bin width (1 for integers)
+    """
+
+    def __init__(self, data=None, nbin=HSTATS_NBIN):
+        """
+        data -- array to start with, or None.
+
+        nbin -- number of bins to use if the data are floating point.
+        """
+        self.n      = 0
+        self.hist   = None
+        self.lo     = 0.
+        self.width  = 1.
+        self._nbin  = nbin
+        self._float = None
+        self._sum   = 0.
+        self._min   = None
+        self._max   = None
+        self._cum   = None
+        if data is not None:
+            self.add(data)
+
+    def add(self, data):
+        """
+        Adds the values of an array (of any shape) into the histogram. All
+        arrays added must be of the same kind (integer or floating point).
+        """
+        data = np.asarray(data).ravel()
+        if not len(data):
+            return
+        isflt = not issubclass(data.dtype.type, np.integer)
+        if self._float is None:
+            self._float = isflt
+        elif isflt != self._float:
+            raise UltracamError('Hstats.add: cannot mix integer and floating point data')
+
+        if isflt:
+            dmin, dmax = data.min(), data.max()
+            if self.hist is None:
+                self.lo    = float(dmin)
+                self.width = (float(dmax) - self.lo)/(self._nbin-1) if dmax > dmin else 1.
+                self.hist  = np.zeros(self._nbin, np.int64)
+            ind = np.rint((data - self.lo)/self.width).astype(np.intp)
+            np.clip(ind, 0, self._nbin-1, out=ind)
+            self.hist += np.bincount(ind, minlength=self._nbin)
+            self._sum += data.sum(dtype=np.float64)
+            self._min  = dmin if self._min is None else min(self._min, dmin)
+            self._max  = dmax if self._max is None else max(self._max, dmax)
+        else:
+            try:
+                hist = np.bincount(data)
+            except ValueError:
+                raise UltracamError('Hstats.add: integer data must be non-negative')
+            if self.hist is None:
+                self.hist = hist
+            elif len(hist) > len(self.hist):
+                hist[:len(self.hist)] += self.hist
+                self.hist = hist
+            else:
+                self.hist[:len(hist)] += hist
+        self.n   += len(data)
+        self._cum = None
+
+    def _check(self):
+        if not self.n:
+            raise UltracamError('Hstats: no data have been added')
+
+    def min(self):
+        """
+        Returns the minimum value
+        """
+        self._check()
+        return self._min if self._float else int(np.flatnonzero(self.hist)[0])
+
+    def max(self):
+        """
+        Returns the maximum value
+        """
+        self._check()
+        return self._max if self._float else len(self.hist)-1
+
+    def mean(self):
+        """
+        Returns the mean value
+        """
+        self._check()
+        if self._float:
+            return self._sum / self.n
+        return np.dot(self.hist, np.arange(len(self.hist), dtype=np.float64)) / self.n
+
+    def mode(self):
+        """
+        Returns (mode, nmode), the modal value and the number of times it
+        occurs (for floats, the centre of the fullest bin and its count).
+        """
+        self._check()
+        imax = int(np.argmax(self.hist))
+        return (self.lo + self.width*imax if self._float else imax, int(self.hist[imax]))
+
+    def centile(self, pcent):
+        """
+        Returns percentile(s) of the values, interpolating in the same way as
+        np.percentile. pcent can be a single number or array-like, in which
+        case an array of values is returned.
+
+        pcent -- percentile or percentiles (0 to 100)
+        """
+        self._check()
+        if isinstance(pcent, six.string_types):
+            raise UltracamError('Hstats.centile: argument "pcent" cannot be a string')
+        pcent = np.asarray(pcent, dtype=np.float64)
+        if (pcent < 0).any() or (pcent > 100).any():
+            raise UltracamError('Hstats.centile: percentiles must lie from 0 to 100')
+
+        if self._cum is None:
+            self._cum = np.cumsum(self.hist)
+
+        # ranks of the values either side of each percentile in the sorted data
+        pos  = pcent/100.*(self.n-1)
+        rlo  = np.floor(pos)
+        frac = pos - rlo
+        rhi  = np.minimum(rlo+1, self.n-1)
+        vlo  = np.searchsorted(self._cum, rlo, side='right')
+        vhi  = np.searchsorted(self._cum, rhi, side='right')
+        vals = vlo + frac*(vhi-vlo)
+
+        if self._float:
+            vals = np.clip(self.lo + self.width*vals, self._min, self._max)
+        return vals[()]
+
+    def median(self):
+        """
+        Returns the median
+        """
+        return self.centile(50.)
+
+class RunningStats(object):
+    """
+    Accumulates the per-pixel mean, variance, minimum and maximum over the
+    frames (MCCDs) of a run without keeping the frames, so memory use does not
+    grow with the length of the run. Frames can be added one at a time
+    (Welford's method) or in blocks, and accumulators built separately, e.g.
+    by parallel workers on different parts of a run, can be merged (Chan et
+    al's method). All frames must have the format signature (see MCCD.fsig)
+    of the first.
+
+    Typical use is:
+
+     rstats = RunningStats()
+     rstats.add_frames(Rdata('run045'))
+     mean, sigma = rstats.mean(), rstats.sigma()
+
+    Attributes:
+
+      n    -- number of frames added
+      fsig -- format signature of the frames, None until one is added
+    """
+
+    def __init__(self):
+        self.n     = 0
+        self.fsig  = None
+        self._tmpl = None
+        self._mean = []
+        self._m2   = []
+        self._min  = []
+        self._max  = []
+
+    def _start(self, mccd):
+        # set up from the first frame; each statistic is a list of 1D
+        # arrays, one per CCD, with pixels in Window order (see CCD.pack)
+        self.fsig  = mccd.fsig
+        self._tmpl = mccd
+        for ccd in mccd:
+            npix = ccd.npix()
+            self._mean.append(np.zeros(npix))
+            self._m2.append(np.zeros(npix))
+            self._min.append(np.full(npix, np.inf))
+            self._max.append(np.full(npix, -np.inf))
+
+    def _check(self, mccd):
+        if self.fsig is None:
+            self._start(mccd)
+        elif mccd.fsig != self.fsig:
+            raise UltracamError('RunningStats: frame format does not match that of the first frame')
+
+    def add(self, mccd):
+        """
+        Adds one frame
+        """
+        self._check(mccd)
+        self.n += 1
+        for nc, ccd in enumerate(mccd):
+            x     = ccd._pixels()
+            mean  = self._mean[nc]
+            delta = x - mean
+            mean += delta/self.n
+            self._m2[nc] += delta*(x - mean)
+            np.minimum(self._min[nc], x, out=self._min[nc])
+            np.maximum(self._max[nc], x, out=self._max[nc])
+
+    def add_block(self, mccds):
+        """
+        Adds a list of frames in one go, which is faster than adding them one
+        by one as the statistics of the block are found with whole-array
+        operations before being merged in.
+        """
+        if not len(mccds):
+            return
+        for mccd in mccds:
+            self._check(mccd)
+        nb = len(mccds)
+        for nc in range(len(self._mean)):
+            block = np.array([mccd[nc]._pixels() for mccd in mccds], dtype=np.float64)
+            bmean = block.mean(axis=0)
+            block -= bmean
+            self._merge(nc, nb, bmean, (block*block).sum(axis=0),
+                        block.min(axis=0) + bmean, block.max(axis=0) + bmean)
+        self.n += nb
+
+    def add_frames(self, frames, nblock=16):
+        """
+        Adds all the frames from an iterable such as an Rdata, nblock at a
+        time (see add_block). Returns the number of frames added.
+        """
+        n, block = 0, []
+        for mccd in frames:
+            block.append(mccd)
+            if len(block) == nblock:
+                self.add_block(block)
+                n, block = n + len(block), []
+        self.add_block(block)
+        return n + len(block)
+
+    def _merge(self, nc, nb, bmean, bm2, bmin, bmax):
+        # merge statistics of nb frames into those of CCD nc (not updating n)
+        ntot  = self.n + nb
+        mean  = self._mean[nc]
+        delta = bmean - mean
+        mean += delta*(float(nb)/ntot)
+        self._m2[nc] += bm2 + delta*delta*(float(self.n)*nb/ntot)
+        np.minimum(self._min[nc], bmin, out=self._min[nc])
+        np.maximum(self._max[nc], bmax, out=self._max[nc])
+
+    def merge(self, other):
+        """
+        Merges in the statistics of another RunningStats, e.g. one built
+        from a different part of the run.
+        """
+        if other.n == 0:
+            return
+        if self.fsig is None:
+            self._start(other._tmpl)
+        elif other.fsig != self.fsig:
+            raise UltracamError('RunningStats.merge: frame formats do not match')
+        for nc in range(len(self._mean)):
+            self._merge(nc, other.n, other._mean[nc], other._m2[nc], other._min[nc], other._max[nc])
+        self.n += other.n
+
+    def _output(self, arrs):
+        if self.n == 0:
+            raise UltracamError('RunningStats: no frames have been added')
+        ccds = [ccd.like(arr.astype(np.float32)) for ccd, arr in zip(self._tmpl, arrs)]
+        return self._tmpl.__class__(ccds, self._tmpl.head)
+
+    def mean(self):
+        """
+        Returns an MCCD of the mean of each pixel
+        """
+        return self._output(self._mean)
+
+    def sigma(self, ddof=1):
+        """
+        Returns an MCCD of the standard deviation of each pixel.
+
+        ddof -- 'delta degrees of freedom': the sums of squares are divided
+                by the number of frames minus ddof.
+        """
+        if self.n <= ddof:
+            raise UltracamError('RunningStats.sigma: too few frames')
+        return self._output([np.sqrt(m2/(self.n-ddof)) for m2 in self._m2])
+
+    def min(self):
+        """
+        Returns an MCCD of the minimum of each pixel
+        """
+        return self._output(self._min)
+
+    def max(self):
+        """
+        Returns an MCCD of the maximum of each pixel
+        """
+        return self._output(self._max)
+
+if __name__ == '__main__':
+    data = np.random.randint(0, 2000, 10001).astype(np.uint16)
+    hs = Hstats(data)
+    pcs = (0.1,1.,5.,50.,95.,99.,99.9)
+    assert (hs.centile(pcs) == np.percentile(data, pcs)).all()
+    assert hs.min() == data.min() and hs.max() == data.max()
+    print('test passed')
@@ -3,6 +3,8 @@ Simple class for representing times
 """
 from __future__ import print_function
 
+from trm.ultracam.Utils import set_dict_state
+
 class Time(object):
     """
     Represents a time for a CCD. Three attributes:
@@ -12,12 +14,23 @@ class Time(object):
     good   -- is the time thought to be reliable?
     reason -- if good == False, this is the reason.
     """
+
+    # one of these is made per CCD per frame, so no per-instance __dict__
+    __slots__ = ('mjd', 'expose', 'good', 'reason')
+
     def __init__(self, mjd, expose, good, reason):
         self.mjd    = mjd
         self.expose = expose
         self.good   = good
         self.reason = reason
 
+    def __getstate__(self):
+        return (self.mjd, self.expose, self.good, self.reason)
+
+    def __setstate__(self, state):
+        if not set_dict_state(self, state):
+            self.mjd, self.expose, self.good, self.reason = state
+
     def __repr__(self):
         rep = 'Time(mjd=' + repr(self.mjd) + ', expose=' + \
             repr(self.expose) + ', good=' + repr(self.good) + \
@@ -0,0 +1,312 @@
+"""
+Pixel time-series files: runs transposed to time-major order.
+
+Raw data files hold one frame after another, so the history of one pixel
+is spread across the whole file. write_tseries transposes a run, or some of
+its windows, into a file in which each window is divided into tiles of
+pixels, and each tile is stored pixel by pixel with the values of a pixel
+over all frames next to each other, i.e. in (tile, y, x, frame) order.
+The light curve of any pixel is then one contiguous read, as is any region
+lying within a tile. The times of the frames are kept as well. Tseries
+reads the files::
+
+  write_tseries('run045', 'run045.tsf')
+  tser  = Tseries('run045.tsf')
+  lc    = tser.series(1, 0, 20, 30)
+  box   = tser.region(1, 0, 15, 25, 25, 35)
+
+Frames are read once, in order, and their pixels written as rows of a
+scratch file in the order of the output. The scratch file is then
+transposed in blocks covering a range of both frames and pixels, each small
+enough to fit within a set amount of memory, with blocks handled in
+parallel in a pool of threads, so that runs of any length can be
+transposed. Blocks are kept roughly square so that reads and writes are of
+runs of values long enough to make good use of each page of the files,
+however many frames there are.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import struct
+import tempfile
+import threading
+import itertools
+
+try:
+    import numpy as np
+except ImportError:
+    print('Failed to import numpy; some routines will fail')
+
+from trm.ultracam.Odict import Odict
+from trm.ultracam.Raw import Rdata
+from trm.ultracam.Utils import thread_pool
+from trm.ultracam.UErrors import UltracamError
+
+TSERIES_MAGIC   = b'UTSF'
+TSERIES_VERSION = 1
+
+# header: magic, version, first frame, number of frames, number of CCDs,
+# number of windows, tile size in y and x, and the data type
+TSERIES_HEAD = struct.Struct('<4sIQQIIII4s')
+
+# one per window: CCD, window (both from 0), nx, ny, llx, lly, xbin, ybin and
+# the byte offset of its data
+TSERIES_WIN = struct.Struct('<IIIIiiIIQ')
+
+# data start at a multiple of this many bytes
+TSERIES_ALIGN = 4096
+
+def _tiles(ny, nx, tile):
+    """
+    Returns the (y1, y2, x1, x2) of the tiles of a window, in file order
+    """
+    ty, tx = tile
+    return [(y1, min(ny,y1+ty), x1, min(nx,x1+tx)) for y1 in range(0, ny, ty)
+            for x1 in range(0, nx, tx)]
+
+def _blocks(npix, nframe, nelem):
+    """
+    Returns the (p1, p2, f1, f2) of the blocks of pixels p1 to p2 and frames
+    f1 to f2 in which to transpose a stack of nframe rows of npix pixels,
+    each block holding at most about nelem values. Blocks are made roughly
+    square, so that both the parts of the rows of the stack read and the
+    parts of the rows of the output written are as long as they can be.
+    """
+    if npix*nframe <= nelem:
+        return [(0, npix, 0, nframe)]
+    npb = min(npix, max(1, int(np.sqrt(nelem))))
+    nfb = min(nframe, max(1, nelem // npb))
+    npb = min(npix, max(1, nelem // nfb))
+    return [(p1, min(npix,p1+npb), f1, min(nframe,f1+nfb))
+            for p1 in range(0, npix, npb) for f1 in range(0, nframe, nfb)]
+
+def write_tseries(run, fname, wins=None, first=1, last=0, tile=(16,16), flt=False,
+                  maxmem=256, nthreads=4, server=False, tdir=None):
+    """
+    Transposes a run into a time-series file (see Tseries). Returns the
+    number of frames written.
+
+    run      -- run to read, e.g. 'run045'
+
+    fname    -- name of the file to write
+
+    wins     -- list of (nccd, nwin) of the windows to include (both from 0),
+                or None for all.
+
+    first    -- first frame to include
+
+    last     -- last frame to include, 0 for the last in the run
+
+    tile     -- (ny, nx), the size of the tiles. Light curves of regions
+                within a tile are read in one go.
+
+    flt      -- True to store float32 values, False for unsigned 2-byte ints
+
+    maxmem   -- approximate memory to use for transposing, MB
+
+    nthreads -- number of blocks to transpose in parallel
+
+    server   -- True to read the run from the FileServer
+
+    tdir     -- directory for the scratch file; defaults to the system's
+                temporary directory.
+    """
+    rdat = Rdata(run, first, flt=flt, server=server)
+    if last == 0:
+        last = rdat.ntotal()
+    if last < first:
+        raise UltracamError('write_tseries: no frames to transpose from ' + str(run))
+    nframe = last - first + 1
+    dtype  = np.dtype('<f4' if flt else '<u2')
+
+    # geometry of the windows of the frames, found as for Rdata.iter_arrays
+    index = np.arange(rdat.framesize//2-rdat.headerwords, dtype=np.intp)
+    frame = rdat._windows(index)
+    nccd  = len(frame)
+    if wins is None:
+        wins = [(nc, nw) for nc in range(nccd) for nw in range(len(frame[nc]))]
+    for nc, nw in wins:
+        if nc < 0 or nc >= nccd or nw < 0 or nw >= len(frame[nc]):
+            raise UltracamError('write_tseries: ' + str(run) + ' has no window ' +
+                                str(nw+1) + ' of CCD ' + str(nc+1))
+
+    # order of the pixels of each window in the file, and where they start
+    perms, starts, npix = [], [], 0
+    for nc, nw in wins:
+        win  = frame[nc][nw]
+        pind = np.arange(win.size).reshape((win.ny,win.nx))
+        perms.append(np.concatenate([pind[y1:y2,x1:x2].ravel() for y1, y2, x1, x2 in
+                                     _tiles(win.ny, win.nx, tile)]))
+        starts.append(npix)
+        npix += win.size
+    if npix == 0:
+        raise UltracamError('write_tseries: no pixels to transpose')
+
+    # header, window table and times come first, then the data
+    ntimes = nccd*nframe*(8+4+1)
+    offset = TSERIES_HEAD.size + len(wins)*TSERIES_WIN.size + ntimes
+    offset = TSERIES_ALIGN*((offset + TSERIES_ALIGN - 1) // TSERIES_ALIGN)
+    mjd    = np.zeros((nccd,nframe), np.float64)
+    expose = np.zeros((nccd,nframe), np.float32)
+    good   = np.zeros((nccd,nframe), np.uint8)
+
+    with tempfile.TemporaryFile(dir=tdir) as fobj:
+
+        # read frames into the stack, one row per frame
+        stack = np.memmap(fobj, dtype, 'w+', shape=(nframe, npix))
+        nread = 0
+        for nf, times, arrays in itertools.islice(rdat.iter_arrays(), nframe):
+            for nc, time in enumerate(times):
+                if time is not None:
+                    mjd[nc,nread], expose[nc,nread], good[nc,nread] = time.mjd, time.expose, time.good
+            for (nc, nw), perm, start in zip(wins, perms, starts):
+                np.take(arrays[nc][nw].ravel(), perm, out=stack[nread,start:start+len(perm)])
+            nread += 1
+
+        if nread < nframe:
+            raise UltracamError('write_tseries: only ' + str(nread) + ' of ' + str(nframe) +
+                                ' frames could be read from ' + str(run))
+
+        # write the header and times
+        with open(fname, 'wb') as fout:
+            fout.write(TSERIES_HEAD.pack(TSERIES_MAGIC, TSERIES_VERSION, first, nframe, nccd,
+                                         len(wins), tile[0], tile[1], dtype.str.encode()))
+            for (nc, nw), start in zip(wins, starts):
+                win = frame[nc][nw]
+                fout.write(TSERIES_WIN.pack(nc, nw, win.nx, win.ny, win.llx, win.lly, win.xbin,
+                                            win.ybin, offset + start*nframe*dtype.itemsize))
+            for arr in (mjd, expose, good):
+                fout.write(arr.astype(arr.dtype.newbyteorder('<')).tobytes())
+            fout.truncate(offset + npix*nframe*dtype.itemsize)
+
+        # then transpose the stack in blocks of frames and pixels, with room
+        # for the copy of each block
+        out    = np.memmap(fname, dtype, 'r+', offset, shape=(npix, nframe))
+        nelem  = int(1024*1024*maxmem) // (2*dtype.itemsize*max(1,nthreads))
+
+        def transpose(block):
+            p1, p2, f1, f2 = block
+            out[p1:p2,f1:f2] = np.array(stack[f1:f2,p1:p2]).T
+
+        blocks = _blocks(npix, nframe, nelem)
+        if nthreads > 1:
+            thread_pool(nthreads).map(transpose, blocks)
+        else:
+            for block in blocks:
+                transpose(block)
+        out.flush()
+        del out, stack
+
+    return nframe
+
+class Tseries(object):
+    """
+    Reads time-series files written by write_tseries. The light curve of a
+    pixel, or of a region within a tile, is found with a single read.
+    Windows are referred to by their CCD and window numbers (from 0) and
+    pixels by their y, x indices within the window's data array (from 0),
+    as for RunArray.
+
+    Attributes:
+
+      first  -- number of the first frame (from 1)
+      nframe -- number of frames
+      nccd   -- number of CCDs of the run
+      tile   -- (ny, nx), the size of the tiles
+      dtype  -- type of the data
+      wins   -- ordered dictionary, keyed on (nccd, nwin), of the windows
+                included, each value being (nx, ny, llx, lly, xbin, ybin).
+      mjd, expose, good -- the MJD, exposure time and whether the time was
+                thought good of each frame, as arrays of shape (nccd, nframe)
+    """
+
+    def __init__(self, fname):
+        self._fobj = open(fname, 'rb')
+        self._lock = threading.Lock()
+        self._fd   = self._fobj.fileno() if hasattr(os, 'preadv') else None
+        head = self._fobj.read(TSERIES_HEAD.size)
+        if len(head) != TSERIES_HEAD.size or head[:4] != TSERIES_MAGIC:
+            raise UltracamError('Tseries: ' + str(fname) + ' is not a time-series file')
+        magic, version, self.first, self.nframe, self.nccd, nwin, ty, tx, dtype = \
+            TSERIES_HEAD.unpack(head)
+        if version != TSERIES_VERSION:
+            raise UltracamError('Tseries: ' + str(fname) + ' has unrecognised version ' + str(version))
+        self.tile  = (ty, tx)
+        self.dtype = np.dtype(dtype.rstrip(b'\x00').decode())
+
+        self.wins    = Odict()
+        self._starts = {}
+        for n in range(nwin):
+            nc, nw, nx, ny, llx, lly, xbin, ybin, start = \
+                TSERIES_WIN.unpack(self._fobj.read(TSERIES_WIN.size))
+            self.wins[(nc,nw)] = (nx, ny, llx, lly, xbin, ybin)
+            self._starts[(nc,nw)] = start
+
+        shape = (self.nccd, self.nframe)
+        self.mjd    = np.fromfile(self._fobj, '<f8', self.nccd*self.nframe).reshape(shape)
+        self.expose = np.fromfile(self._fobj, '<f4', self.nccd*self.nframe).reshape(shape)
+        self.good   = np.fromfile(self._fobj, 'u1', self.nccd*self.nframe).reshape(shape).astype(bool)
+
+    def _read(self, nbytes, offset):
+        # positional read of nbytes from offset into a new array
+        buff = np.empty(nbytes, np.uint8)
+        if self._fd is not None:
+            mv, nread = memoryview(buff), 0
+            while nread < nbytes:
+                n = os.preadv(self._fd, [mv[nread:]], offset+nread)
+                if n == 0:
+                    break
+                nread += n
+        else:
+            with self._lock:
+                self._fobj.seek(offset)
+                nread = self._fobj.readinto(buff)
+        if nread != nbytes:
+            raise UltracamError('Tseries: failed to read ' + str(nbytes) + ' bytes')
+        return buff.view(self.dtype)
+
+    def region(self, nc, nw, y1, y2, x1, x2):
+        """
+        Returns the light curves of the pixels y1 <= y < y2, x1 <= x < x2 of
+        window nw of CCD nc, as an array of shape (y2-y1, x2-x1, nframe).
+        Each tile overlapping the region is read with one read.
+        """
+        try:
+            nx, ny = self.wins[(nc,nw)][:2]
+        except KeyError:
+            raise UltracamError('Tseries.region: there is no window ' + str(nw+1) + ' of CCD ' + str(nc+1))
+        if y1 < 0 or y2 > ny or y1 >= y2 or x1 < 0 or x2 > nx or x1 >= x2:
+            raise UltracamError('Tseries.region: region is empty or out of range')
+
+        out   = np.empty((y2-y1, x2-x1, self.nframe), self.dtype)
+        nval  = self.nframe*self.dtype.itemsize
+        start = self._starts[(nc,nw)]
+        for ty1, ty2, tx1, tx2 in _tiles(ny, nx, self.tile):
+            if ty1 < y2 and ty2 > y1 and tx1 < x2 and tx2 > x1:
+                # the rows of the tile within the region are contiguous
+                ya, yb = max(y1,ty1), min(y2,ty2)
+                tnx    = tx2 - tx1
+                data   = self._read((yb-ya)*tnx*nval, start + (ya-ty1)*tnx*nval)
+                data   = data.reshape((yb-ya, tnx, self.nframe))
+                xa, xb = max(x1,tx1), min(x2,tx2)
+                out[ya-y1:yb-y1,xa-x1:xb-x1] = data[:,xa-tx1:xb-tx1]
+            start += (ty2-ty1)*(tx2-tx1)*nval
+        return out
+
+    def series(self, nc, nw, y, x):
+        """
+        Returns the light curve of pixel y, x of window nw of CCD nc
+        """
+        return self.region(nc, nw, y, y+1, x, x+1)[0,0]
+
+    def close(self):
+        """
+        Closes the file
+        """
+        self._fobj.close()
+
+if __name__ == '__main__':
+    assert _tiles(5, 3, (2,2)) == [(0,2,0,2), (0,2,2,3), (2,4,0,2), (2,4,2,3), (4,5,0,2), (4,5,2,3)]
+    print('test passed')
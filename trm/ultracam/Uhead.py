@@ -4,11 +4,33 @@ Header class for ucm files
 from __future__ import absolute_import
 from __future__ import print_function
 
+import struct
+try:
+    import numpy as np
+except ImportError:
+    print('Failed to import numpy; some routines will fail')
+
 from trm.ultracam.Odict import Odict
 from trm.ultracam.Constants import *
 from trm.ultracam.UErrors import UltracamError
 import six
 
+# formats used when writing header values of fixed size to ucm files
+PACK_INT   = struct.Struct('=i')
+PACK_ITYPE = {ITYPE_DOUBLE : struct.Struct('=d'), ITYPE_INT : PACK_INT,
+              ITYPE_UINT : struct.Struct('=I'), ITYPE_FLOAT : struct.Struct('=f'),
+              ITYPE_BOOL : struct.Struct('=B'), ITYPE_UCHAR : struct.Struct('=B'),
+              ITYPE_USINT : struct.Struct('=H')}
+PACK_VTYPE = {ITYPE_DVECTOR : 'd', ITYPE_IVECTOR : 'i', ITYPE_FVECTOR : 'f'}
+
+def pack_string(strng):
+    """
+    Returns a string serialised as in ucm files, as the number of bytes
+    followed by the bytes.
+    """
+    bstr = strng.encode('utf-8')
+    return PACK_INT.pack(len(bstr)) + bstr
+
 class Uhead(Odict):
     """
     Class for containing headers compatible with ucm files. Each entry is
@@ -31,6 +53,9 @@ class Uhead(Odict):
     the keys and values.
     """
 
+    # serialised header and the modification stamp it applies to (see pack)
+    _packed = None
+
     def __init__(self, head=None):
         """
         Constructor, either just a default () or with a header as a dictionary
@@ -156,7 +181,7 @@ class Uhead(Odict):
             if not isinstance(value, np.ndarray) or len(value.shape) != 1:
                 raise UltracamError('Uhead.add_entry: key = ' + key +
                                 ': require a 1D numpy.ndarray for ITYPE_DVECTOR)')
-            value = value.astype(float64)
+            value = value.astype(np.float64)
         elif itype == ITYPE_IVECTOR:
             if not isinstance(value, np.ndarray) or len(value.shape) != 1:
                 raise UltracamError('Uhead.add_entry: key = ' + key +
@@ -166,7 +191,7 @@ class Uhead(Odict):
             if not isinstance(value, np.ndarray) or len(value.shape) != 1:
                 raise UltracamError('Uhead.add_entry: key = ' + key +
                                 ': require a 1D numpy.ndarray for ITYPE_FVECTOR)')
-            value = value.astype(float32)
+            value = value.astype(np.float32)
         else:
             raise UltracamError('Uhead.add_entry: key = ' + key +
                             ': itype = ' + str(itype) + ' not recognised.')
@@ -177,6 +202,60 @@ class Uhead(Odict):
         else:
             Odict.__setitem__(self, key, (value, itype, comment))
 
+    def copy(self):
+        "Returns a copy of the header"
+        head = Uhead()
+        for key in self._keys:
+            Odict.__setitem__(head, key, dict.__getitem__(self, key))
+        return head
+
+    def __reduce__(self):
+        # pickle as the ordered items, since __setitem__ is disabled
+        return (_unpickle_uhead, ([(key, dict.__getitem__(self, key)) for key in self._keys],))
+
+    def pack(self, prefixes=None):
+        """
+        Returns the header serialised as in a ucm file, i.e. the number of
+        items followed by the key, type, comment and value of each one. The
+        bytes are kept and returned directly until the header is next changed.
+
+        prefixes -- dictionary in which to keep the serialised key, type and
+                    comment of each item, keyed on all three. Passing the same
+                    dictionary for a series of headers with the same items
+                    but differing values saves repeating this part of the work
+                    (see UcmWriter).
+        """
+        if self._packed is not None and self._packed[0] == self._stamp:
+            return self._packed[1]
+
+        parts = [PACK_INT.pack(len(self))]
+        for key in self._keys:
+            value, itype, comment = dict.__getitem__(self, key)
+
+            if prefixes is None:
+                parts.append(pack_string(key) + PACK_INT.pack(itype) + pack_string(comment))
+            else:
+                pkey = (key, itype, comment)
+                if pkey not in prefixes:
+                    prefixes[pkey] = pack_string(key) + PACK_INT.pack(itype) + pack_string(comment)
+                parts.append(prefixes[pkey])
+
+            if itype in PACK_ITYPE:
+                parts.append(PACK_ITYPE[itype].pack(value))
+            elif itype == ITYPE_STRING:
+                parts.append(pack_string(value))
+            elif itype == ITYPE_DIR:
+                pass
+            elif itype == ITYPE_TIME:
+                parts.append(struct.pack('=id', value[0], value[1]))
+            elif itype in PACK_VTYPE:
+                parts.append(struct.pack('=i' + str(len(value)) + PACK_VTYPE[itype], len(value), *value))
+            else:
+                raise UltracamError('Uhead.pack: type = ' + str(itype) + ' not recognised')
+
+        self._packed = (self._stamp, b''.join(parts))
+        return self._packed[1]
+
     def value(self, key):
         "Returns the value associated with a given key"
         return self[key][0]
@@ -203,6 +282,12 @@ class Uhead(Odict):
                     (final,str(val[0]),'/'+TNAME[val[1]]+'/',val[2])
         return ret
 
+def _unpickle_uhead(items):
+    head = Uhead()
+    for key, val in items:
+        Odict.__setitem__(head, key, val)
+    return head
+
 if __name__ == '__main__':
     uhead = Uhead()
     uhead.add_entry('User','User information')
@@ -4,8 +4,11 @@ A few general utility functions
 from __future__ import absolute_import
 from __future__ import print_function
 
+import os
 import struct
 import datetime
+import threading
+from multiprocessing.pool import ThreadPool
 try:
     import numpy as np
 except ImportError:
@@ -27,6 +30,80 @@ def write_string(fobj, strng):
     nchar = len(strng)
     fobj.write(struct.pack('i' + str(nchar) + 's',nchar, strng.encode('utf-8')))
 
+def write_buffers(fname, buffs):
+    """
+    Writes a list of buffers (bytes, contiguous numpy arrays etc) to a file,
+    with a single vectored write where the operating system supports it.
+
+    fname  -- name of file to write to (overwritten if it exists), or an
+              unbuffered file object opened for binary output, in which case
+              the buffers are written at its current position.
+    buffs  -- list of objects supporting the buffer protocol
+    """
+    if not hasattr(fname, 'fileno'):
+        with open(fname, 'wb', 0) as fobj:
+            write_buffers(fobj, buffs)
+        return
+
+    fobj = fname
+    if hasattr(os, 'writev'):
+        views = [memoryview(buff).cast('B') for buff in buffs]
+        try:
+            iovmax = os.sysconf('SC_IOV_MAX')
+        except (ValueError, OSError, AttributeError):
+            iovmax = 1024
+        nv = 0
+        while nv < len(views):
+            nbytes = os.writev(fobj.fileno(), views[nv:nv+iovmax])
+            # skip what was written; writes can be partial
+            while nv < len(views) and nbytes >= len(views[nv]):
+                nbytes -= len(views[nv])
+                nv += 1
+            if nbytes:
+                views[nv] = views[nv][nbytes:]
+    else:
+        for buff in buffs:
+            fobj.write(buff)
+
+# thread pools kept for re-use, keyed by their number of threads
+THREAD_POOLS = {}
+_POOL_LOCK   = threading.Lock()
+
+def thread_pool(nthreads):
+    """
+    Returns a pool of nthreads threads (multiprocessing.pool.ThreadPool),
+    created on first request and then kept and shared by all callers asking
+    for the same number, so that the threads are not started and stopped
+    for each frame. Tasks run in the pool must not themselves wait on tasks
+    in the same pool.
+    """
+    with _POOL_LOCK:
+        try:
+            return THREAD_POOLS[nthreads]
+        except KeyError:
+            pool = THREAD_POOLS[nthreads] = ThreadPool(nthreads)
+            return pool
+
+def set_dict_state(obj, state):
+    """
+    Restores an object of a class with __slots__ from pickles made when the
+    class had a per-instance __dict__, whose state is a dictionary of the
+    attributes or, from classes with both, a (dict or None, slot dict) pair.
+    The attributes are set by name. Returns True if state was of this form,
+    False otherwise, in which case nothing is done.
+    """
+    if isinstance(state, dict):
+        attrs = state
+    elif isinstance(state, tuple) and len(state) == 2 and isinstance(state[1], dict) and \
+            (state[0] is None or isinstance(state[0], dict)):
+        attrs = dict(state[0] or {})
+        attrs.update(state[1])
+    else:
+        return False
+    for key, value in attrs.items():
+        setattr(obj, key, value)
+    return True
+
 def read_string(fobj, endian=''):
     """
     Reads a string written in binary format by my C++ code
@@ -22,7 +22,37 @@ try:
 except ImportError:
     print('Failed to import ppgplot; plotting based on it will fail')
 
+from trm.ultracam.Utils import set_dict_state
 from trm.ultracam.UErrors import UltracamError
+from trm.ultracam.Stats import Hstats
+
+def hist_ok(wins):
+    """
+    Returns True if the data of a sequence of Windows are all unsigned
+    integers of at most 2 bytes, for which histogram-based statistics (see
+    Stats.py) are exact and faster than sorting.
+    """
+    for win in wins:
+        if win.dtype.kind != 'u' or win.dtype.itemsize > 2:
+            return False
+    return len(wins) > 0
+
+def crop_slices(sfsig, tfsig):
+    """
+    Returns the (y, x) slices which crop the data of a Window of format
+    signature sfsig to the format tfsig (see Window.fsig), or None if this
+    is not possible because the binning factors differ, the pixels are out of
+    step, or the target is not enclosed.
+    """
+    sllx, slly, snx, sny, xbin, ybin = sfsig
+    llx, lly, nx, ny, txbin, tybin = tfsig
+    if xbin != txbin or ybin != tybin or sllx > llx or slly > lly or \
+            sllx + xbin*snx < llx + xbin*nx or slly + ybin*sny < lly + ybin*ny or \
+            (sllx - llx) % xbin != 0 or (slly - lly) % ybin != 0:
+        return None
+    x1 = (llx-sllx) // xbin
+    y1 = (lly-slly) // ybin
+    return (slice(y1,y1+ny), slice(x1,x1+nx))
 
 class Window(object):
     """
@@ -43,6 +73,9 @@ class Window(object):
     with the last printing out the data values with the outer edge removed.
     """
 
+    # many Windows are made per frame, so no per-instance __dict__
+    __slots__ = ('_data', 'llx', 'lly', 'xbin', 'ybin')
+
     def __init__(self, data, llx, lly, xbin, ybin):
         """
         Creates  a Window given some data, a lower-left
@@ -62,6 +95,13 @@ class Window(object):
         self.xbin = xbin
         self.ybin = ybin
 
+    def __getstate__(self):
+        return (self._data, self.llx, self.lly, self.xbin, self.ybin)
+
+    def __setstate__(self, state):
+        if not set_dict_state(self, state):
+            self._data, self.llx, self.lly, self.xbin, self.ybin = state
+
     def __repr__(self):
         rep = 'Window(data=' + repr(self._data) + ', llx=' + \
             repr(self.llx) + ', lly=' + repr(self.lly) + \
@@ -110,17 +150,18 @@ class Window(object):
         """
         return self._data.size
 
-    def astype(self, dtype):
+    def astype(self, dtype, copy=True):
         """
         Returns the data as a numpy.ndarray with data type = dtype, (e.g. np.uint16) 
-        rounding if converting from a non-integer to an integer type
+        rounding if converting from a non-integer to an integer type. If copy=False
+        the data themselves are returned when they already have the right type.
         """
         if issubclass(dtype, np.integer) and issubclass(self._data.dtype.type,np.integer):
-            return self._data.astype(dtype)
+            return self._data.astype(dtype, copy=copy)
         elif issubclass(dtype, np.integer):
-            return np.rint(self._data).astype(dtype)
+            return np.rint(self._data).astype(dtype, copy=False)
         else:
-            return self._data.astype(dtype)
+            return self._data.astype(dtype, copy=copy)
 
     def totype(self, dtype):
         """
@@ -154,8 +195,11 @@ class Window(object):
 
     def median(self):
         """
-        Returns the median value of the Window
+        Returns the median value of the Window, computed from a histogram for
+        raw unsigned 2-byte data.
         """
+        if hist_ok((self,)):
+            return Hstats(self._data).median()
         return np.median(self._data)
 
     def flatten(self):
@@ -170,6 +214,15 @@ class Window(object):
         """
         return self._data.sum()
 
+    @property
+    def fsig(self):
+        """
+        Format signature of the Window, the tuple (llx, lly, nx, ny, xbin,
+        ybin). Signatures are hashable and equal for Windows of the same format.
+        """
+        ny, nx = self._data.shape
+        return (self.llx, self.lly, nx, ny, self.xbin, self.ybin)
+
     def canCropTo(self, other):
         """
         Determines whether the Window has the correct format to be 
@@ -177,13 +230,7 @@ class Window(object):
         has to equal or exceed 'other' in area, have the same binning
         factors, and its pixels must be in step.
         """
-
-        return (self.xbin == other.xbin and self.ybin == other.ybin and
-                self.llx <= other.llx and self.lly <= other.lly and 
-                self.llx + self.xbin*self.nx >= other.llx + other.xbin*other.nx and
-                self.lly + self.ybin*self.ny >= other.lly + other.ybin*other.ny and
-                (self.llx - other.llx) % self.xbin == 0 and
-                (self.lly - other.lly) % self.ybin == 0)
+        return crop_slices(self.fsig, other.fsig) is not None
 
     def cropTo(self, other):
         """
@@ -195,14 +242,10 @@ class Window(object):
 
         other -- the Window to crop to.
         """
-        if self.canCropTo(other):
-            x1 = (other.llx-self.llx) // self.xbin
-            x2 = x1 + other.nx
-            y1 = (other.lly-self.lly) // self.ybin
-            y2 = y1 + other.ny
-            return Window(self._data[y1:y2,x1:x2], other.llx, other.lly, other.xbin, other.ybin)
-        else:
+        slices = crop_slices(self.fsig, other.fsig)
+        if slices is None:
             raise UltracamError('Window.cropTo: Window cannot be cropped to "other"') 
+        return Window(self._data[slices], other.llx, other.lly, other.xbin, other.ybin)
 
     def trim(self, nleft, nright, nbottom, ntop):
         """
@@ -277,9 +320,7 @@ class Window(object):
         Tests quality of two Windows. True if the binned dimensions,
         binning factors and lower-left pixels all match.
         """
-        return (self.llx == other.llx and self.lly == other.lly and 
-                self.xbin == other.xbin and self.ybin == other.ybin and
-                self.nx == other.nx and self.ny == other.ny)
+        return self.fsig == other.fsig
 
     def __ne__(self, other):
         """
@@ -0,0 +1,329 @@
+"""
+Lossless compressed storage of raw runs.
+
+A run's .dat file can be replaced by a compressed .zdat file, which Rdata and
+Rtime read transparently if there is no .dat file (see open_dat in Raw.py).
+The data of each frame are compressed separately, after filtering to make
+them more compressible: each pixel is replaced by its difference from the
+pixel 'lag' values earlier in the frame (6 for ULTRACAM, whose windows are
+interleaved, 1 otherwise), and the bytes are then shuffled so that all the
+low bytes come before all the high ones. The timing bytes of all frames are
+stored uncompressed in a table at the end of the file along with the offset
+of each frame, so times can be read without decompressing anything and any
+frame can be located directly. The layout is::
+
+  4s     b'UZDT'
+  int32  version, framesize, headerwords, codec (0 zlib, 1 lzma), lag
+  ...    compressed frame data
+  int64  offset, int32 size, of each compressed frame
+  ...    timing bytes of each frame
+  int64  offset of the table, int64 number of frames
+  4s     b'UZDT'
+
+all in little-endian byte order. Frames are decompressed in a pool of
+threads shared by all readers (size set by ULTRACAM_ZDAT_THREADS, default
+4), several frames ahead of the one being read when reading sequentially.
+Both zlib and lzma release the GIL, so this runs in parallel.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import zlib
+import struct
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import numpy as np
+except ImportError:
+    print('Failed to import numpy; some routines will fail')
+
+from trm.ultracam.UErrors import UltracamError
+
+ZDAT_MAGIC   = b'UZDT'
+ZDAT_VERSION = 1
+ZDAT_ZLIB    = 0
+ZDAT_LZMA    = 1
+ZDAT_CODECS  = {'zlib' : ZDAT_ZLIB, 'lzma' : ZDAT_LZMA}
+
+ZDAT_HEAD    = struct.Struct('<4s5i')
+ZDAT_TRAIL   = struct.Struct('<qq4s')
+ZDAT_INDEX   = np.dtype([('offset', '<i8'), ('size', '<i4')])
+
+# decompression threads, shared by all ZdatFiles and started when first needed
+ZDAT_THREADS = int(os.environ.get('ULTRACAM_ZDAT_THREADS', '4'))
+_POOL        = []
+_POOL_LOCK   = threading.Lock()
+
+def zdat_pool():
+    """
+    Returns the thread pool used for decompression.
+    """
+    with _POOL_LOCK:
+        if not _POOL:
+            _POOL.append(ThreadPool(ZDAT_THREADS))
+        return _POOL[0]
+
+def zfilter(data, lag):
+    """
+    Returns the bytes of an array of unsigned 2-byte ints after
+    differencing with lag 'lag' and byte shuffling. See zunfilter.
+    """
+    diff = data.astype('<u2')
+    diff[lag:] -= data[:-lag]
+    return diff.view(np.uint8).reshape((-1,2)).T.tobytes()
+
+def zunfilter(buff, lag):
+    """
+    Inverse of zfilter, returning the array of unsigned 2-byte ints.
+    """
+    diff = np.frombuffer(buff, np.uint8).reshape((2,-1)).T.copy().view('<u2').ravel()
+    npad = (-len(diff)) % lag
+    if npad:
+        diff = np.concatenate((diff, np.zeros(npad, '<u2')))
+    data = np.cumsum(diff.reshape((-1,lag)), axis=0, dtype='<u2').ravel()
+    return data[:len(data)-npad] if npad else data
+
+def _compress(frame, hbytes, codec, level, lag):
+    # compressed data of a frame
+    buff = zfilter(np.frombuffer(frame, '<u2', offset=hbytes), lag)
+    if codec == ZDAT_LZMA:
+        return lzma.compress(buff, preset=level)
+    return zlib.compress(buff, level)
+
+def write_zdat(rhead, fname=None, codec='zlib', level=6, nthreads=4):
+    """
+    Compresses the .dat file of a run to a .zdat file, returning the number
+    of frames written. Any incomplete frame at the end of the run is dropped.
+
+    rhead    -- Rhead of the run (local disk only)
+
+    fname    -- name of the file to write. Defaults to the run name + '.zdat'
+
+    codec    -- 'zlib' or 'lzma' (slower, but tighter)
+
+    level    -- compression level, 0-9
+
+    nthreads -- number of frames to compress in parallel
+    """
+    if codec not in ZDAT_CODECS:
+        raise UltracamError('write_zdat: codec = ' + str(codec) + ' not recognised')
+    if codec == 'lzma' and lzma is None:
+        raise UltracamError('write_zdat: lzma is not available')
+    icodec = ZDAT_CODECS[codec]
+
+    framesize = rhead.framesize
+    hbytes    = 2*rhead.headerwords
+    lag       = 6 if rhead.instrument == 'ULTRACAM' else 1
+    if fname is None:
+        fname = rhead.run + '.zdat'
+
+    def frames(fin):
+        while True:
+            frame = fin.read(framesize)
+            if len(frame) < framesize:
+                break
+            yield frame
+
+    index  = []
+    tbytes = []
+    pool   = ThreadPool(nthreads)
+    try:
+        with open(rhead.run + '.dat', 'rb') as fin, open(fname, 'wb') as fout:
+            fout.write(ZDAT_HEAD.pack(ZDAT_MAGIC, ZDAT_VERSION, framesize, rhead.headerwords,
+                                      icodec, lag))
+            offset = ZDAT_HEAD.size
+
+            # frames are compressed in parallel but written in order
+            def compress(frame):
+                return (frame[:hbytes], _compress(frame, hbytes, icodec, level, lag))
+
+            for tbyte, cbuff in pool.imap(compress, frames(fin), 4):
+                fout.write(cbuff)
+                index.append((offset, len(cbuff)))
+                tbytes.append(tbyte)
+                offset += len(cbuff)
+
+            fout.write(np.array(index, ZDAT_INDEX).tobytes())
+            fout.write(b''.join(tbytes))
+            fout.write(ZDAT_TRAIL.pack(offset, len(index), ZDAT_MAGIC))
+    finally:
+        pool.close()
+        pool.join()
+
+    return len(index)
+
+class ZdatFile(object):
+    """
+    Read-only, seekable file-like object which presents a .zdat file as the
+    .dat file it was made from. It supports read, readinto, seek and tell,
+    which is all that Rdata and Rtime need. Timing bytes are served directly
+    from the table at the end of the file; frame data are decompressed when
+    first read, with the following frames decompressed in the background.
+
+    Attributes:
+
+      framesize   -- bytes per frame
+      headerwords -- number of 2-byte timing words per frame
+      nframe      -- number of frames
+      ndecomp     -- number of frames decompressed so far
+    """
+
+    def __init__(self, fname, threads=True, nahead=None):
+        """
+        fname    -- the .zdat file
+
+        threads  -- True to decompress in the shared thread pool (see
+                    zdat_pool), False to decompress frames as needed in the
+                    calling thread.
+
+        nahead   -- number of frames to decompress ahead of the one being
+                    read. Defaults to twice the number of threads.
+        """
+        self.name    = fname
+        self._fobj   = open(fname, 'rb')
+        self._lock   = threading.Lock()
+        head = self._fobj.read(ZDAT_HEAD.size)
+        try:
+            magic, version, self.framesize, self.headerwords, self.codec, self.lag = \
+                ZDAT_HEAD.unpack(head)
+            self._fobj.seek(-ZDAT_TRAIL.size, 2)
+            toffset, self.nframe, tmagic = ZDAT_TRAIL.unpack(self._fobj.read(ZDAT_TRAIL.size))
+        except (struct.error, IOError, OSError):
+            raise UltracamError('ZdatFile: ' + fname + ' is not a complete .zdat file')
+        if magic != ZDAT_MAGIC or tmagic != ZDAT_MAGIC:
+            raise UltracamError('ZdatFile: ' + fname + ' is not a .zdat file')
+        if version != ZDAT_VERSION:
+            raise UltracamError('ZdatFile: version = ' + str(version) + ' of ' + fname + ' not recognised')
+        if self.codec == ZDAT_LZMA and lzma is None:
+            raise UltracamError('ZdatFile: ' + fname + ' needs lzma which is not available')
+
+        hbytes = 2*self.headerwords
+        self._fobj.seek(toffset)
+        self._index  = np.frombuffer(self._fobj.read(ZDAT_INDEX.itemsize*self.nframe), ZDAT_INDEX)
+        self._tbytes = self._fobj.read(hbytes*self.nframe)
+        if len(self._index) != self.nframe or len(self._tbytes) != hbytes*self.nframe:
+            raise UltracamError('ZdatFile: failed to read the index of ' + fname)
+
+        self.ndecomp = 0
+        self.closed  = False
+        self._pos    = 0
+        self._nahead = 2*ZDAT_THREADS if nahead is None else nahead
+        self._pool   = zdat_pool() if threads and ZDAT_THREADS > 0 else None
+        self._frames = collections.OrderedDict()
+
+    def _decompress(self, nf):
+        # decompressed data of frame nf (from 0), as bytes
+        offset, size = self._index[nf]
+        with self._lock:
+            self._fobj.seek(offset)
+            cbuff = self._fobj.read(size)
+        buff = lzma.decompress(cbuff) if self.codec == ZDAT_LZMA else zlib.decompress(cbuff)
+        self.ndecomp += 1
+        return zunfilter(buff, self.lag).tobytes()
+
+    def _frame(self, nf):
+        """
+        Returns the data of frame nf (from 0), starting decompression of the
+        following frames if there is a thread pool.
+        """
+        if self._pool is None:
+            if nf not in self._frames:
+                self._frames[nf] = self._decompress(nf)
+                if len(self._frames) > 2:
+                    self._frames.popitem(last=False)
+            return self._frames[nf]
+
+        for n in range(nf, min(nf+self._nahead+1, self.nframe)):
+            if n not in self._frames:
+                self._frames[n] = self._pool.apply_async(self._decompress, (n,))
+        result = self._frames[nf]
+
+        # drop frames no longer needed, oldest first
+        while len(self._frames) > 2*self._nahead+2:
+            self._frames.popitem(last=False)
+        return result.get()
+
+    def size(self):
+        """
+        Size of the equivalent .dat file
+        """
+        return self.nframe*self.framesize
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        elif whence == 2:
+            self._pos = self.size() + offset
+        else:
+            raise UltracamError('ZdatFile.seek: whence = ' + str(whence) + ' not recognised')
+        if self._pos < 0:
+            self._pos = 0
+            raise IOError('ZdatFile.seek: attempt to seek before start of file')
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, nbytes=-1):
+        """
+        Reads up to nbytes bytes from the current position, fewer if the end of
+        the file is reached. nbytes < 0 reads to the end of the file.
+        """
+        if nbytes < 0:
+            nbytes = max(0, self.size() - self._pos)
+        nbytes = min(nbytes, max(0, self.size() - self._pos))
+
+        hbytes = 2*self.headerwords
+        parts  = []
+        while nbytes > 0:
+            nf, start = divmod(self._pos, self.framesize)
+            if start < hbytes:
+                # timing bytes, no decompression needed
+                part = self._tbytes[nf*hbytes+start:(nf+1)*hbytes][:nbytes]
+            else:
+                part = self._frame(nf)[start-hbytes:start-hbytes+nbytes]
+            parts.append(part)
+            self._pos += len(part)
+            nbytes    -= len(part)
+
+        return parts[0] if len(parts) == 1 else b''.join(parts)
+
+    def readinto(self, buff):
+        """
+        Reads into a pre-allocated, writable buffer, returning the number of
+        bytes read.
+        """
+        mv   = memoryview(buff)
+        if mv.ndim != 1 or mv.itemsize != 1:
+            raise UltracamError('ZdatFile.readinto: buffer must be 1D and of bytes')
+        data = self.read(len(mv))
+        mv[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._pool = None
+        self._frames.clear()
+        self._fobj.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+if __name__ == '__main__':
+    data = (1000 + np.arange(600) % 17).astype('<u2')
+    for lag in (1, 6, 7):
+        assert (zunfilter(zfilter(data, lag), lag) == data).all()
+    print('test passed')
@@ -14,7 +14,11 @@ from __future__ import absolute_import
 
 from .Constants import *
 from .Utils import *
+from .Stats import *
 from .Server import *
+from .Range import *
+from .Zdat import *
+from .Cdat import *
 from .Odict import *
 from .Window import *
 from .Time import *
@@ -22,13 +26,26 @@ from .Uhead import *
 from .CCD import *
 from .MCCD import *
 from .Raw import *
+from .Calib import *
+from .Shared import *
+from .RunArray import *
+from .Tseries import *
+from .Mucm import *
+from .Combine import *
+from .Follow import *
 from .Log import *
 from .UErrors import *
 
 # list of classes and members to document at top level
 
-__all__ = ['str2mjd', 'mjd2str', 'runID', 'blevs', \
+__all__ = ['str2mjd', 'mjd2str', 'runID', 'blevs', 'thread_pool', \
                'get_nframe_from_server', 'get_runs_from_server', \
-               'Odict', 'Window', 'Time', 'Uhead', 'CCD', 'MCCD', \
-               'UCAM', 'Rwin', 'Rdata', 'Rhead', 'utimer', 'Log', \
+               'get_frame_from_server', 'FrameCache', 'RunList', 'Runinfo', \
+               'RangeFile', 'is_url', 'ZdatFile', 'write_zdat', 'CdatFile', 'dat_exists', \
+               'Hstats', 'RunningStats', 'Odict', 'Window', 'Time', 'Uhead', 'CCD', 'MCCD', 'crop_plan', \
+               'UCAM', 'UcmWriter', 'Mucm', 'MucmWriter', 'Rwin', 'Rdata', 'Rfile', 'Rhead', 'Tstate', 'utimer', 'Log', \
+               'Calib', 'ShmFrame', 'RingWriter', 'RingReader', 'RunArray', 'WinArray', \
+               'write_tseries', 'Tseries', \
+               'combine', 'reduce_stack', \
+               'follow', 'complete_frames', 'local_runs', \
                'UltracamError', 'UendError', 'PowerOnOffError', 'ccd2fits']